@@ -0,0 +1,426 @@
+"""
+Load test for bot.py against a local stand-in for the Telegram Bot API.
+
+The real Application from bot.build_application() long-polls a fake Bot API
+server (getUpdates, sendMessage, editMessageText and friends) that can add
+latency and answer with 429s. Simulated players go through /start and the
+profile conversation, and simulated admins go through the tournament
+wizard. Each step is timed from the moment the update is queued until the
+bot's reply reaches the fake API.
+
+    python bench.py                              # 1000 players, 10 admins
+    python bench.py --users 5000 --concurrency 500 --latency-ms 40 --rate-429 0.01
+    python bench.py --save-baseline              # write bench_baseline.json
+    python bench.py --compare                    # exit 1 on a regression vs the baseline
+
+A baseline only means something on the machine and settings that produced it.
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from urllib.parse import parse_qsl
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+BOT_TOKEN = "123456:BENCH"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "OTO Bench", "username": "oto_bench_bot"}
+ADMIN_ID_BASE = 900_000_000
+PLAYER_ID_BASE = 100_000_000
+
+bot = None  # imported in main() once the environment points it at a scratch database
+
+# ------------------- FAKE BOT API -------------------
+class FakeBotAPI:
+    """
+    Just enough of the Bot API for the bot to run: updates are fed through
+    getUpdates, and every sendMessage/editMessageText is matched against the
+    simulated user waiting on that chat.
+    """
+
+    def __init__(self, latency, jitter, rate_429, retry_after):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.updates = asyncio.Queue()
+        self.waiters = {}
+        self.calls = Counter()
+        self.injected_429 = Counter()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def app(self):
+        return Starlette(routes=[Route("/bot{token}/{method}", self.handle, methods=["GET", "POST"])])
+
+    async def handle(self, request: Request):
+        method = request.path_params["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        if method in ("sendMessage", "editMessageText") and random.random() < self.rate_429:
+            self.injected_429[method] += 1
+            return JSONResponse({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status_code=429)
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in ("sendMessage", "editMessageText") and "chat_id" in params:
+            chat_id = int(params["chat_id"])
+            self._deliver(chat_id, params.get("text", ""))
+            return self._ok(self._message(chat_id, params.get("text", ""), BOT_USER))
+        return self._ok(True)
+
+    @staticmethod
+    async def _params(request):
+        # PTB posts url-encoded fields whose non-string values are JSON encoded
+        # (parsed by hand: Starlette's form() needs python-multipart)
+        raw = dict(request.query_params)
+        raw.update(parse_qsl((await request.body()).decode()))
+        params = {}
+        for key, value in raw.items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    @staticmethod
+    def _ok(result):
+        return JSONResponse({"ok": True, "result": result})
+
+    def _message(self, chat_id, text, sender):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": sender,
+            "text": text,
+        }
+
+    async def _get_updates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout) if timeout else self.updates.get_nowait()
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            return []
+        batch = [first]
+        while len(batch) < limit and not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def _deliver(self, chat_id, text):
+        waiter = self.waiters.get(chat_id)
+        if waiter and not waiter[1].done() and (waiter[0] is None or waiter[0] in text):
+            waiter[1].set_result(time.perf_counter())
+
+    async def exchange(self, chat_id, update, expect, timeout):
+        """Queue an update and wait for the bot's reply containing expect. Returns the latency or None."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = (expect, future)
+        update["update_id"] = next(self._update_ids)
+        started = time.perf_counter()
+        await self.updates.put(update)
+        try:
+            return await asyncio.wait_for(future, timeout) - started
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.waiters.pop(chat_id, None)
+
+    def message_update(self, user_id, text):
+        user = {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"}
+        message = self._message(user_id, text, user)
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": message}
+
+    def callback_update(self, user_id, data):
+        user = {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}"}
+        return {"callback_query": {
+            "id": str(next(self._message_ids)),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": self._message(user_id, "Main Menu:", BOT_USER),
+        }}
+
+# ------------------- SCENARIOS -------------------
+def _letters(number):
+    return "".join(chr(ord("a") + int(digit)) for digit in str(number))
+
+def player_steps(api, user_id):
+    return [
+        ("start", api.message_update(user_id, "/start"), "Welcome"),
+        ("create_profile", api.callback_update(user_id, "create_profile"), "Create your profile"),
+        ("ask_game_id", api.message_update(user_id, f"Bench {_letters(user_id).title()}"), "Game ID"),
+        ("ask_level", api.message_update(user_id, f"gid_{user_id}"), "Level"),
+        ("ask_state", api.message_update(user_id, str(random.randint(1, 80))), "State"),
+        ("save_profile", api.message_update(user_id, random.choice(["Maharashtra", "Goa", "Kerala", "Delhi"])), "all set"),
+    ]
+
+def admin_steps(api, user_id, n):
+    when = (date.today() + timedelta(days=7 + n % 30)).isoformat()
+    return [
+        ("admin_create_tournament_start", api.callback_update(user_id, "admin_create_tournament"), None),
+        ("admin_ask_game_type", api.message_update(user_id, f"Bench Cup {n}"), "Select game type"),
+        ("admin_handle_game_type", api.callback_update(user_id, "game_bgmi"), "Select map"),
+        ("admin_handle_map", api.callback_update(user_id, "map_erangel"), "Select game mode"),
+        ("admin_handle_game_mode", api.callback_update(user_id, "mode_squad"), "tournament date"),
+        ("admin_ask_time", api.message_update(user_id, when), "tournament time"),
+        ("admin_ask_entry_fee", api.message_update(user_id, "18:30"), "entry fee"),
+        ("admin_ask_prize", api.message_update(user_id, "10"), "prize pool"),
+        ("admin_save_tournament", api.message_update(user_id, "500"), "Created Successfully"),
+    ]
+
+async def run_scenario(api, user_id, steps, results, timeout):
+    for kind, update, expect in steps:
+        latency = await api.exchange(user_id, update, expect, timeout)
+        if latency is None:
+            results["failures"][kind] += 1
+            return
+        results["latency"][kind].append(latency)
+
+# ------------------- REPORT -------------------
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def histogram_quantile(counts, q):
+    """Upper bound of the bucket holding quantile q (inf if it's in the +Inf bucket)."""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank, cumulative = q * total, 0
+    for bound, count in zip(bot.LATENCY_BUCKETS + (float("inf"),), counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return float("inf")
+
+def summarize(args, driven):
+    wall = driven["wall"]
+    failures = Counter(driven["failures"])
+    all_latencies = [v for values in driven["latency"].values() for v in values]
+    steps = {
+        kind: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            "failures": failures[kind],
+        }
+        for kind, values in driven["latency"].items()
+    }
+    for kind, count in failures.items():
+        steps.setdefault(kind, {"count": 0, "p50_ms": 0.0, "p99_ms": 0.0, "failures": count})
+    db_wait = {
+        pool: {
+            "calls": sum(counts),
+            "mean_ms": round(total / sum(counts) * 1000, 3) if sum(counts) else 0.0,
+            "p99_ms_bucket": histogram_quantile(counts, 0.99) * 1000,
+        }
+        for pool, (counts, total) in bot.DB_WAIT_SECONDS.snapshot().items()
+    }
+    db_helpers = sorted(
+        ((helper, sum(counts), total) for helper, (counts, total) in bot.DB_SECONDS.snapshot().items()),
+        key=lambda item: item[2], reverse=True
+    )
+    return {
+        "config": {
+            "users": args.users, "admins": args.admins, "tournaments_per_admin": args.tournaments_per_admin,
+            "concurrency": args.concurrency, "latency_ms": args.latency_ms, "rate_429": args.rate_429,
+        },
+        "wall_seconds": round(wall, 3),
+        "steps_completed": len(all_latencies),
+        "steps_per_second": round(len(all_latencies) / wall, 1) if wall else 0.0,
+        "failures": sum(failures.values()),
+        "latency_ms": {
+            "p50": round(percentile(all_latencies, 0.5) * 1000, 2),
+            "p99": round(percentile(all_latencies, 0.99) * 1000, 2),
+        },
+        "steps": steps,
+        "db_wait": db_wait,
+        "db_helpers": {
+            helper: {"calls": calls, "total_ms": round(total * 1000, 1), "mean_ms": round(total / calls * 1000, 3)}
+            for helper, calls, total in db_helpers[:8]
+        },
+        "api_calls": driven["api_calls"],
+        "injected_429": driven["injected_429"],
+    }
+
+def print_report(summary):
+    print(f"\n{summary['steps_completed']} steps in {summary['wall_seconds']}s "
+          f"-> {summary['steps_per_second']} steps/s, {summary['failures']} failed")
+    print(f"latency p50 {summary['latency_ms']['p50']} ms, p99 {summary['latency_ms']['p99']} ms\n")
+    print(f"{'step':<32}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'failed':>8}")
+    for kind, stats in summary["steps"].items():
+        print(f"{kind:<32}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['failures']:>8}")
+    print(f"\n{'db pool wait':<32}{'calls':>8}{'mean ms':>10}{'p99 <= ms':>10}")
+    for pool, stats in sorted(summary["db_wait"].items()):
+        print(f"{pool:<32}{stats['calls']:>8}{stats['mean_ms']:>10}{stats['p99_ms_bucket']:>10}")
+    print(f"\n{'db helper':<32}{'calls':>8}{'mean ms':>10}{'total ms':>10}")
+    for helper, stats in summary["db_helpers"].items():
+        print(f"{helper:<32}{stats['calls']:>8}{stats['mean_ms']:>10}{stats['total_ms']:>10}")
+    print(f"\nBot API calls: {summary['api_calls']}")
+    if summary["injected_429"]:
+        print(f"Injected 429s: {summary['injected_429']}")
+
+def compare(summary, baseline, tolerance):
+    """Human-readable regressions of summary against baseline (empty if none)."""
+    problems = []
+    if baseline["config"] != summary["config"]:
+        problems.append(f"config differs from baseline: {baseline['config']}")
+        return problems
+    if summary["steps_per_second"] < baseline["steps_per_second"] * (1 - tolerance):
+        problems.append(f"throughput {summary['steps_per_second']} steps/s < baseline {baseline['steps_per_second']}")
+    for q in ("p50", "p99"):
+        if summary["latency_ms"][q] > baseline["latency_ms"][q] * (1 + tolerance):
+            problems.append(f"{q} {summary['latency_ms'][q]} ms > baseline {baseline['latency_ms'][q]} ms")
+    if summary["failures"] > baseline["failures"]:
+        problems.append(f"{summary['failures']} failed steps > baseline {baseline['failures']}")
+    return problems
+
+# ------------------- MAIN -------------------
+# The fake API and the simulated users run in a child process, so the bot's
+# event loop (the thing being measured) doesn't also pay for the load generator.
+async def drive(args, pipe):
+    random.seed(args.seed)
+    loop = asyncio.get_running_loop()
+    api = FakeBotAPI(args.latency_ms / 1000, args.jitter, args.rate_429, args.retry_after)
+    server = uvicorn.Server(uvicorn.Config(api.app(), host="127.0.0.1", port=args.port, log_level="warning", lifespan="off"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    pipe.send("listening")
+    await loop.run_in_executor(None, pipe.recv)  # bot is polling
+
+    results = {"latency": defaultdict(list), "failures": Counter()}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id, steps):
+        async with semaphore:
+            await run_scenario(api, user_id, steps, results, args.timeout)
+
+    async def admin(user_id):
+        for n in range(args.tournaments_per_admin):
+            await limited(user_id, admin_steps(api, user_id, user_id * 1000 + n))
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(limited(PLAYER_ID_BASE + i, player_steps(api, PLAYER_ID_BASE + i)) for i in range(args.users)),
+        *(admin(ADMIN_ID_BASE + i) for i in range(args.admins)),
+    )
+    wall = time.perf_counter() - started
+    pipe.send({
+        "latency": dict(results["latency"]), "failures": dict(results["failures"]), "wall": wall,
+        "api_calls": dict(api.calls), "injected_429": dict(api.injected_429),
+    })
+    await loop.run_in_executor(None, pipe.recv)  # bot has stopped polling
+    server.should_exit = True
+    await server_task
+
+def drive_process(args, pipe):
+    asyncio.run(drive(args, pipe))
+
+async def run(args, pipe):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, pipe.recv)  # fake API is listening
+    bot.init_db()
+    application = bot.build_application(BOT_TOKEN, base_url=f"http://127.0.0.1:{args.port}/bot")
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0.0, timeout=1, allowed_updates=bot.Update.ALL_TYPES)
+    await application.start()
+    pipe.send("polling")
+    driven = await loop.run_in_executor(None, pipe.recv)
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    pipe.send("stopped")
+    return summarize(args, driven)
+
+def main():
+    global bot
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="simulated players creating a profile")
+    parser.add_argument("--admins", type=int, default=10, help="simulated admins running the tournament wizard")
+    parser.add_argument("--tournaments-per-admin", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=200, help="scenarios in flight at once")
+    parser.add_argument("--latency-ms", type=float, default=20, help="added to every Bot API call except getUpdates")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by +/- this fraction")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=15, help="seconds to wait for each reply")
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-baseline", nargs="?", const=BASELINE_PATH, metavar="PATH")
+    parser.add_argument("--compare", nargs="?", const=BASELINE_PATH, metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression vs the baseline")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own logging")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    scratch = tempfile.mkdtemp(prefix="oto-bench-")
+    os.environ.update({
+        "DB_PATH": os.path.join(scratch, "data.db"),
+        "STATE_DB_PATH": os.path.join(scratch, "state.db"),
+        "ADMIN_IDS": ",".join(str(ADMIN_ID_BASE + i) for i in range(max(args.admins, 1))),
+        "METRICS_PORT": "0",
+        "MAINTENANCE_INTERVAL_HOURS": "0",
+        # simulated users tap as fast as replies arrive; measure the bot, not the throttle
+        "FLOOD_RATE": "0",
+        "FLOOD_GLOBAL_RATE": "0",
+        "FLOOD_DEDUP_SECONDS": "0",
+    })
+    bot = importlib.import_module("bot")
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    context = multiprocessing.get_context("spawn")
+    pipe, child_pipe = context.Pipe()
+    driver = context.Process(target=drive_process, args=(args, child_pipe), daemon=True)
+    driver.start()
+    summary = asyncio.run(run(args, pipe))
+    driver.join()
+    print(json.dumps(summary, indent=2) if args.json else "", end="")
+    if not args.json:
+        print_report(summary)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            problems = compare(summary, json.load(f), args.tolerance)
+        if problems:
+            print("\nREGRESSION:\n  " + "\n  ".join(problems))
+            sys.exit(1)
+        print("\nNo regression against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,63 @@
+import asyncio
+import bisect
+import contextlib
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import itertools
+import hmac
+import io
 import logging
+import json
+import math
 import os
+import pickle
 import re
+import secrets
 import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from operator import itemgetter
+from urllib.parse import parse_qsl
+from zoneinfo import ZoneInfo
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputFile,
+    InputTextMessageContent,
     ReplyKeyboardRemove
 )
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
+    BasePersistence,
+    BaseUpdateProcessor,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     filters,
     CallbackQueryHandler,
-    ConversationHandler
+    ConversationHandler,
+    InlineQueryHandler,
+    PersistenceInput
 )
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
 
 # ------------------- CONFIG -------------------
 # Use environment variables in production (e.g., Render)
@@ -28,8 +68,116 @@ MINI_APP_URL = os.getenv("MINI_APP_URL", "https://oto-tournament.vercel.app")
 # Admin user IDs (replace with actual admin Telegram IDs)
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS", "").split(","))) if os.getenv("ADMIN_IDS") else [123456789]
 
+# Update delivery: "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+# Webhook mode: public base URL Telegram posts to, and the local HTTP server it reaches
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Parallel HTTPS connections Telegram may open to deliver updates (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Updates processed concurrently (updates from one user are still handled in order)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+# Prometheus-style /metrics, served on its own local port in both polling and webhook mode (0 disables)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Read-only JSON API for the mini app under /api. Mounted on the webhook server in
+# webhook mode; in polling mode it gets its own port when API_PORT is set.
+API_LISTEN = os.getenv("API_LISTEN", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "0"))
+API_AUTH_MAX_AGE = int(os.getenv("API_AUTH_MAX_AGE", "86400"))  # seconds an initData stays valid
+API_SNAPSHOT_SIZE = int(os.getenv("API_SNAPSHOT_SIZE", "5000"))
+API_PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "50"))
+
+# Moderator notification outbox
+OUTBOX_MIN_INTERVAL = float(os.getenv("OUTBOX_MIN_INTERVAL", "3"))  # groups allow ~20 msgs/min
+OUTBOX_DIGEST_THRESHOLD = int(os.getenv("OUTBOX_DIGEST_THRESHOLD", "5"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "600"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))  # failed sends before a row is dropped
+
+# Mass broadcasts (Telegram allows ~30 msgs/s overall, 1 msg/s per chat)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "25"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "10"))
+
+# Conversation / user_data persistence (SQLite file next to data.db)
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(os.path.dirname(os.getenv("DB_PATH", "data.db")) or ".", "state.db"))
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "10"))
+CONVERSATION_TIMEOUT = float(os.getenv("CONVERSATION_TIMEOUT", "1800"))
+
+# Admin browsers
+BROWSER_PAGE_SIZE = int(os.getenv("BROWSER_PAGE_SIZE", "10"))
+
+# Admin search (/search and inline mode); results are cached briefly per query
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "10"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1000"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "1000"))
+
+# Bulk tournament import (CSV/JSONL upload) and gzipped data exports
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "5000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+EXPORT_UPLOAD_TIMEOUT = float(os.getenv("EXPORT_UPLOAD_TIMEOUT", "300"))
+
+# Tournament scheduler: admins enter dates and times local to TOURNAMENT_TZ
+TOURNAMENT_TZ = ZoneInfo(os.getenv("TOURNAMENT_TZ", "Asia/Kolkata"))
+REMINDER_MINUTES = sorted((int(m) for m in os.getenv("REMINDER_MINUTES", "60,10").split(",")), reverse=True)
+TOURNAMENT_DURATION_MINUTES = int(os.getenv("TOURNAMENT_DURATION_MINUTES", "90"))
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "48"))
+SCHEDULER_HORIZON_HOURS = float(os.getenv("SCHEDULER_HORIZON_HOURS", "6"))
+
+# Flood control: per-user token bucket (FLOOD_RATE updates/s sustained, FLOOD_BURST
+# at once), a shared budget for all users, and a window in which a repeated tap on
+# the same button is dropped. A rate of 0 disables that bucket.
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "5"))
+FLOOD_GLOBAL_RATE = float(os.getenv("FLOOD_GLOBAL_RATE", "100"))
+FLOOD_GLOBAL_BURST = float(os.getenv("FLOOD_GLOBAL_BURST", "200"))
+FLOOD_DEDUP_SECONDS = float(os.getenv("FLOOD_DEDUP_SECONDS", "2"))
+FLOOD_TRACKED_USERS = int(os.getenv("FLOOD_TRACKED_USERS", "100000"))
+
+# OTO Coins credited to the referrer when a referred player creates a profile
+REFERRAL_BONUS = int(os.getenv("REFERRAL_BONUS", "10"))
+
 # Database file
 DB_PATH = os.getenv("DB_PATH", "data.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+# Write-behind batching: queued inserts are grouped into one transaction
+DB_BATCH_WINDOW_MS = float(os.getenv("DB_BATCH_WINDOW_MS", "5"))
+DB_BATCH_MAX = int(os.getenv("DB_BATCH_MAX", "200"))
+# In-process user profile cache
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+# Rendered profile/tournament cards kept per row version
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "20000"))
+# Maintenance: online backups, archival of old tournaments, incremental vacuum (0 disables)
+MAINTENANCE_INTERVAL_HOURS = float(os.getenv("MAINTENANCE_INTERVAL_HOURS", "6"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))
+# Completed tournaments older than this move (with registrations and results) to ARCHIVE_DB_PATH
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "archive.db")
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "30"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "200"))
+VACUUM_PAGES_PER_STEP = int(os.getenv("VACUUM_PAGES_PER_STEP", "1000"))
+# Incremental vacuum needs auto_vacuum=INCREMENTAL. New databases get it for free; an
+# existing one needs a full VACUUM (blocking, twice the disk), run at boot only when this is 1.
+VACUUM_CONVERT = os.getenv("VACUUM_CONVERT", "0") == "1"
+
+# Opt-in log of incoming updates (PII redacted) for replay.py; empty disables.
+# A path ending in .gz is written gzip-compressed.
+RECORD_UPDATES_PATH = os.getenv("RECORD_UPDATES_PATH", "")
+RECORD_SAMPLE_RATE = float(os.getenv("RECORD_SAMPLE_RATE", "1"))  # share of users recorded, all of their updates
+RECORD_FLUSH_SECONDS = float(os.getenv("RECORD_FLUSH_SECONDS", "5"))
 
 # Configure logging
 logging.basicConfig(
@@ -38,107 +186,2392 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ------------------- STATES -------------------
-# Profile creation states
-ASK_NAME, ASK_GAME_ID, ASK_LEVEL, ASK_STATE = range(4)
+# Leaderboard points: placement points plus one point per kill
+PLACEMENT_POINTS = {1: 12, 2: 9, 3: 8, 4: 7, 5: 6, 6: 5, 7: 4, 8: 3, 9: 2, 10: 1}
+
+# Player slots per tournament for each game mode (typical custom-room sizes)
+GAME_MODE_CAPACITY = {"Squad (4v4)": 48, "Duo (2v2)": 50, "Solo (1v1)": 50, "Custom": 100}
+
+# Players per team for bracket/lobby seeding (Custom is seeded as solo)
+TEAM_SIZES = {"Squad (4v4)": 4, "Duo (2v2)": 2, "Solo (1v1)": 1}
+# Share of each lobby's teams that go through to the next lobby round
+LOBBY_QUALIFY = float(os.getenv("LOBBY_QUALIFY", "0.5"))
+
+# Game types offered in the tournament wizard, keyed by callback data
+GAME_TYPES = {"game_freefire": "Free Fire", "game_bgmi": "BGMI", "game_codm": "COD Mobile", "game_valorant": "Valorant Mobile"}
+
+# ------------------- STATES -------------------
+# Profile creation states
+ASK_NAME, ASK_GAME_ID, ASK_LEVEL, ASK_STATE = range(4)
+
+# Admin tournament creation states
+ADMIN_TOURNAMENT_NAME, ADMIN_GAME_TYPE, ADMIN_MAP, ADMIN_GAME_MODE, ADMIN_DATE, ADMIN_TIME, ADMIN_ENTRY_FEE, ADMIN_PRIZE = range(8, 16)
+
+# user_data fields each persistent wizard fills in, by conversation name; an
+# abandoned wizard loses these and nothing else (e.g. the admin browsers stay)
+CONVERSATION_FIELDS = {
+    "profile_conversation": ("name", "game_id", "level", "state"),
+    "tournament_conversation": (
+        "tournament_name", "game_type", "map", "game_mode", "date", "time", "entry_fee", "prize_pool",
+    ),
+}
+
+# ------------------- METRICS -------------------
+# Cheap enough for the hot path: an observation is a bisect over ~12 bucket
+# bounds and two additions under an uncontended lock. Everything else
+# (queue depths, cache stats) is read only when /metrics is scraped.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _metric_labels(label, value):
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{label}="{escaped}"'
+
+class Histogram:
+    """Latency histogram with one series per value of a single label."""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # per-bucket (not cumulative) counts, plus the running sum
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += seconds
+
+    def snapshot(self):
+        """{label value: (per-bucket counts with +Inf last, sum)}"""
+        with self._lock:
+            return {value: (list(counts), total) for value, (counts, total) in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total) in sorted(self.snapshot().items()):
+            labels = _metric_labels(self.label, value)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic counter with one series per value of a single label."""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._series[label_value] = self._series.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._series.items())
+        lines += [f"{self.name}{{{_metric_labels(self.label, value)}}} {count}" for value, count in snapshot]
+        return lines
+
+HANDLER_SECONDS = Histogram("oto_handler_seconds", "Time spent in each update handler.", "handler")
+DB_SECONDS = Histogram("oto_db_seconds", "Time spent running each DB helper on its connection.", "helper")
+DB_WAIT_SECONDS = Histogram("oto_db_wait_seconds", "Time a DB call waited for a free connection thread.", "pool")
+TELEGRAM_SECONDS = Histogram("oto_telegram_api_seconds", "Outbound Bot API request latency.", "method")
+TELEGRAM_429 = Counter("oto_telegram_429_total", "Bot API requests rejected with 429 Too Many Requests.", "method")
+THROTTLED = Counter("oto_throttled_updates_total", "Updates dropped by flood control.", "reason")
+RECORDED = Counter("oto_recorded_updates_total", "Updates written to the replay log.", "kind")
+
+def _helper_name(fn):
+    return getattr(fn, "__name__", type(fn).__name__)
+
+# ------------------- DB POOL -------------------
+# One long-lived writer connection (single thread, so writes never contend for the
+# lock) plus a small pool of reader connections. All SQLite work runs in these
+# executors so a slow disk never stalls the event loop.
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+_db_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+_db_read_executor = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-reader")
+
+def _open_connection(path, incremental_vacuum=False):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    if incremental_vacuum:
+        # only takes on a brand-new file, and only before WAL writes its header
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000")
+    conn.execute("PRAGMA mmap_size=134217728")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+def _thread_connection(path=None):
+    path = path or DB_PATH
+    conns = getattr(_db_local, "conns", None)
+    if conns is None:
+        conns = _db_local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = _open_connection(path)
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+def _run_read(fn, args, path, queued_at):
+    started = time.perf_counter()
+    DB_WAIT_SECONDS.observe("read", started - queued_at)
+    try:
+        return fn(_thread_connection(path), *args)
+    finally:
+        DB_SECONDS.observe(_helper_name(fn), time.perf_counter() - started)
+
+def _run_write(fn, args, path, queued_at):
+    started = time.perf_counter()
+    DB_WAIT_SECONDS.observe("write", started - queued_at)
+    conn = _thread_connection(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn, *args)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        DB_SECONDS.observe(_helper_name(fn), time.perf_counter() - started)
+    conn.execute("COMMIT")
+    return result
+
+async def db_read(fn, *args, path=None):
+    """Run fn(conn, *args) on a pooled reader connection."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_read_executor, _run_read, fn, args, path, time.perf_counter())
+
+async def db_write(fn, *args, path=None):
+    """Run fn(conn, *args) inside one transaction on the writer connection."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_write_executor, _run_write, fn, args, path, time.perf_counter())
+
+def _run_write_batch(batch, queued_at):
+    # Each item gets its own savepoint so one failing insert (e.g. a duplicate
+    # telegram_id) does not roll back the rest of the batch.
+    DB_WAIT_SECONDS.observe("batch", time.perf_counter() - queued_at)
+    conn = _thread_connection()
+    results = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for fn, args, _ in batch:
+            conn.execute("SAVEPOINT batch_item")
+            started = time.perf_counter()
+            try:
+                results.append((True, fn(conn, *args)))
+            except Exception as e:
+                conn.execute("ROLLBACK TO batch_item")
+                results.append((False, e))
+            DB_SECONDS.observe(_helper_name(fn), time.perf_counter() - started)
+            conn.execute("RELEASE batch_item")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return results
+
+class WriteBatcher:
+    """
+    Async write-behind queue. Writes submitted within the same short window are
+    committed together in one transaction (one fsync), and each caller gets its
+    own row back through a future.
+    """
+
+    def __init__(self, window_ms, max_batch):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+
+    async def submit(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+        future = loop.create_future()
+        self._queue.put_nowait((fn, args, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                results = await loop.run_in_executor(_db_write_executor, _run_write_batch, batch, time.perf_counter())
+            except Exception as e:
+                logger.exception("Batched write failed")
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def close(self):
+        """Flush everything already queued, then stop the worker."""
+        if self._task is None or self._task.done():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+
+write_batcher = WriteBatcher(DB_BATCH_WINDOW_MS, DB_BATCH_MAX)
+
+def close_db():
+    _db_write_executor.shutdown(wait=True)
+    _db_read_executor.shutdown(wait=True)
+    with _db_connections_lock:
+        for conn in _db_connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _db_connections.clear()
+
+# ------------------- PROFILE CACHE -------------------
+class ProfileCache:
+    """
+    Bounded LRU cache of user rows keyed by telegram_id, with a TTL per entry.
+    Users without a profile are cached too (as None) so repeat /start taps from
+    new users don't hit the DB either.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id):
+        """Return the cached row (or None for a cached negative), or ProfileCache._MISSING."""
+        entry = self._data.get(telegram_id)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[telegram_id]
+            self.misses += 1
+            return self._MISSING
+        self._data.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, telegram_id, row):
+        self._data[telegram_id] = (row, time.monotonic() + self.ttl)
+        self._data.move_to_end(telegram_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def add(self, telegram_id, row):
+        """Like set(), but never overwrites an entry written while a DB read was in flight."""
+        if telegram_id not in self._data:
+            self.set(telegram_id, row)
+
+    def invalidate(self, telegram_id):
+        self._data.pop(telegram_id, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class SnapshotCache:
+    """
+    Serialized API responses (JSON body, gzipped body, ETag) keyed by
+    (namespace, *params). Writers call invalidate(namespace) to drop every
+    snapshot in a namespace at once by bumping its generation; a snapshot
+    built while such a write landed is served once but never cached.
+    Concurrent misses on one key share a single build.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._generations = {}
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, namespace, key=None):
+        if key is None:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        else:
+            self._data.pop((namespace,) + tuple(key), None)
+
+    async def get(self, key, build):
+        """The cached snapshot for key, or build() -> JSON-able object (None for "not found")."""
+        generation = self._generations.get(key[0], 0)
+        entry = self._data.get(key)
+        if entry is not None and entry[0] == generation:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        task = self._building.get(key)
+        if task is None:
+            task = self._building[key] = asyncio.ensure_future(self._build(key, generation, build))
+            task.add_done_callback(lambda _: self._building.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _build(self, key, generation, build):
+        obj = await build()
+        snapshot = None if obj is None else make_snapshot(obj)
+        if snapshot is not None and self._generations.get(key[0], 0) == generation:
+            self._data[key] = (generation, snapshot)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return snapshot
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+def make_snapshot(obj):
+    body = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+    return body, gzip.compress(body, 6), '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+# same LRU/TTL map, keyed by normalized query text
+search_cache = ProfileCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+api_snapshots = SnapshotCache(API_SNAPSHOT_SIZE)
+
+# ------------------- MIGRATIONS -------------------
+# Versioned schema steps, tracked in PRAGMA user_version. Append new versions at
+# the end and never edit a step that has shipped. A step is either an SQL
+# statement or a callable taking the connection (for data backfills).
+MIGRATIONS = [
+    (1, "users and tournaments", [
+        # users: id (auto), telegram_id (unique), oto_id (unique), name, game_id, level, state, username, created_at
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            oto_id TEXT UNIQUE,
+            name TEXT,
+            game_id TEXT,
+            level INTEGER,
+            state TEXT,
+            username TEXT,
+            created_at TEXT
+        )
+        """,
+        # tournaments: id (auto), name, game_type, map, game_mode, date, time, entry_fee, prize_pool, created_at
+        """
+        CREATE TABLE IF NOT EXISTS tournaments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            game_type TEXT,
+            map TEXT,
+            game_mode TEXT,
+            date TEXT,
+            time TEXT,
+            entry_fee INTEGER,
+            prize_pool INTEGER,
+            created_at TEXT
+        )
+        """,
+    ]),
+    (2, "moderator outbox", [
+        # outbox: pending moderator notifications; rows are deleted once delivered
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox(next_attempt_at)",
+    ]),
+    (3, "broadcasts", [
+        # broadcasts: one row per mass message; last_user_id is the resume checkpoint
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            admin_chat_id INTEGER,
+            progress_message_id INTEGER,
+            created_at TEXT,
+            finished_at TEXT
+        )
+        """,
+    ]),
+    (4, "tournament registrations", [
+        # capacity: player slots; seats_taken: confirmed registrations (kept in step by the join/leave helpers)
+        "ALTER TABLE tournaments ADD COLUMN capacity INTEGER NOT NULL DEFAULT 100",
+        "ALTER TABLE tournaments ADD COLUMN seats_taken INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE tournaments SET capacity = CASE game_mode
+            WHEN 'Squad (4v4)' THEN 48
+            WHEN 'Duo (2v2)' THEN 50
+            WHEN 'Solo (1v1)' THEN 50
+            ELSE 100
+        END
+        """,
+        # registrations: status is 'confirmed' (holds a seat) or 'waitlist' (promoted in id order)
+        """
+        CREATE TABLE IF NOT EXISTS registrations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id INTEGER NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            status TEXT NOT NULL CHECK (status IN ('confirmed', 'waitlist')),
+            created_at TEXT NOT NULL,
+            UNIQUE (tournament_id, user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_registrations_status ON registrations(tournament_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_registrations_user ON registrations(user_id)",
+    ]),
+    (5, "wallet ledger", [
+        # Double-entry ledger: every transaction has legs on two or more accounts
+        # that sum to zero. Accounts are "user:<users.id>", "tournament:<id>" and
+        # "house:<purpose>". Both tables are append-only.
+        """
+        CREATE TABLE IF NOT EXISTS ledger_transactions (
+            id INTEGER PRIMARY KEY,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL CHECK (kind IN ('deposit', 'entry_fee', 'prize', 'referral_bonus', 'refund')),
+            reference TEXT,
+            created_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ledger_entries (
+            id INTEGER PRIMARY KEY,
+            txn_id INTEGER NOT NULL REFERENCES ledger_transactions(id),
+            account TEXT NOT NULL,
+            amount INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ledger_entries_account ON ledger_entries(account, id)",
+        "CREATE TRIGGER IF NOT EXISTS ledger_transactions_append_only BEFORE UPDATE ON ledger_transactions BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END",
+        "CREATE TRIGGER IF NOT EXISTS ledger_transactions_no_delete BEFORE DELETE ON ledger_transactions BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END",
+        "CREATE TRIGGER IF NOT EXISTS ledger_entries_append_only BEFORE UPDATE ON ledger_entries BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END",
+        "CREATE TRIGGER IF NOT EXISTS ledger_entries_no_delete BEFORE DELETE ON ledger_entries BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END",
+        # balances: materialized per-account totals, updated in the same transaction as the legs
+        """
+        CREATE TABLE IF NOT EXISTS balances (
+            account TEXT PRIMARY KEY,
+            balance INTEGER NOT NULL DEFAULT 0,
+            CHECK (account NOT LIKE 'user:%' OR balance >= 0)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (6, "match results and leaderboards", [
+        # match_results: one row per player per tournament; no cascade, so a
+        # tournament with recorded results can't be deleted out from under the scores
+        """
+        CREATE TABLE IF NOT EXISTS match_results (
+            tournament_id INTEGER NOT NULL REFERENCES tournaments(id),
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            placement INTEGER NOT NULL,
+            kills INTEGER NOT NULL,
+            points INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (tournament_id, user_id)
+        )
+        """,
+        # scores: running leaderboard totals per game type, maintained incrementally
+        """
+        CREATE TABLE IF NOT EXISTS scores (
+            game_type TEXT NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            state TEXT,
+            points INTEGER NOT NULL DEFAULT 0,
+            matches INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (game_type, user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scores_game_points ON scores(game_type, points, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_scores_game_state_points ON scores(game_type, state, points, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_scores_user ON scores(user_id)",
+    ]),
+    (7, "referrals", [
+        # referrals: recorded on the first /start with a payload, before the referee
+        # has a profile, so it is keyed by telegram id; a player can be referred once
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            referee_telegram_id INTEGER PRIMARY KEY,
+            referrer_id INTEGER NOT NULL REFERENCES users(id),
+            created_at TEXT NOT NULL,
+            credited_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id)",
+        # credited referrals per user, kept as a counter so the referral screen never counts rows
+        "ALTER TABLE users ADD COLUMN referral_count INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (8, "full-text search", [
+        # External-content FTS5 indexes: the text lives only in users/tournaments,
+        # the triggers below keep the index in step. prefix= builds extra index
+        # levels so short "abc*" queries are a direct lookup, not a term scan.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            name, game_id, username, oto_id,
+            content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS tournaments_fts USING fts5(
+            name, game_type, map,
+            content='tournaments', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, name, game_id, username, oto_id)
+            VALUES (new.id, new.name, new.game_id, new.username, new.oto_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, name, game_id, username, oto_id)
+            VALUES ('delete', old.id, old.name, old.game_id, old.username, old.oto_id);
+        END
+        """,
+        # only the indexed columns: counter updates (referral_count, seats_taken) skip the index
+        """
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, game_id, username, oto_id ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, name, game_id, username, oto_id)
+            VALUES ('delete', old.id, old.name, old.game_id, old.username, old.oto_id);
+            INSERT INTO users_fts (rowid, name, game_id, username, oto_id)
+            VALUES (new.id, new.name, new.game_id, new.username, new.oto_id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS tournaments_fts_insert AFTER INSERT ON tournaments BEGIN
+            INSERT INTO tournaments_fts (rowid, name, game_type, map) VALUES (new.id, new.name, new.game_type, new.map);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS tournaments_fts_delete AFTER DELETE ON tournaments BEGIN
+            INSERT INTO tournaments_fts (tournaments_fts, rowid, name, game_type, map)
+            VALUES ('delete', old.id, old.name, old.game_type, old.map);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS tournaments_fts_update AFTER UPDATE OF name, game_type, map ON tournaments BEGIN
+            INSERT INTO tournaments_fts (tournaments_fts, rowid, name, game_type, map)
+            VALUES ('delete', old.id, old.name, old.game_type, old.map);
+            INSERT INTO tournaments_fts (rowid, name, game_type, map) VALUES (new.id, new.name, new.game_type, new.map);
+        END
+        """,
+        # Rows that already exist are indexed by build_background_indexes(), not
+        # here: a rebuild takes time proportional to the table. Until it has run,
+        # search() falls back to LIKE on the content tables.
+        "CREATE TABLE IF NOT EXISTS fts_pending (fts_table TEXT PRIMARY KEY)",
+        "INSERT OR IGNORE INTO fts_pending (fts_table) VALUES ('users_fts'), ('tournaments_fts')",
+    ]),
+    (9, "tournament schedule", [
+        # starts_at: UTC epoch seconds of date + time; status moves
+        # upcoming -> live -> completed -> archived; reminded counts reminders sent
+        "ALTER TABLE tournaments ADD COLUMN starts_at INTEGER",
+        "ALTER TABLE tournaments ADD COLUMN status TEXT NOT NULL DEFAULT 'upcoming' CHECK (status IN ('upcoming', 'live', 'completed', 'archived'))",
+        "ALTER TABLE tournaments ADD COLUMN reminded INTEGER NOT NULL DEFAULT 0",
+        lambda conn: _backfill_starts_at(conn),
+        # partial index: archived tournaments drop out, so the scheduler's range scan stays small
+        "CREATE INDEX IF NOT EXISTS idx_tournaments_schedule ON tournaments(starts_at) WHERE status != 'archived'",
+    ]),
+    (10, "brackets and lobbies", [
+        # bracket_teams: seeded teams (a solo player is a team of one); user_ids is
+        # a comma-separated list of users.id, strength the summed levels
+        """
+        CREATE TABLE IF NOT EXISTS bracket_teams (
+            tournament_id INTEGER NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
+            team_no INTEGER NOT NULL,
+            user_ids TEXT NOT NULL,
+            strength INTEGER NOT NULL,
+            PRIMARY KEY (tournament_id, team_no)
+        ) WITHOUT ROWID
+        """,
+        # bracket_matches: one knockout match or lobby per (round, slot). teams is a
+        # JSON list of team_no (null = bye or not decided yet); result is the
+        # winning team_no for a knockout match, the placement list for a lobby
+        """
+        CREATE TABLE IF NOT EXISTS bracket_matches (
+            tournament_id INTEGER NOT NULL REFERENCES tournaments(id) ON DELETE CASCADE,
+            round INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('knockout', 'lobby')),
+            teams TEXT NOT NULL,
+            result TEXT,
+            PRIMARY KEY (tournament_id, round, slot)
+        ) WITHOUT ROWID
+        """,
+    ]),
+]
+
+# Indexes on tables that can be large. They only speed queries up, so they are
+# built after the bot is online instead of inside the startup transaction:
+# one index per transaction on the writer thread, so WAL readers keep going and
+# queued writes wait for a single build rather than the whole migration.
+BACKGROUND_INDEXES = {
+    # admin browsers' filters and keyset pagination
+    "idx_tournaments_date_time": "CREATE INDEX IF NOT EXISTS idx_tournaments_date_time ON tournaments(date, time)",
+    "idx_tournaments_game_type": "CREATE INDEX IF NOT EXISTS idx_tournaments_game_type ON tournaments(game_type)",
+    "idx_users_state": "CREATE INDEX IF NOT EXISTS idx_users_state ON users(state)",
+    "idx_users_created_at": "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)",
+}
+
+# FTS indexes still waiting for their background rebuild (loaded by init_db)
+fts_pending = set()
+
+def init_db():
+    """Apply pending migrations in one transaction. A current schema costs one PRAGMA read."""
+    conn = _open_connection(DB_PATH, incremental_vacuum=True)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # INCREMENTAL lets maintenance hand free pages back in small steps. A new
+            # file took it on open; an existing one needs one full VACUUM, done
+            # here before the bot is online rather than under live traffic.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if VACUUM_CONVERT:
+                logger.info("Rewriting %s once to enable incremental vacuum", DB_PATH)
+                conn.execute("VACUUM")
+            else:
+                logger.info("%s doesn't use incremental vacuum; set VACUUM_CONVERT=1 for one boot to convert it", DB_PATH)
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        latest = MIGRATIONS[-1][0]
+        if current >= latest:
+            fts_pending.update(_pending_fts(conn))
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for version, description, steps in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info("Applying migration %s: %s", version, description)
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {latest}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        fts_pending.update(_pending_fts(conn))
+    finally:
+        conn.close()
+
+def _pending_fts(conn):
+    return [row[0] for row in conn.execute("SELECT fts_table FROM fts_pending")]
+
+def _rebuild_fts(conn, table):
+    conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+    conn.execute("DELETE FROM fts_pending WHERE fts_table=?", (table,))
+
+def _existing_indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+
+def _build_index(conn, sql):
+    conn.execute(sql)
+
+async def build_background_indexes():
+    existing = await db_read(_existing_indexes)
+    for name, sql in BACKGROUND_INDEXES.items():
+        if name in existing:
+            continue
+        started = time.monotonic()
+        try:
+            await db_write(_build_index, sql)
+        except sqlite3.Error:
+            logger.exception("Failed to build index %s", name)
+            continue
+        logger.info("Built index %s in %.1fs", name, time.monotonic() - started)
+    for table in sorted(fts_pending):
+        started = time.monotonic()
+        try:
+            await db_write(_rebuild_fts, table)
+        except sqlite3.Error:
+            logger.exception("Failed to rebuild search index %s", table)
+            continue
+        fts_pending.discard(table)
+        search_cache.clear()
+        logger.info("Rebuilt search index %s in %.1fs", table, time.monotonic() - started)
+
+# ------------------- DB HELPERS -------------------
+USER_COLUMNS = "id, telegram_id, oto_id, name, game_id, level, state, username, created_at"
+TOURNAMENT_COLUMNS = "id, name, game_type, map, game_mode, date, time, entry_fee, prize_pool"
+
+def _get_user_by_telegram_id(conn, telegram_id):
+    return conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE telegram_id=?", (telegram_id,)).fetchone()
+
+def _get_user_by_oto_id(conn, oto_id):
+    return conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE oto_id=?", (oto_id,)).fetchone()
+
+async def get_user_by_oto_id(oto_id):
+    return await db_read(_get_user_by_oto_id, oto_id.strip().upper())
+
+async def get_user_by_telegram_id(telegram_id):
+    row = profile_cache.get(telegram_id)
+    if row is ProfileCache._MISSING:
+        row = await db_read(_get_user_by_telegram_id, telegram_id)
+        profile_cache.add(telegram_id, row)
+    return row
+
+def _create_user(conn, telegram_id, name, game_id, level, state, username):
+    created_at = datetime.utcnow().isoformat()
+    # Allocate the next autoincrement id up front so the OTO ID
+    # (OTO + zero-padded id, 6 digits) is written by the same statement.
+    return conn.execute(
+        f"""
+        INSERT INTO users (id, telegram_id, oto_id, name, game_id, level, state, username, created_at)
+        SELECT next_id, ?, 'OTO' || printf('%06d', next_id), ?, ?, ?, ?, ?, ?
+        FROM (
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name='users'), 0),
+                COALESCE((SELECT MAX(id) FROM users), 0)
+            ) + 1 AS next_id
+        )
+        RETURNING {USER_COLUMNS}
+        """,
+        (telegram_id, name, game_id, level, state, username, created_at)
+    ).fetchone()
+
+def _signup(conn, telegram_id, name, game_id, level, state, username):
+    row = _create_user(conn, telegram_id, name, game_id, level, state, username)
+    # the referral bonus commits atomically with the profile it pays for
+    _credit_referral(conn, telegram_id, row[0])
+    return row
+
+async def create_user(telegram_id, name, game_id, level, state, username):
+    # sqlite3.IntegrityError (duplicate telegram_id) propagates to the caller
+    try:
+        row = await write_batcher.submit(_signup, telegram_id, name, game_id, level, state, username)
+    except sqlite3.IntegrityError:
+        # a cached negative lookup is now known to be stale
+        profile_cache.invalidate(telegram_id)
+        raise
+    profile_cache.set(telegram_id, row)
+    api_snapshots.invalidate("profile", (row[2],))
+    return row
+
+def tournament_starts_at(date_str, time_str):
+    """UTC epoch seconds of a tournament's local date and time, or None if they don't parse."""
+    try:
+        local = datetime.strptime(f"{date_str.strip()} {time_str.strip()}", "%Y-%m-%d %H:%M")
+    except (AttributeError, ValueError):
+        return None
+    return int(local.replace(tzinfo=TOURNAMENT_TZ).timestamp())
+
+def _backfill_starts_at(conn):
+    rows = conn.execute("SELECT id, date, time FROM tournaments").fetchall()
+    conn.executemany("UPDATE tournaments SET starts_at=? WHERE id=?",
+                     [(tournament_starts_at(date, time_), tid) for tid, date, time_ in rows])
+
+def _tournament_values(t, created_at):
+    capacity = GAME_MODE_CAPACITY.get(t["game_mode"], GAME_MODE_CAPACITY["Custom"])
+    return (t["name"], t["game_type"], t["map"], t["game_mode"], t["date"], t["time"], t["entry_fee"], t["prize_pool"],
+            capacity, tournament_starts_at(t["date"], t["time"]), created_at)
+
+def _save_tournament(conn, t):
+    c = conn.execute(
+        """INSERT INTO tournaments (name, game_type, map, game_mode, date, time, entry_fee, prize_pool, capacity, starts_at, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        _tournament_values(t, datetime.utcnow().isoformat())
+    )
+    return c.lastrowid
+
+async def save_tournament_to_db(t):
+    tournament_id = await write_batcher.submit(_save_tournament, t)
+    api_snapshots.invalidate("tournaments")
+    return tournament_id
+
+def _get_recent_tournaments(conn, limit):
+    return conn.execute(f"SELECT {TOURNAMENT_COLUMNS} FROM tournaments ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+async def get_recent_tournaments(limit=10):
+    return await db_read(_get_recent_tournaments, limit)
+
+def _keyset_page(conn, select, where, params, sort_cols, descending, cursor, backwards, limit):
+    """
+    One page of a keyset-paginated query. cursor is the sort key of the row
+    the page starts after (or before, when backwards), so every page is an
+    index range scan no matter how deep the admin has paged. Returns
+    (rows, has_more) with rows always in display order.
+    """
+    clauses, args = list(where), list(params)
+    scan_desc = descending != backwards
+    if cursor is not None:
+        columns = ", ".join(sort_cols)
+        marks = ", ".join("?" * len(sort_cols))
+        clauses.append(f"({columns}) {'<' if scan_desc else '>'} ({marks})")
+        args.extend(cursor)
+    sql = select
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY " + ", ".join(f"{col} {'DESC' if scan_desc else 'ASC'}" for col in sort_cols)
+    sql += " LIMIT ?"
+    rows = conn.execute(sql, args + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    return rows, has_more
+
+def _browse_tournaments(conn, game_type, date, cursor, backwards, limit):
+    where, params = [], []
+    if game_type:
+        where.append("game_type = ?")
+        params.append(game_type)
+    if date:
+        # one day's schedule in start-time order, served by idx_tournaments_date_time
+        where.append("date = ?")
+        params.append(date)
+        sort_cols, descending = ("time", "id"), False
+    else:
+        sort_cols, descending = ("id",), True
+    rows, has_more = _keyset_page(conn, f"SELECT {TOURNAMENT_COLUMNS} FROM tournaments", where, params,
+                                  sort_cols, descending, cursor, backwards, limit)
+    return rows, has_more, sort_cols
+
+def _browse_users(conn, state, joined, cursor, backwards, limit):
+    where, params = [], []
+    if state:
+        where.append("state = ?")
+        params.append(state)
+    if joined:
+        # created_at is an ISO timestamp, so one day is a range on idx_users_created_at.
+        # Past the first page the cursor is the tighter bound on that side, and
+        # leaving the day bound out lets SQLite start the index scan at the cursor.
+        if cursor is None or backwards:
+            where.append("created_at >= ?")
+            params.append(joined)
+        if cursor is None or not backwards:
+            where.append("created_at < ?")
+            params.append(joined + "T99")
+        sort_cols, descending = ("created_at", "id"), False
+    else:
+        sort_cols, descending = ("id",), True
+    rows, has_more = _keyset_page(conn, f"SELECT {USER_COLUMNS} FROM users", where, params,
+                                  sort_cols, descending, cursor, backwards, limit)
+    return rows, has_more, sort_cols
+
+def _delete_tournament(conn, tournament_id):
+    return conn.execute("DELETE FROM tournaments WHERE id=?", (tournament_id,)).rowcount
+
+async def delete_tournament(tournament_id):
+    deleted = await db_write(_delete_tournament, tournament_id)
+    api_snapshots.invalidate("tournaments")
+    return deleted
+
+def _get_tournament(conn, tournament_id):
+    return conn.execute(f"SELECT {TOURNAMENT_COLUMNS} FROM tournaments WHERE id=?", (tournament_id,)).fetchone()
+
+async def get_tournament(tournament_id):
+    return await db_read(_get_tournament, tournament_id)
+
+# ------------------- REGISTRATIONS -------------------
+def _join_tournament(conn, tournament_id, user_id, today):
+    """
+    Returns (outcome, position): ("confirmed", seats now taken), ("waitlist", place
+    in line), ("already_confirmed"/"already_waitlist", None) or ("closed", None).
+    The seat is claimed with one conditional UPDATE on the counter, so capacity
+    holds even if several writers ever raced on the same tournament.
+    """
+    existing = conn.execute(
+        "SELECT status FROM registrations WHERE tournament_id=? AND user_id=?", (tournament_id, user_id)
+    ).fetchone()
+    if existing:
+        return f"already_{existing[0]}", None
+    tournament = conn.execute("SELECT date, status FROM tournaments WHERE id=?", (tournament_id,)).fetchone()
+    if not tournament or tournament[0] < today or tournament[1] != "upcoming":
+        return "closed", None
+    seat = conn.execute(
+        "UPDATE tournaments SET seats_taken = seats_taken + 1 WHERE id=? AND seats_taken < capacity RETURNING seats_taken",
+        (tournament_id,)
+    ).fetchone()
+    status = "confirmed" if seat else "waitlist"
+    c = conn.execute(
+        "INSERT INTO registrations (tournament_id, user_id, status, created_at) VALUES (?, ?, ?, ?)",
+        (tournament_id, user_id, status, datetime.utcnow().isoformat())
+    )
+    if seat:
+        return status, seat[0]
+    position = conn.execute(
+        "SELECT COUNT(*) FROM registrations WHERE tournament_id=? AND status='waitlist' AND id<=?",
+        (tournament_id, c.lastrowid)
+    ).fetchone()[0]
+    return status, position
+
+async def join_tournament(tournament_id, user_id):
+    # Joins go through the write batcher: a burst of taps at announcement time
+    # becomes a handful of transactions instead of one commit per player.
+    result = await write_batcher.submit(_join_tournament, tournament_id, user_id, datetime.now().date().isoformat())
+    # seats_taken is part of the listing
+    api_snapshots.invalidate("tournaments")
+    return result
+
+def _leave_tournament(conn, tournament_id, user_id):
+    """
+    Returns (old status, telegram_id of a promoted waitlisted player or None,
+    refunded amount). Old status is None if the player wasn't registered and
+    "closed" once the tournament has left 'upcoming' (nobody leaves a live or
+    finished one). An entry fee already collected goes back from the prize pool.
+    """
+    tournament = conn.execute("SELECT status FROM tournaments WHERE id=?", (tournament_id,)).fetchone()
+    if not tournament:
+        return None, None, 0
+    if tournament[0] != "upcoming":
+        registered = conn.execute(
+            "SELECT 1 FROM registrations WHERE tournament_id=? AND user_id=?", (tournament_id, user_id)
+        ).fetchone()
+        return ("closed" if registered else None), None, 0
+    row = conn.execute(
+        "DELETE FROM registrations WHERE tournament_id=? AND user_id=? RETURNING status, id", (tournament_id, user_id)
+    ).fetchone()
+    if not row or row[0] != "confirmed":
+        return (row[0] if row else None), None, 0
+    refunded = 0
+    # the fee this registration paid; fees collected before they were keyed per
+    # registration carry the user id instead
+    for key in (fee_key(tournament_id, row[1]), f"fee:{tournament_id}:{user_id}"):
+        fee = conn.execute(
+            """SELECT -e.amount FROM ledger_transactions t JOIN ledger_entries e ON e.txn_id = t.id
+               WHERE t.idempotency_key=? AND e.account=?""",
+            (key, user_account(user_id))
+        ).fetchone()
+        if fee:
+            _, created = _post_transaction(
+                conn, "refund:" + key.split(":", 1)[1], "refund",
+                [(f"tournament:{tournament_id}", -fee[0]), (user_account(user_id), fee[0])], f"tournament:{tournament_id}"
+            )
+            if created:
+                refunded = fee[0]
+            break
+    promoted = conn.execute(
+        """UPDATE registrations SET status='confirmed'
+           WHERE id = (SELECT id FROM registrations WHERE tournament_id=? AND status='waitlist' ORDER BY id LIMIT 1)
+           RETURNING user_id""",
+        (tournament_id,)
+    ).fetchone()
+    if not promoted:
+        conn.execute("UPDATE tournaments SET seats_taken = seats_taken - 1 WHERE id=?", (tournament_id,))
+        return row[0], None, refunded
+    return row[0], conn.execute("SELECT telegram_id FROM users WHERE id=?", (promoted[0],)).fetchone()[0], refunded
+
+async def leave_tournament(tournament_id, user_id):
+    result = await write_batcher.submit(_leave_tournament, tournament_id, user_id)
+    api_snapshots.invalidate("tournaments")
+    return result
+
+def _browse_upcoming(conn, today, cursor, backwards, limit):
+    # schedule order on idx_tournaments_date_time
+    return _keyset_page(
+        conn,
+        f"SELECT {TOURNAMENT_COLUMNS}, capacity, seats_taken FROM tournaments",
+        ["date >= ?", "status = 'upcoming'"], [today], ("date", "time", "id"), False, cursor, backwards, limit
+    )
+
+# ------------------- WALLET LEDGER -------------------
+class InsufficientFunds(Exception):
+    pass
+
+def user_account(user_id):
+    return f"user:{user_id}"
+
+def _post_transaction(conn, idempotency_key, kind, legs, reference=None):
+    """
+    Append one balanced transaction and apply its legs to the materialized
+    balances. Returns (txn_id, created); replaying an idempotency key returns
+    the original transaction without touching any balance.
+    """
+    if sum(amount for _, amount in legs) != 0:
+        raise ValueError("ledger legs must sum to zero")
+    row = conn.execute("SELECT id FROM ledger_transactions WHERE idempotency_key=?", (idempotency_key,)).fetchone()
+    if row:
+        return row[0], False
+    txn_id = conn.execute(
+        "INSERT INTO ledger_transactions (idempotency_key, kind, reference, created_at) VALUES (?, ?, ?, ?)",
+        (idempotency_key, kind, reference, datetime.utcnow().isoformat())
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO ledger_entries (txn_id, account, amount) VALUES (?, ?, ?)",
+        [(txn_id, account, amount) for account, amount in legs]
+    )
+    try:
+        # not an upsert: its candidate row would carry the bare (negative) leg
+        # into the CHECK even when the existing balance covers it
+        for account, amount in legs:
+            if not conn.execute("UPDATE balances SET balance = balance + ? WHERE account=?", (amount, account)).rowcount:
+                conn.execute("INSERT INTO balances (account, balance) VALUES (?, ?)", (account, amount))
+    except sqlite3.IntegrityError as e:
+        # the CHECK on balances refuses to take a user account below zero
+        raise InsufficientFunds(str(e)) from e
+    # prize pools can only pay out what was collected into them
+    for account, amount in legs:
+        if amount < 0 and account.startswith("tournament:") and _get_balance(conn, account) < 0:
+            raise InsufficientFunds(f"{account} holds less than {-amount}")
+    return txn_id, True
+
+async def post_transaction(idempotency_key, kind, legs, reference=None):
+    return await write_batcher.submit(_post_transaction, idempotency_key, kind, legs, reference)
+
+def _get_balance(conn, account):
+    row = conn.execute("SELECT balance FROM balances WHERE account=?", (account,)).fetchone()
+    return row[0] if row else 0
+
+async def get_balance(user_id):
+    return await db_read(_get_balance, user_account(user_id))
+
+def _recent_ledger_entries(conn, account, limit):
+    return conn.execute(
+        """SELECT e.amount, t.kind, t.reference, t.created_at FROM ledger_entries e
+           JOIN ledger_transactions t ON t.id = e.txn_id
+           WHERE e.account=? ORDER BY e.id DESC LIMIT ?""",
+        (account, limit)
+    ).fetchall()
+
+def fee_key(tournament_id, registration_id):
+    """
+    Idempotency key of the entry fee paid for one registration (its refund
+    swaps "fee:" for "refund:"). Keyed on the registration, not the player, so
+    leaving with a refund and joining again means paying again.
+    """
+    return f"fee:{tournament_id}:r{registration_id}"
+
+def _collect_entry_fees(conn, tournament_id):
+    """
+    Debit the entry fee from every confirmed player of a tournament in one
+    transaction. Already-charged registrations are skipped (idempotency key per
+    registration), so the command can be re-run safely. Returns (charged, short)
+    where short lists user ids whose balance didn't cover the fee, or None if
+    the tournament doesn't exist or has already finished.
+    """
+    row = conn.execute("SELECT entry_fee, status FROM tournaments WHERE id=?", (tournament_id,)).fetchone()
+    if not row or row[1] not in ("upcoming", "live"):
+        return None
+    if not row[0]:
+        return 0, []
+    fee = row[0]
+    prefix = f"fee:{tournament_id}:"
+    candidates = conn.execute(
+        """SELECT r.id, r.user_id, COALESCE(b.balance, 0) FROM registrations r
+           LEFT JOIN balances b ON b.account = 'user:' || r.user_id
+           WHERE r.tournament_id=? AND r.status='confirmed'
+             AND NOT EXISTS (SELECT 1 FROM ledger_transactions WHERE idempotency_key = ? || 'r' || r.id)
+             -- an unrefunded fee from before keys were per registration
+             AND NOT EXISTS (
+                 SELECT 1 FROM ledger_transactions WHERE idempotency_key = ? || r.user_id
+                 AND NOT EXISTS (SELECT 1 FROM ledger_transactions WHERE idempotency_key = ? || r.user_id)
+             )""",
+        (tournament_id, prefix, prefix, f"refund:{tournament_id}:")
+    ).fetchall()
+    payable = [(reg_id, user_id) for reg_id, user_id, balance in candidates if balance >= fee]
+    short = [user_id for _, user_id, balance in candidates if balance < fee]
+    if not payable:
+        return 0, short
+    # we hold the write lock, so transaction ids can be assigned up front for executemany
+    first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM ledger_transactions").fetchone()[0]
+    now = datetime.utcnow().isoformat()
+    pool = f"tournament:{tournament_id}"
+    conn.executemany(
+        "INSERT INTO ledger_transactions (id, idempotency_key, kind, reference, created_at) VALUES (?, ?, 'entry_fee', ?, ?)",
+        [(first_id + i, fee_key(tournament_id, reg_id), pool, now) for i, (reg_id, _) in enumerate(payable)]
+    )
+    conn.executemany(
+        "INSERT INTO ledger_entries (txn_id, account, amount) VALUES (?, ?, ?)",
+        [leg for i, (_, user_id) in enumerate(payable)
+         for leg in ((first_id + i, user_account(user_id), -fee), (first_id + i, pool, fee))]
+    )
+    conn.executemany(
+        "UPDATE balances SET balance = balance - ? WHERE account=?",
+        [(fee, user_account(user_id)) for _, user_id in payable]
+    )
+    conn.execute(
+        "INSERT INTO balances (account, balance) VALUES (?, ?) ON CONFLICT(account) DO UPDATE SET balance = balance + excluded.balance",
+        (pool, fee * len(payable))
+    )
+    return len(payable), short
+
+async def collect_entry_fees(tournament_id):
+    return await db_write(_collect_entry_fees, tournament_id)
+
+# ------------------- REFERRALS -------------------
+def parse_referral_payload(args):
+    """Referrer telegram id from a /start deep-link payload, or None."""
+    if len(args) != 1 or not re.fullmatch(r"\d{1,20}", args[0]):
+        return None
+    return int(args[0])
+
+def _record_referral(conn, referee_telegram_id, referrer_telegram_id):
+    """
+    Attribute a not-yet-registered player to a referrer. The first link a
+    player opens wins; later ones are ignored. Returns True if recorded.
+    """
+    if referee_telegram_id == referrer_telegram_id:
+        return False
+    if conn.execute("SELECT 1 FROM users WHERE telegram_id=?", (referee_telegram_id,)).fetchone():
+        return False
+    referrer = conn.execute("SELECT id FROM users WHERE telegram_id=?", (referrer_telegram_id,)).fetchone()
+    if not referrer:
+        return False
+    c = conn.execute(
+        "INSERT OR IGNORE INTO referrals (referee_telegram_id, referrer_id, created_at) VALUES (?, ?, ?)",
+        (referee_telegram_id, referrer[0], datetime.utcnow().isoformat())
+    )
+    return c.rowcount == 1
+
+async def record_referral(referee_telegram_id, referrer_telegram_id):
+    return await write_batcher.submit(_record_referral, referee_telegram_id, referrer_telegram_id)
+
+def _credit_referral(conn, referee_telegram_id, referee_id):
+    """Pay the referrer of a newly created profile. Returns the referrer's users.id or None."""
+    row = conn.execute(
+        "SELECT referrer_id FROM referrals WHERE referee_telegram_id=? AND credited_at IS NULL", (referee_telegram_id,)
+    ).fetchone()
+    if not row:
+        return None
+    referrer_id = row[0]
+    if REFERRAL_BONUS > 0:
+        _post_transaction(
+            conn, f"referral:{referee_id}", "referral_bonus",
+            [("house:referrals", -REFERRAL_BONUS), (user_account(referrer_id), REFERRAL_BONUS)],
+            reference=f"user:{referee_id}"
+        )
+    conn.execute("UPDATE referrals SET credited_at=? WHERE referee_telegram_id=?",
+                 (datetime.utcnow().isoformat(), referee_telegram_id))
+    conn.execute("UPDATE users SET referral_count = referral_count + 1 WHERE id=?", (referrer_id,))
+    return referrer_id
+
+def _referral_count(conn, telegram_id):
+    row = conn.execute("SELECT referral_count FROM users WHERE telegram_id=?", (telegram_id,)).fetchone()
+    return row[0] if row else 0
+
+# ------------------- SEARCH -------------------
+def fts_query(text):
+    """Every whitespace-separated term becomes a quoted prefix match, ANDed together."""
+    terms = text.split()[:8]
+    if not terms:
+        return None
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+def _like_search(conn, text, columns, content_table, searched, limit):
+    """Newest rows where every term is a substring of one of the searched columns (no FTS index yet)."""
+    where, params = [], []
+    for term in text.split()[:8]:
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        where.append("(" + " OR ".join(f"{col} LIKE ? ESCAPE '\\'" for col in searched) + ")")
+        params += [pattern] * len(searched)
+    if not where:
+        return []
+    return conn.execute(
+        f"SELECT {columns} FROM {content_table} WHERE {' AND '.join(where)} ORDER BY id DESC LIMIT ?",
+        (*params, limit)
+    ).fetchall()
+
+def _fts_ranked(conn, table, weights, query, columns, content_table, limit):
+    """
+    bm25-ranked matches joined back to their content rows. Very broad prefixes
+    ("ra*" on a million users) match too many rows to score them all, so only
+    the newest SEARCH_RANK_WINDOW matches are ranked: the window floor is a
+    rowid range the FTS index applies before scoring.
+    """
+    floor = conn.execute(
+        f"SELECT rowid FROM {table} WHERE {table} MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+        (query, SEARCH_RANK_WINDOW - 1)
+    ).fetchone()
+    select = ", ".join(f"c.{col}" for col in columns.split(", "))
+    return conn.execute(
+        f"""SELECT {select} FROM (
+                SELECT rowid, bm25({table}, {weights}) AS score FROM {table}
+                WHERE {table} MATCH ? AND rowid >= ? ORDER BY score LIMIT ?
+            ) f JOIN {content_table} c ON c.id = f.rowid ORDER BY f.score""",
+        (query, floor[0] if floor else 0, limit)
+    ).fetchall()
+
+def _search_users(conn, text, limit):
+    rows = []
+    # "123", "000123" or "OTO000123" is an exact OTO ID lookup, listed first
+    m = re.fullmatch(r"(?:oto)?(\d{1,6})", text, re.IGNORECASE)
+    if m:
+        exact = conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE oto_id=?", (f"OTO{int(m.group(1)):06d}",)).fetchone()
+        if exact:
+            rows.append(exact)
+    query = fts_query(text)
+    if query and "users_fts" in fts_pending:
+        matches = _like_search(conn, text, USER_COLUMNS, "users", ("name", "game_id", "username", "oto_id"), limit)
+        rows += [row for row in matches if not rows or row[0] != rows[0][0]]
+    elif query:
+        # bm25 weights (name, game_id, username, oto_id): an ID match outranks a name match
+        matches = _fts_ranked(conn, "users_fts", "1.0, 5.0, 2.0, 10.0", query, USER_COLUMNS, "users", limit)
+        rows += [row for row in matches if not rows or row[0] != rows[0][0]]
+    return rows[:limit]
+
+def _search_tournaments(conn, text, limit):
+    query = fts_query(text)
+    if not query:
+        return []
+    if "tournaments_fts" in fts_pending:
+        return _like_search(conn, text, TOURNAMENT_COLUMNS, "tournaments", ("name", "game_type", "map"), limit)
+    return _fts_ranked(conn, "tournaments_fts", "3.0, 1.0, 1.0", query, TOURNAMENT_COLUMNS, "tournaments", limit)
+
+def _search(conn, text, limit):
+    return _search_users(conn, text, limit), _search_tournaments(conn, text, limit)
+
+async def search(text, limit=SEARCH_LIMIT):
+    """(users, tournaments) matching text, best first. Repeated queries are served from search_cache."""
+    key = (" ".join(text.lower().split()), limit)
+    cached = search_cache.get(key)
+    if cached is not ProfileCache._MISSING:
+        return cached
+    result = await db_read(_search, key[0], limit)
+    search_cache.add(key, result)
+    return result
+
+# ------------------- LEADERBOARDS -------------------
+def match_points(placement, kills):
+    return PLACEMENT_POINTS.get(placement, 0) + kills
+
+def _record_result(conn, tournament_id, user_id, placement, kills):
+    """
+    Upsert one player's result and apply the difference to their running
+    score. Returns (game_type, state, old_total, new_total), or None if the
+    tournament doesn't exist.
+    """
+    tournament = conn.execute("SELECT game_type FROM tournaments WHERE id=?", (tournament_id,)).fetchone()
+    if not tournament:
+        return None
+    game_type = tournament[0]
+    state = conn.execute("SELECT state FROM users WHERE id=?", (user_id,)).fetchone()[0]
+    points = match_points(placement, kills)
+    previous = conn.execute(
+        "SELECT points FROM match_results WHERE tournament_id=? AND user_id=?", (tournament_id, user_id)
+    ).fetchone()
+    conn.execute(
+        """INSERT INTO match_results (tournament_id, user_id, placement, kills, points, created_at) VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT(tournament_id, user_id) DO UPDATE SET placement=excluded.placement, kills=excluded.kills, points=excluded.points""",
+        (tournament_id, user_id, placement, kills, points, datetime.utcnow().isoformat())
+    )
+    old_total = conn.execute(
+        "SELECT points FROM scores WHERE game_type=? AND user_id=?", (game_type, user_id)
+    ).fetchone()
+    delta = points - (previous[0] if previous else 0)
+    new_total = conn.execute(
+        """INSERT INTO scores (game_type, user_id, state, points, matches) VALUES (?, ?, ?, ?, 1)
+           ON CONFLICT(game_type, user_id) DO UPDATE SET points = points + ?, matches = matches + ?
+           RETURNING points""",
+        (game_type, user_id, state, delta, delta, 0 if previous else 1)
+    ).fetchone()[0]
+    return game_type, state, (old_total[0] if old_total else None), new_total
+
+def _all_scores(conn):
+    return conn.execute("SELECT game_type, state, points FROM scores").fetchall()
+
+def _user_scores(conn, user_id):
+    return conn.execute("SELECT game_type, state, points, matches FROM scores WHERE user_id=?", (user_id,)).fetchall()
+
+def _leaderboard_page(conn, game_type, state, cursor, limit):
+    where, params = ["s.game_type = ?"], [game_type]
+    if state:
+        where.append("s.state = ?")
+        params.append(state)
+    # (points, user_id) DESC walks idx_scores_game_points / idx_scores_game_state_points backwards
+    return _keyset_page(
+        conn,
+        "SELECT s.points, s.user_id, u.name, u.oto_id, s.matches FROM scores s JOIN users u ON u.id = s.user_id",
+        where, params, ("s.points", "s.user_id"), True, cursor, False, limit
+    )
+
+def _count_above(conn, game_type, state, points):
+    if state:
+        sql, params = "SELECT COUNT(*) FROM scores WHERE game_type=? AND state=? AND points>?", (game_type, state, points)
+    else:
+        sql, params = "SELECT COUNT(*) FROM scores WHERE game_type=? AND points>?", (game_type, points)
+    return conn.execute(sql, params).fetchone()[0]
+
+class Leaderboards:
+    """
+    In-memory sorted score arrays per game type and per (game type, state),
+    rebuilt from the scores table at startup and updated incrementally as
+    results are recorded. A rank lookup is a binary search (O(log n)); it
+    never re-sorts or counts the user base. Until the rebuild finishes, ranks
+    fall back to an indexed COUNT.
+
+    The rebuild holds the same lock as record_result, so no result commits
+    between its read and the swap and none is lost to a stale snapshot.
+    """
+
+    def __init__(self):
+        self._boards = {}
+        self.ready = False
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def _keys(game_type, state):
+        return ((game_type, None),) if state is None else ((game_type, None), (game_type, state))
+
+    async def rebuild(self):
+        started = time.monotonic()
+        async with self.lock:
+            rows = await db_read(_all_scores)
+            boards = {}
+            for game_type, state, points in rows:
+                for key in self._keys(game_type, state):
+                    boards.setdefault(key, []).append(points)
+            for scores in boards.values():
+                scores.sort()
+            self._boards = boards
+            self.ready = True
+        logger.info("Leaderboards rebuilt from %d scores in %.2fs", len(rows), time.monotonic() - started)
+
+    def apply(self, game_type, state, old_points, new_points):
+        for key in self._keys(game_type, state):
+            scores = self._boards.setdefault(key, [])
+            if old_points is not None:
+                i = bisect.bisect_left(scores, old_points)
+                if i < len(scores) and scores[i] == old_points:
+                    del scores[i]
+            bisect.insort(scores, new_points)
+
+    async def rank(self, game_type, state, points):
+        """1-based competition rank (ties share a rank) and the board size."""
+        if not self.ready:
+            above = await db_read(_count_above, game_type, state, points)
+            return above + 1, None
+        scores = self._boards.get((game_type, state), [])
+        return len(scores) - bisect.bisect_right(scores, points) + 1, len(scores)
+
+    def rank_cached(self, game_type, state, points):
+        scores = self._boards.get((game_type, state), [])
+        return len(scores) - bisect.bisect_right(scores, points) + 1
+
+    async def record_result(self, tournament_id, user_id, placement, kills):
+        # results are serialized so in-memory updates are applied in commit order
+        async with self.lock:
+            result = await db_write(_record_result, tournament_id, user_id, placement, kills)
+            if result and self.ready:
+                self.apply(*result)
+        if result:
+            api_snapshots.invalidate("leaderboard")
+        return result
+
+leaderboards = Leaderboards()
+
+# ------------------- BRACKETS -------------------
+# Seeding works on parallel lists and does its per-player work in sorts,
+# slices and map/zip, so it stays in C for the bulk of the entrants: 10k
+# players seed in a few tens of milliseconds.
+def _fold_teams(ids, levels, team_size):
+    """
+    Split players (sorted strongest first) into balanced teams: the list is cut
+    into team_size pots and alternate pots are reversed, so team i gets the
+    i-th best of pot 0, the i-th worst of pot 1, and so on. Returns (teams,
+    strengths, leftover ids, leftover levels).
+    """
+    count = len(ids) // team_size
+    id_pots, level_pots = [], []
+    for j in range(team_size):
+        step = 1 if j % 2 == 0 else -1
+        id_pots.append(ids[j * count:(j + 1) * count][::step])
+        level_pots.append(levels[j * count:(j + 1) * count][::step])
+    used = count * team_size
+    return list(zip(*id_pots)), list(map(sum, zip(*level_pots))), ids[used:], levels[used:]
+
+def form_teams(players, team_size):
+    """
+    players: [(user_id, level, state)]. Teammates come from the same state
+    where possible. The players a state can't fill a team with are taken from
+    the middle of its list (not the bottom, which would pool every state's
+    weakest into the same few teams), pooled and folded the same way, and a
+    final short-handed team takes the remainder.
+    Returns (teams as tuples of user ids, strengths).
+    """
+    players = sorted(players, key=itemgetter(1), reverse=True)
+    if team_size == 1:
+        return [(p[0],) for p in players], [p[1] for p in players]
+    players.sort(key=itemgetter(2))  # stable: strongest first within each state
+    teams, strengths, spare_ids, spare_levels = [], [], [], []
+    for _, group in itertools.groupby(players, key=itemgetter(2)):
+        group = list(group)
+        extra = len(group) % team_size
+        mid = (len(group) - extra) // 2
+        spares, group = group[mid:mid + extra], group[:mid] + group[mid + extra:]
+        formed, formed_strengths, _, _ = _fold_teams([p[0] for p in group], [p[1] for p in group], team_size)
+        teams += formed
+        strengths += formed_strengths
+        spare_ids += [p[0] for p in spares]
+        spare_levels += [p[1] for p in spares]
+    order = sorted(range(len(spare_ids)), key=spare_levels.__getitem__, reverse=True)
+    spare_ids = [spare_ids[i] for i in order]
+    spare_levels = [spare_levels[i] for i in order]
+    formed, formed_strengths, rest_ids, rest_levels = _fold_teams(spare_ids, spare_levels, team_size)
+    teams += formed
+    strengths += formed_strengths
+    if rest_ids:
+        teams.append(tuple(rest_ids))
+        strengths.append(sum(rest_levels))
+    return teams, strengths
+
+def snake_lobbies(order, lobby_count):
+    """Deal teams (best first) into lobbies 1..n, n..1, 1..n, ... so lobby strengths stay even."""
+    period = 2 * lobby_count
+    return [order[j::period] + order[period - 1 - j::period] for j in range(lobby_count)]
+
+def bracket_positions(size):
+    """Seed numbers in bracket order for a power-of-two bracket: 1, 16, 8, 9, ... for 16."""
+    seeds = [1]
+    while len(seeds) < size:
+        mirror = len(seeds) * 2 + 1
+        seeds = [x for s in seeds for x in (s, mirror - s)]
+    return seeds
+
+def knockout_matches(order):
+    """
+    Single-elimination matches for teams ordered best seed first, as
+    [(round, slot, [team, team], winner)]. Missing seeds are byes, which only
+    ever meet top seeds and are resolved straight into round 2.
+    """
+    size = 1 << max(1, (len(order) - 1).bit_length())
+    seeded = [order[s - 1] if s <= len(order) else None for s in bracket_positions(size)]
+    pairs = list(zip(seeded[0::2], seeded[1::2]))
+    matches = []
+    winners = [b if a is None else a if b is None else None for a, b in pairs]
+    for slot, (pair, winner) in enumerate(zip(pairs, winners)):
+        matches.append((1, slot, list(pair), winner if None in pair else None))
+    round_ = 2
+    while len(winners) > 1:
+        pairs = list(zip(winners[0::2], winners[1::2]))
+        matches += [(round_, slot, list(pair), None) for slot, pair in enumerate(pairs)]
+        winners = [None] * len(pairs)
+        round_ += 1
+    return matches
+
+def lobby_qualifiers(team_count):
+    return max(1, math.ceil(team_count * LOBBY_QUALIFY))
+
+def _bracket_entrants(conn, tournament_id):
+    return conn.execute(
+        """SELECT u.id, COALESCE(u.level, 0), COALESCE(u.state, '') FROM registrations r JOIN users u ON u.id = r.user_id
+           WHERE r.tournament_id=? AND r.status='confirmed'""",
+        (tournament_id,)
+    ).fetchall()
+
+def _save_bracket(conn, tournament_id, teams, strengths, kind, matches):
+    """Replace a tournament's seeding; refuses (False) once a result has been reported."""
+    # byes are the only results recorded at seeding time, and a bye match has a null team
+    if conn.execute(
+        "SELECT 1 FROM bracket_matches WHERE tournament_id=? AND result IS NOT NULL AND teams NOT LIKE '%null%' LIMIT 1",
+        (tournament_id,)
+    ).fetchone():
+        return False
+    conn.execute("DELETE FROM bracket_matches WHERE tournament_id=?", (tournament_id,))
+    conn.execute("DELETE FROM bracket_teams WHERE tournament_id=?", (tournament_id,))
+    conn.executemany(
+        "INSERT INTO bracket_teams (tournament_id, team_no, user_ids, strength) VALUES (?, ?, ?, ?)",
+        ((tournament_id, no, ",".join(map(str, team)), strength)
+         for no, (team, strength) in enumerate(zip(teams, strengths), 1))
+    )
+    conn.executemany(
+        "INSERT INTO bracket_matches (tournament_id, round, slot, kind, teams, result) VALUES (?, ?, ?, ?, ?, ?)",
+        ((tournament_id, round_, slot, kind, json.dumps(pair), None if result is None else json.dumps(result))
+         for round_, slot, pair, result in matches)
+    )
+    return True
+
+def _report_knockout(conn, tournament_id, round_, slot, winner):
+    """Record a match winner and move them into their next-round match. Returns the outcome."""
+    row = conn.execute(
+        "SELECT teams, result FROM bracket_matches WHERE tournament_id=? AND round=? AND slot=? AND kind='knockout'",
+        (tournament_id, round_, slot)
+    ).fetchone()
+    if not row:
+        return "missing"
+    if row[1] is not None:
+        return "decided"
+    teams = json.loads(row[0])
+    if None in teams or winner not in teams:
+        return "invalid"
+    conn.execute(
+        "UPDATE bracket_matches SET result=? WHERE tournament_id=? AND round=? AND slot=?",
+        (json.dumps(winner), tournament_id, round_, slot)
+    )
+    following = conn.execute(
+        "SELECT teams FROM bracket_matches WHERE tournament_id=? AND round=? AND slot=?", (tournament_id, round_ + 1, slot // 2)
+    ).fetchone()
+    if not following:
+        return "champion"
+    teams = json.loads(following[0])
+    teams[slot % 2] = winner
+    conn.execute(
+        "UPDATE bracket_matches SET teams=? WHERE tournament_id=? AND round=? AND slot=?",
+        (json.dumps(teams), tournament_id, round_ + 1, slot // 2)
+    )
+    return "advanced"
+
+def _report_lobby(conn, tournament_id, slot, placement, per_lobby):
+    """
+    Record a lobby's finishing order (at least its qualifiers) in the current
+    round. Only when the round's last lobby reports are the qualifiers dealt
+    into the next round: by finishing place, then strength. Returns
+    (outcome, detail).
+    """
+    round_ = conn.execute(
+        "SELECT MAX(round) FROM bracket_matches WHERE tournament_id=? AND kind='lobby'", (tournament_id,)
+    ).fetchone()[0]
+    row = round_ and conn.execute(
+        "SELECT teams, result FROM bracket_matches WHERE tournament_id=? AND round=? AND slot=?", (tournament_id, round_, slot)
+    ).fetchone()
+    if not row:
+        return "missing", None
+    if row[1] is not None:
+        return "decided", None
+    teams = json.loads(row[0])
+    needed = lobby_qualifiers(len(teams))
+    if len(set(placement)) != len(placement) or not set(placement) <= set(teams) or len(placement) < needed:
+        return "invalid", needed
+    conn.execute(
+        "UPDATE bracket_matches SET result=? WHERE tournament_id=? AND round=? AND slot=?",
+        (json.dumps(placement), tournament_id, round_, slot)
+    )
+    lobbies = conn.execute(
+        "SELECT teams, result FROM bracket_matches WHERE tournament_id=? AND round=? ORDER BY slot", (tournament_id, round_)
+    ).fetchall()
+    if any(result is None for _, result in lobbies):
+        return "recorded", round_
+    if len(lobbies) == 1:
+        return "final", placement[0]
+    qualified = []
+    for teams_json, result_json in lobbies:
+        qualified += enumerate(json.loads(result_json)[:lobby_qualifiers(len(json.loads(teams_json)))])
+    strengths = dict(conn.execute("SELECT team_no, strength FROM bracket_teams WHERE tournament_id=?", (tournament_id,)))
+    qualified.sort(key=lambda q: (q[0], -strengths[q[1]]))
+    next_lobbies = snake_lobbies([team for _, team in qualified], math.ceil(len(qualified) / per_lobby))
+    conn.executemany(
+        "INSERT INTO bracket_matches (tournament_id, round, slot, kind, teams) VALUES (?, ?, ?, 'lobby', ?)",
+        ((tournament_id, round_ + 1, slot, json.dumps(lobby)) for slot, lobby in enumerate(next_lobbies))
+    )
+    return "next_round", len(next_lobbies)
+
+def _pending_matches(conn, tournament_id, limit):
+    # playable = both sides known and no result yet; lowest round first
+    return conn.execute(
+        """SELECT round, slot, kind, teams FROM bracket_matches
+           WHERE tournament_id=? AND result IS NULL AND teams NOT LIKE '%null%' ORDER BY round, slot LIMIT ?""",
+        (tournament_id, limit)
+    ).fetchall()
+
+def _bracket_final(conn, tournament_id):
+    return conn.execute(
+        "SELECT kind, result FROM bracket_matches WHERE tournament_id=? ORDER BY round DESC, slot LIMIT 1", (tournament_id,)
+    ).fetchone()
+
+def _team_labels(conn, tournament_id, team_nos):
+    """{team_no: "#no Name +n (Lv strength)"} for the given teams."""
+    team_nos = sorted(set(team_nos))
+    if not team_nos:
+        return {}
+    rows = conn.execute(
+        f"SELECT team_no, user_ids, strength FROM bracket_teams WHERE tournament_id=? AND team_no IN ({', '.join('?' * len(team_nos))})",
+        [tournament_id] + team_nos
+    ).fetchall()
+    captains = [int(user_ids.split(",")[0]) for _, user_ids, _ in rows]
+    names = dict(conn.execute(f"SELECT id, name FROM users WHERE id IN ({', '.join('?' * len(captains))})", captains))
+    labels = {}
+    for team_no, user_ids, strength in rows:
+        size = user_ids.count(",") + 1
+        captain = names.get(int(user_ids.split(",")[0])) or "?"
+        labels[team_no] = f"#{team_no} {captain}" + (f" +{size - 1}" if size > 1 else "") + f" (Lv {strength})"
+    return labels
+
+def teams_per_lobby(game_mode):
+    room = GAME_MODE_CAPACITY.get(game_mode, GAME_MODE_CAPACITY["Custom"])
+    return max(2, room // TEAM_SIZES.get(game_mode, 1))
+
+async def seed_tournament(tournament, kind):
+    """
+    Seed a tournament's confirmed players into round-1 lobbies or a knockout
+    bracket. Returns (team count, round-1 team lists with strengths), or
+    None once results are being reported.
+    """
+    tournament_id, game_mode = tournament[0], tournament[4]
+    players = await db_read(_bracket_entrants, tournament_id)
+    teams, strengths = form_teams(players, TEAM_SIZES.get(game_mode, 1))
+    # team numbers are 1-based positions in teams
+    order = [i + 1 for i in sorted(range(len(teams)), key=strengths.__getitem__, reverse=True)]
+    if kind == "knockout":
+        matches = knockout_matches(order) if len(order) > 1 else []
+    else:
+        lobbies = snake_lobbies(order, math.ceil(len(order) / teams_per_lobby(game_mode)))
+        matches = [(1, slot, lobby, None) for slot, lobby in enumerate(lobbies)]
+    if not await db_write(_save_bracket, tournament_id, teams, strengths, kind, matches):
+        return None
+    first_round = [[strengths[team - 1] for team in pair if team] for round_, _, pair, _ in matches if round_ == 1]
+    return len(teams), first_round
+
+async def report_knockout(tournament_id, round_, slot, winner):
+    return await db_write(_report_knockout, tournament_id, round_, slot, winner)
+
+async def report_lobby(tournament_id, game_mode, slot, placement):
+    return await db_write(_report_lobby, tournament_id, slot, placement, teams_per_lobby(game_mode))
+
+# ------------------- MODERATOR OUTBOX -------------------
+OUTBOX_DIGEST_LABELS = {
+    "profile": ("📥", "new profiles"),
+    "tournament": ("🏆", "new tournaments"),
+}
+
+def _enqueue_outbox(conn, chat_id, kind, text, summary):
+    conn.execute(
+        "INSERT INTO outbox (chat_id, kind, text, summary, created_at) VALUES (?, ?, ?, ?, ?)",
+        (chat_id, kind, text, summary, time.time())
+    )
+
+def _due_outbox(conn, now, limit):
+    return conn.execute(
+        "SELECT id, chat_id, kind, text, summary, created_at, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+        (now, limit)
+    ).fetchall()
+
+def _delete_outbox(conn, ids):
+    conn.executemany("DELETE FROM outbox WHERE id=?", [(i,) for i in ids])
+
+def _defer_outbox(conn, ids, now):
+    """Back off ids after a failed send; rows out of attempts are deleted. Returns how many were."""
+    conn.executemany(
+        "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ? + MIN(?, 5 * (1 << MIN(attempts, 16))) WHERE id=?",
+        [(now, OUTBOX_MAX_BACKOFF, i) for i in ids]
+    )
+    before = conn.total_changes
+    conn.executemany("DELETE FROM outbox WHERE id=? AND attempts >= ?", [(i, OUTBOX_MAX_ATTEMPTS) for i in ids])
+    return conn.total_changes - before
+
+def _format_age(seconds):
+    if seconds < 90:
+        return "the last minute"
+    if seconds < 3600:
+        return f"the last {round(seconds / 60)} minutes"
+    return f"the last {round(seconds / 3600)} hours"
+
+class ModeratorOutbox:
+    """
+    Background sender for the persistent outbox table. Handlers only insert a
+    row; this task delivers it to the moderator group at the group's rate
+    limit, retries failures with exponential backoff (up to OUTBOX_MAX_ATTEMPTS),
+    and folds bursts of the same kind into a single digest message.
+
+    text is Markdown with its user-supplied parts already escaped; summary is
+    plain text and escaped here. A message Telegram refuses to parse is sent
+    once more as plain text rather than retried.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_send = 0.0
+
+    async def enqueue(self, kind, text, summary, chat_id=None):
+        await write_batcher.submit(_enqueue_outbox, chat_id or MODERATOR_GROUP_ID, kind, text, escape_markdown(summary))
+        self._wakeup.set()
+
+    def start(self, bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                rows = await db_read(_due_outbox, time.time(), 500)
+                if rows:
+                    await self._deliver(rows)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Moderator outbox iteration failed")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, rows):
+        groups = {}
+        for row in rows:
+            groups.setdefault((row[1], row[2]), []).append(row)
+        for (chat_id, kind), group in groups.items():
+            if len(group) >= OUTBOX_DIGEST_THRESHOLD:
+                await self._send(chat_id, self._digest_text(kind, group), [r[0] for r in group])
+            else:
+                for row in group:
+                    await self._send(chat_id, row[3], [row[0]])
+
+    def _digest_text(self, kind, group):
+        icon, label = OUTBOX_DIGEST_LABELS.get(kind, ("🔔", f"{kind} notifications"))
+        age = time.time() - min(r[5] for r in group)
+        lines = [f"• {r[4]}" for r in group[:20]]
+        if len(group) > 20:
+            lines.append(f"…and {len(group) - 20} more")
+        return f"{icon} *{len(group)} {label} in {_format_age(age)}*\n\n" + "\n".join(lines)
+
+    async def _send(self, chat_id, text, ids):
+        parse_mode = "Markdown"
+        while True:
+            wait = self._last_send + OUTBOX_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_send = time.monotonic()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+            except RetryAfter as e:
+                logger.warning("Moderator group rate limited, retrying in %ss", e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except BadRequest:
+                # retrying won't help; strip the formatting once, then give up on the row
+                if parse_mode is None:
+                    logger.exception("Moderator group rejected notification %s, dropping it", ids)
+                    break
+                logger.warning("Moderator notification %s failed to parse, resending as plain text", ids)
+                parse_mode = None
+                continue
+            except TelegramError:
+                logger.exception("Failed to notify moderator group, will retry")
+                dropped = await db_write(_defer_outbox, ids, time.time())
+                if dropped:
+                    logger.error("Dropped %s moderator notification(s) after %s attempts", dropped, OUTBOX_MAX_ATTEMPTS)
+                return
+            break
+        await db_write(_delete_outbox, ids)
+
+moderator_outbox = ModeratorOutbox()
+
+# ------------------- BROADCASTS -------------------
+class TokenBucket:
+    """Async token bucket. pause() empties it for a while, e.g. after a 429."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+def _create_broadcast(conn, text, parse_mode, admin_chat_id):
+    total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    c = conn.execute(
+        "INSERT INTO broadcasts (text, parse_mode, total, admin_chat_id, created_at) VALUES (?, ?, ?, ?, ?)",
+        (text, parse_mode, total, admin_chat_id, datetime.utcnow().isoformat())
+    )
+    return c.lastrowid
+
+def _get_broadcast(conn, broadcast_id):
+    return conn.execute(
+        "SELECT id, text, parse_mode, status, last_user_id, total, sent, failed, admin_chat_id, progress_message_id FROM broadcasts WHERE id=?",
+        (broadcast_id,)
+    ).fetchone()
+
+def _running_broadcast_ids(conn):
+    return [r[0] for r in conn.execute("SELECT id FROM broadcasts WHERE status='running' ORDER BY id")]
+
+def _broadcast_recipients(conn, after_user_id, limit):
+    # keyset pagination on the primary key: constant cost per page, no OFFSET
+    return conn.execute(
+        "SELECT id, telegram_id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+        (after_user_id, limit)
+    ).fetchall()
+
+def _checkpoint_broadcast(conn, broadcast_id, last_user_id, sent, failed):
+    conn.execute(
+        "UPDATE broadcasts SET last_user_id=?, sent=?, failed=? WHERE id=?",
+        (last_user_id, sent, failed, broadcast_id)
+    )
+
+def _set_broadcast_status(conn, broadcast_id, status):
+    finished_at = datetime.utcnow().isoformat() if status == "done" else None
+    conn.execute("UPDATE broadcasts SET status=?, finished_at=? WHERE id=?", (status, finished_at, broadcast_id))
+
+def _set_broadcast_progress_message(conn, broadcast_id, message_id):
+    conn.execute("UPDATE broadcasts SET progress_message_id=? WHERE id=?", (message_id, broadcast_id))
+
+class BroadcastEngine:
+    """
+    Streams recipients from the users table page by page and sends through a
+    shared token bucket. Progress is checkpointed after every chunk, so a
+    paused or interrupted broadcast resumes where it stopped (at most one
+    chunk is re-sent after a crash).
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.bucket = TokenBucket(BROADCAST_RATE, BROADCAST_RATE)
+        self._tasks = {}
+        self._pause_requested = set()
+
+    async def start(self, bot):
+        self.bot = bot
+        for broadcast_id in await db_read(_running_broadcast_ids):
+            logger.info("Resuming broadcast #%s", broadcast_id)
+            self._launch(broadcast_id)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def create(self, text, parse_mode, admin_chat_id):
+        broadcast_id = await db_write(_create_broadcast, text, parse_mode, admin_chat_id)
+        self._launch(broadcast_id)
+        return broadcast_id
+
+    async def pause(self, broadcast_id):
+        # the sender stops at the next chunk boundary, right after a checkpoint
+        await db_write(_set_broadcast_status, broadcast_id, "paused")
+        if broadcast_id in self._tasks:
+            self._pause_requested.add(broadcast_id)
+
+    async def resume(self, broadcast_id):
+        self._pause_requested.discard(broadcast_id)
+        await db_write(_set_broadcast_status, broadcast_id, "running")
+        self._launch(broadcast_id)
+
+    def _launch(self, broadcast_id):
+        task = self._tasks.get(broadcast_id)
+        if task and not task.done():
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(broadcast_id, None) if self._tasks.get(broadcast_id) is t else None)
 
-# Admin tournament creation states
-ADMIN_TOURNAMENT_NAME, ADMIN_GAME_TYPE, ADMIN_MAP, ADMIN_GAME_MODE, ADMIN_DATE, ADMIN_TIME, ADMIN_ENTRY_FEE, ADMIN_PRIZE = range(8, 16)
+    async def _run(self, broadcast_id):
+        row = await db_read(_get_broadcast, broadcast_id)
+        if not row or row[3] != "running":
+            return
+        _, text, parse_mode, _, last_user_id, total, sent, failed, admin_chat_id, progress_message_id = row
+        last_report = 0.0
+        try:
+            while True:
+                page = await db_read(_broadcast_recipients, last_user_id, BROADCAST_PAGE_SIZE)
+                if not page:
+                    break
+                for i in range(0, len(page), BROADCAST_CHUNK_SIZE):
+                    chunk = page[i:i + BROADCAST_CHUNK_SIZE]
+                    results = await asyncio.gather(*(self.send(tid, text, parse_mode) for _, tid in chunk))
+                    delivered = sum(results)
+                    sent += delivered
+                    failed += len(chunk) - delivered
+                    last_user_id = chunk[-1][0]
+                    await db_write(_checkpoint_broadcast, broadcast_id, last_user_id, sent, failed)
+                    if broadcast_id in self._pause_requested:
+                        self._pause_requested.discard(broadcast_id)
+                        await self._report(broadcast_id, admin_chat_id, progress_message_id, sent, failed, total, "paused")
+                        return
+                    if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                        last_report = time.monotonic()
+                        progress_message_id = await self._report(broadcast_id, admin_chat_id, progress_message_id, sent, failed, total, "running")
+            await db_write(_set_broadcast_status, broadcast_id, "done")
+            await self._report(broadcast_id, admin_chat_id, progress_message_id, sent, failed, total, "done")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Broadcast #%s stopped unexpectedly", broadcast_id)
 
-# ------------------- DB HELPERS -------------------
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # users: id (auto), telegram_id (unique), oto_id (unique), name, game_id, level, state, username, created_at
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE,
-            oto_id TEXT UNIQUE,
-            name TEXT,
-            game_id TEXT,
-            level INTEGER,
-            state TEXT,
-            username TEXT,
-            created_at TEXT
+    async def send(self, chat_id, text, parse_mode):
+        """Send one message through the shared rate limit. Returns True if delivered."""
+        for attempt in range(3):
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                return True
+            except RetryAfter as e:
+                # a 429 applies to the whole bot: stop every sender, then retry
+                logger.warning("Broadcast rate limited, pausing %ss", e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest):
+                # user blocked the bot or the chat is gone
+                return False
+            except TelegramError:
+                await asyncio.sleep(2 ** attempt)
+        return False
+
+    async def _report(self, broadcast_id, chat_id, message_id, sent, failed, total, status):
+        if not chat_id:
+            return message_id
+        done = sent + failed
+        percent = 100 * done // total if total else 100
+        labels = {"running": "📣 Broadcasting", "paused": "⏸️ Paused", "done": "✅ Broadcast finished"}
+        text = (
+            f"{labels[status]} (#{broadcast_id})\n\n"
+            f"Progress: {done}/{total} ({percent}%)\n"
+            f"Delivered: {sent}\n"
+            f"Failed: {failed}"
         )
-        """
+        if status == "running":
+            keyboard = [[InlineKeyboardButton("⏸️ Pause", callback_data=f"bc_pause_{broadcast_id}")]]
+        elif status == "paused":
+            keyboard = [[InlineKeyboardButton("▶️ Resume", callback_data=f"bc_resume_{broadcast_id}")]]
+        else:
+            keyboard = []
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        try:
+            if message_id:
+                await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+                return message_id
+            message = await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+            await db_write(_set_broadcast_progress_message, broadcast_id, message.message_id)
+            return message.message_id
+        except BadRequest:
+            # "message is not modified" and similar
+            return message_id
+        except TelegramError:
+            logger.exception("Failed to report progress of broadcast #%s", broadcast_id)
+            return message_id
+
+broadcaster = BroadcastEngine()
+
+# ------------------- SCHEDULER -------------------
+def _tournament_event(starts_at, status, reminded, now):
+    """
+    (fire_at, kind, reminder index) of a tournament's next lifecycle step, or
+    None once archived. A reminder that was missed (e.g. the bot was down)
+    is skipped once the next reminder or the start is already due.
+    """
+    if status == "upcoming":
+        for i in range(reminded, len(REMINDER_MINUTES)):
+            fire_at = starts_at - REMINDER_MINUTES[i] * 60
+            next_at = starts_at - REMINDER_MINUTES[i + 1] * 60 if i + 1 < len(REMINDER_MINUTES) else starts_at
+            if now < next_at:
+                return fire_at, "remind", i
+        return starts_at, "live", None
+    if status == "live":
+        return starts_at + TOURNAMENT_DURATION_MINUTES * 60, "completed", None
+    if status == "completed":
+        return starts_at + int(ARCHIVE_AFTER_HOURS * 3600), "archived", None
+    return None
+
+def _scheduled_tournaments(conn, until):
+    # range scan on the partial idx_tournaments_schedule
+    return conn.execute(
+        "SELECT id, starts_at, status, reminded FROM tournaments WHERE status != 'archived' AND starts_at <= ?", (until,)
+    ).fetchall()
+
+def _schedule_row(conn, tournament_id):
+    return conn.execute(
+        "SELECT id, name, game_type, map, game_mode, date, time, starts_at, status, reminded FROM tournaments WHERE id=?",
+        (tournament_id,)
+    ).fetchone()
+
+def _advance_tournament(conn, tournament_id, status, reminded, new_status, new_reminded):
+    """Compare-and-set on (status, reminded); False if the row moved on or is gone."""
+    c = conn.execute(
+        "UPDATE tournaments SET status=?, reminded=? WHERE id=? AND status=? AND reminded=?",
+        (new_status, new_reminded, tournament_id, status, reminded)
     )
-    # tournaments: id (auto), name, game_type, map, game_mode, date, time, entry_fee, prize_pool, created_at
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS tournaments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            game_type TEXT,
-            map TEXT,
-            game_mode TEXT,
-            date TEXT,
-            time TEXT,
-            entry_fee INTEGER,
-            prize_pool INTEGER,
-            created_at TEXT
+    return c.rowcount == 1
+
+def _confirmed_players(conn, tournament_id, after_id, limit):
+    return conn.execute(
+        """SELECT r.id, u.telegram_id FROM registrations r JOIN users u ON u.id = r.user_id
+           WHERE r.tournament_id=? AND r.status='confirmed' AND r.id > ? ORDER BY r.id LIMIT ?""",
+        (tournament_id, after_id, limit)
+    ).fetchall()
+
+class TournamentScheduler:
+    """
+    Min-heap of (fire_at, tournament_id) for every lifecycle step due within
+    the next SCHEDULER_HORIZON_HOURS, loaded from idx_tournaments_schedule at
+    startup and re-loaded halfway through each horizon. A tournament has at
+    most one live heap entry (tracked in _next); anything else popped from
+    the heap is stale and skipped. Each step is a compare-and-set on the row,
+    so a restart resumes from the stored status without repeating reminders.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self._heap = []
+        self._next = {}
+        self._loaded_until = 0
+        self._wake = asyncio.Event()
+        self._task = None
+
+    async def start(self, bot):
+        self.bot = bot
+        await self._load()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def schedule(self, tournament_id, starts_at):
+        """Pick up a newly created tournament without waiting for the next horizon load."""
+        if starts_at is None or starts_at > self._loaded_until:
+            return
+        event = _tournament_event(starts_at, "upcoming", 0, time.time())
+        self._push(tournament_id, event[0])
+        self._wake.set()
+
+    def _push(self, tournament_id, fire_at):
+        if self._next.get(tournament_id) == fire_at:
+            return
+        self._next[tournament_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, tournament_id))
+
+    async def _load(self):
+        now = time.time()
+        until = int(now + SCHEDULER_HORIZON_HOURS * 3600)
+        rows = await db_read(_scheduled_tournaments, until)
+        for tournament_id, starts_at, status, reminded in rows:
+            event = _tournament_event(starts_at, status, reminded, now)
+            if event:
+                self._push(tournament_id, event[0])
+        self._loaded_until = until
+        logger.info("Scheduler loaded %d tournaments (%d events pending)", len(rows), len(self._next))
+
+    async def _run(self):
+        reload_every = SCHEDULER_HORIZON_HOURS * 3600 / 2
+        next_load = time.time() + reload_every
+        while True:
+            now = time.time()
+            if now >= next_load:
+                await self._load()
+                next_load = now + reload_every
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, tournament_id = heapq.heappop(self._heap)
+                if self._next.get(tournament_id) != fire_at:
+                    continue
+                del self._next[tournament_id]
+                try:
+                    await self._fire(tournament_id)
+                except Exception:
+                    logger.exception("Scheduled step for tournament %s failed", tournament_id)
+            wake_at = min(self._heap[0][0], next_load) if self._heap else next_load
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(0, wake_at - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, tournament_id):
+        row = await db_read(_schedule_row, tournament_id)
+        if not row or row[7] is None:
+            return
+        status, reminded = row[8], row[9]
+        # catch up through every step that is already due (e.g. after downtime)
+        while True:
+            now = time.time()
+            event = _tournament_event(row[7], status, reminded, now)
+            if not event:
+                return
+            fire_at, kind, index = event
+            if fire_at > now:
+                self._push(tournament_id, fire_at)
+                return
+            new_status, new_reminded = (status, index + 1) if kind == "remind" else (kind, reminded)
+            if not await db_write(_advance_tournament, tournament_id, status, reminded, new_status, new_reminded):
+                return
+            if new_status != status:
+                api_snapshots.invalidate("tournaments")
+            if kind == "remind":
+                spawn_background(self._remind(row, REMINDER_MINUTES[index]))
+            else:
+                logger.info("Tournament %s is now %s", tournament_id, kind)
+            status, reminded = new_status, new_reminded
+
+    async def _remind(self, row, minutes):
+        tournament_id, name, game_type, map_name, game_mode, date, time_ = row[:7]
+        text = (
+            f"⏰ *{escape_markdown(name)}* starts in {minutes} minutes!\n\n"
+            f"🎮 {game_type} | 🗺️ {escape_markdown(map_name)} | 🎯 {escape_markdown(game_mode)}\n"
+            f"📅 {date} at {time_}"
         )
-        """
-    )
-    conn.commit()
-    conn.close()
+        # same keyset paging and shared token bucket as broadcasts
+        sent, after_id = 0, 0
+        while True:
+            page = await db_read(_confirmed_players, tournament_id, after_id, BROADCAST_PAGE_SIZE)
+            if not page:
+                break
+            for i in range(0, len(page), BROADCAST_CHUNK_SIZE):
+                chunk = page[i:i + BROADCAST_CHUNK_SIZE]
+                results = await asyncio.gather(*(broadcaster.send(chat_id, text, "Markdown") for _, chat_id in chunk))
+                sent += sum(results)
+            after_id = page[-1][0]
+        logger.info("Sent %d-minute reminder for tournament %s to %d players", minutes, tournament_id, sent)
 
-def get_user_by_telegram_id(telegram_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, telegram_id, oto_id, name, game_id, level, state, username, created_at FROM users WHERE telegram_id=?", (telegram_id,))
-    row = c.fetchone()
-    conn.close()
-    return row
+scheduler = TournamentScheduler()
 
-def create_user(telegram_id, name, game_id, level, state, username):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    created_at = datetime.utcnow().isoformat()
-    # Insert without oto_id first to get autoincrement id
+# ------------------- MAINTENANCE -------------------
+def _backup_database(path):
+    """
+    Copy DB_PATH to path with the online backup API, BACKUP_PAGES_PER_STEP
+    pages at a time. The source connection holds one read transaction for
+    the whole copy, so the backup is a consistent snapshot that concurrent
+    writers (WAL) neither wait for nor restart.
+    """
+    partial = path + ".partial"
+    source = _open_connection(DB_PATH)
+    target = sqlite3.connect(partial)
     try:
-        c.execute(
-            "INSERT INTO users (telegram_id, name, game_id, level, state, username, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (telegram_id, name, game_id, level, state, username, created_at)
+        source.execute("BEGIN")
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=0.005)
+        source.execute("COMMIT")
+    finally:
+        target.close()
+        source.close()
+    os.replace(partial, path)
+
+def _prune_backups(directory, keep):
+    names = os.listdir(directory)
+    backups = sorted(f for f in names if f.startswith("data-") and f.endswith(".db"))
+    # .partial files here are left over from a run that was interrupted
+    stale = [f for f in names if f.startswith("data-") and ".db.partial" in f]
+    for name in (backups[:-keep] if keep > 0 else []) + stale:
+        os.remove(os.path.join(directory, name))
+
+# Spelled out rather than copied from main with CREATE TABLE ... AS SELECT: that
+# drops the keys, and SELECT * stops lining up as soon as main gains a column.
+# A column added to main is only archived once it is added here (and ALTERed
+# into existing archive files).
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS archive.tournaments (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        game_type TEXT,
+        map TEXT,
+        game_mode TEXT,
+        date TEXT,
+        time TEXT,
+        entry_fee INTEGER,
+        prize_pool INTEGER,
+        created_at TEXT,
+        capacity INTEGER,
+        seats_taken INTEGER,
+        starts_at INTEGER,
+        status TEXT,
+        reminded INTEGER
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive.registrations (
+        id INTEGER PRIMARY KEY,
+        tournament_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive.match_results (
+        tournament_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        placement INTEGER NOT NULL,
+        kills INTEGER NOT NULL,
+        points INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        PRIMARY KEY (tournament_id, user_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive.bracket_teams (
+        tournament_id INTEGER NOT NULL,
+        team_no INTEGER NOT NULL,
+        user_ids TEXT NOT NULL,
+        strength INTEGER NOT NULL,
+        PRIMARY KEY (tournament_id, team_no)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS archive.bracket_matches (
+        tournament_id INTEGER NOT NULL,
+        round INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        teams TEXT NOT NULL,
+        result TEXT,
+        PRIMARY KEY (tournament_id, round, slot)
+    ) WITHOUT ROWID""",
+]
+
+# table -> (column selecting a batch, columns copied)
+ARCHIVE_TABLES = {
+    "tournaments": ("id", (
+        "id", "name", "game_type", "map", "game_mode", "date", "time", "entry_fee", "prize_pool",
+        "created_at", "capacity", "seats_taken", "starts_at", "status", "reminded",
+    )),
+    "registrations": ("tournament_id", ("id", "tournament_id", "user_id", "status", "created_at")),
+    "match_results": ("tournament_id", ("tournament_id", "user_id", "placement", "kills", "points", "created_at")),
+    "bracket_teams": ("tournament_id", ("tournament_id", "team_no", "user_ids", "strength")),
+    "bracket_matches": ("tournament_id", ("tournament_id", "round", "slot", "kind", "teams", "result")),
+}
+
+def _archive_batch(conn, cutoff, limit):
+    """Move up to limit finished tournaments that started before cutoff into the archive database."""
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM tournaments WHERE status IN ('completed', 'archived') AND starts_at < ? ORDER BY starts_at LIMIT ?",
+        (cutoff, limit)
+    )]
+    if not ids:
+        return 0
+    marks = ", ".join("?" * len(ids))
+    # Commits across attached WAL databases are atomic per file only: if we die
+    # between the two, the next run copies the batch again (ignored, the archive
+    # tables share main's keys) and deletes it.
+    for table, (column, columns) in ARCHIVE_TABLES.items():
+        names = ", ".join(columns)
+        conn.execute(
+            f"INSERT OR IGNORE INTO archive.{table} ({names}) SELECT {names} FROM main.{table} WHERE {column} IN ({marks})",
+            ids
         )
-        user_row_id = c.lastrowid
-        # Generate OTO ID: OTO + zero-padded user_row_id (6 digits)
-        oto_id = f"OTO{str(user_row_id).zfill(6)}"
-        c.execute("UPDATE users SET oto_id=? WHERE id=?", (oto_id, user_row_id))
-        conn.commit()
-        # Return the full user row
-        c.execute("SELECT id, telegram_id, oto_id, name, game_id, level, state, username, created_at FROM users WHERE id=?", (user_row_id,))
-        new_row = c.fetchone()
-        conn.close()
-        return new_row
-    except sqlite3.IntegrityError as e:
-        conn.rollback()
-        conn.close()
-        raise
+    conn.execute(f"DELETE FROM main.match_results WHERE tournament_id IN ({marks})", ids)
+    # registrations and bracket rows go with their tournament (ON DELETE CASCADE)
+    conn.execute(f"DELETE FROM main.tournaments WHERE id IN ({marks})", ids)
+    return len(ids)
 
-def save_tournament_to_db(t):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    created_at = datetime.utcnow().isoformat()
-    c.execute(
-        """INSERT INTO tournaments (name, game_type, map, game_mode, date, time, entry_fee, prize_pool, created_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (t["name"], t["game_type"], t["map"], t["game_mode"], t["date"], t["time"], t["entry_fee"], t["prize_pool"], created_at)
-    )
-    conn.commit()
-    new_id = c.lastrowid
-    conn.close()
-    return new_id
-
-def get_recent_tournaments(limit=10):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, game_type, map, game_mode, date, time, entry_fee, prize_pool FROM tournaments ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+def _run_archive_batch(cutoff, limit, queued_at):
+    # ATTACH/DETACH can't run inside a transaction, so this wraps _run_write on the writer thread
+    conn = _thread_connection()
+    conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+    try:
+        for sql in ARCHIVE_SCHEMA:
+            conn.execute(sql)
+        return _run_write(_archive_batch, (cutoff, limit), None, queued_at)
+    finally:
+        conn.execute("DETACH DATABASE archive")
+
+def _run_incremental_vacuum(pages, queued_at):
+    # cursor.execute() steps a PRAGMA only once (one page freed), while
+    # executescript() runs it to completion as its own autocommit transaction
+    DB_WAIT_SECONDS.observe("write", time.perf_counter() - queued_at)
+    conn = _thread_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0  # incremental_vacuum would be a no-op
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+async def run_maintenance():
+    """
+    Every MAINTENANCE_INTERVAL_HOURS: take a backup, archive old tournaments in
+    ARCHIVE_BATCH-sized transactions, then release free pages in
+    VACUUM_PAGES_PER_STEP steps. Queued writes slot in between the small
+    transactions instead of waiting for the whole job.
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(min(60, MAINTENANCE_INTERVAL_HOURS * 3600))
+    while True:
+        started = time.monotonic()
+        try:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            path = os.path.join(BACKUP_DIR, f"data-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.db")
+            await loop.run_in_executor(None, _backup_database, path)
+            await loop.run_in_executor(None, _prune_backups, BACKUP_DIR, BACKUP_KEEP)
+            maintenance_stats["last_backup"] = time.time()
+
+            cutoff = int(time.time() - ARCHIVE_RETENTION_DAYS * 86400)
+            archived = 0
+            while True:
+                moved = await loop.run_in_executor(
+                    _db_write_executor, _run_archive_batch, cutoff, ARCHIVE_BATCH, time.perf_counter()
+                )
+                archived += moved
+                if moved < ARCHIVE_BATCH:
+                    break
+            if archived:
+                api_snapshots.invalidate("tournaments")
+            maintenance_stats["archived"] += archived
+
+            free = None
+            while True:
+                remaining = await loop.run_in_executor(
+                    _db_write_executor, _run_incremental_vacuum, VACUUM_PAGES_PER_STEP, time.perf_counter()
+                )
+                # stop when done, or when a step stops making progress
+                if not remaining or (free is not None and remaining >= free):
+                    break
+                free = remaining
+                await asyncio.sleep(0.05)
+            logger.info("Maintenance: backup %s, %d tournaments archived, %.1fs",
+                        path, archived, time.monotonic() - started)
+        except Exception:
+            logger.exception("Maintenance run failed")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_HOURS * 3600)
+
+maintenance_stats = {"last_backup": 0, "archived": 0}
 
 # ------------------- VALIDATIONS -------------------
 def validate_name(name):
@@ -168,17 +2601,18 @@ def validate_level(level):
     except ValueError:
         return False, "Level must be a number"
 
+VALID_STATES = [
+    "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh",
+    "Goa", "Gujarat", "Haryana", "Himachal Pradesh", "Jharkhand", "Karnataka",
+    "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur", "Meghalaya", "Mizoram",
+    "Nagaland", "Odisha", "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu",
+    "Telangana", "Tripura", "Uttar Pradesh", "Uttarakhand", "West Bengal",
+    "Delhi", "Jammu and Kashmir", "Ladakh", "Puducherry", "Chandigarh",
+    "Andaman and Nicobar Islands", "Dadra and Nagar Haveli", "Daman and Diu", "Lakshadweep"
+]
+
 def validate_state(state):
-    valid_states = [
-        "Andhra Pradesh", "Arunachal Pradesh", "Assam", "Bihar", "Chhattisgarh",
-        "Goa", "Gujarat", "Haryana", "Himachal Pradesh", "Jharkhand", "Karnataka",
-        "Kerala", "Madhya Pradesh", "Maharashtra", "Manipur", "Meghalaya", "Mizoram",
-        "Nagaland", "Odisha", "Punjab", "Rajasthan", "Sikkim", "Tamil Nadu",
-        "Telangana", "Tripura", "Uttar Pradesh", "Uttarakhand", "West Bengal",
-        "Delhi", "Jammu and Kashmir", "Ladakh", "Puducherry", "Chandigarh",
-        "Andaman and Nicobar Islands", "Dadra and Nagar Haveli", "Daman and Diu", "Lakshadweep"
-    ]
-    if state.strip().title() not in valid_states:
+    if state.strip().title() not in VALID_STATES:
         return False, "Please enter a valid Indian state"
     return True, ""
 
@@ -198,15 +2632,136 @@ def validate_time(time_str):
     except ValueError:
         return False, "Time must be in HH:MM format (e.g., 18:30)"
 
-# ------------------- BOT HANDLERS -------------------
-async def build_main_menu_for_user(telegram_id, user_obj=None):
-    """
-    Build a menu. If user_obj is None -> user doesn't have a profile yet.
-    """
+# ------------------- BULK IMPORT / EXPORT -------------------
+IMPORT_FIELDS = ("name", "game_type", "map", "game_mode", "date", "time", "entry_fee", "prize_pool")
+
+def _lookup(value, choices):
+    """Case-insensitive match of value against choices; game types also accept their short code (bgmi, codm...)."""
+    value = value.strip().lower()
+    for key, choice in choices.items():
+        if value in (choice.lower(), key.lower(), key.lower().partition("_")[2]):
+            return choice
+    return None
+
+def validate_import_row(raw):
+    """(tournament dict, "") for a valid row, else (None, error message)."""
+    missing = [f for f in IMPORT_FIELDS if not str(raw.get(f) or "").strip()]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    t = {f: str(raw[f]).strip() for f in IMPORT_FIELDS}
+    if len(t["name"]) > 100 or len(t["map"]) > 30:
+        return None, "name or map is too long"
+    t["game_type"] = _lookup(t["game_type"], GAME_TYPES)
+    if not t["game_type"]:
+        return None, f"game_type must be one of {', '.join(GAME_TYPES.values())}"
+    t["game_mode"] = _lookup(t["game_mode"], {mode: mode for mode in GAME_MODE_CAPACITY})
+    if not t["game_mode"]:
+        return None, f"game_mode must be one of {', '.join(GAME_MODE_CAPACITY)}"
+    for check, field in ((validate_date, "date"), (validate_time, "time")):
+        is_valid, error_msg = check(t[field])
+        if not is_valid:
+            return None, error_msg
+    for field in ("entry_fee", "prize_pool"):
+        try:
+            t[field] = int(t[field])
+        except ValueError:
+            return None, f"{field} must be a number"
+        if t[field] < 0:
+            return None, f"{field} cannot be negative"
+    return t, ""
+
+def _import_records(stream, fmt):
+    """Yield (line number, raw dict or None) from a CSV (with header) or JSONL text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for raw in reader:
+            yield reader.line_num, raw
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            raw = json.loads(line)
+        except ValueError:
+            raw = None
+        yield line_no, raw if isinstance(raw, dict) else None
+
+def parse_tournament_import(stream, fmt, max_errors=10):
+    """Validate a whole upload; returns (tournaments, errors, error count)."""
+    tournaments, errors, error_count = [], [], 0
+    for line_no, raw in _import_records(stream, fmt):
+        if len(tournaments) + error_count >= IMPORT_MAX_ROWS:
+            errors.append(f"more than {IMPORT_MAX_ROWS} rows")
+            return tournaments, errors, error_count + 1
+        t, error_msg = validate_import_row(raw) if raw is not None else (None, "not a JSON object")
+        if t:
+            tournaments.append(t)
+            continue
+        error_count += 1
+        if len(errors) < max_errors:
+            errors.append(f"line {line_no}: {error_msg}")
+    return tournaments, errors, error_count
+
+def _import_tournaments(conn, tournaments):
+    # rows already scheduled for the same name/date/time are skipped, so a
+    # re-uploaded schedule does not create duplicates
+    first_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM tournaments").fetchone()[0]
+    created_at = datetime.utcnow().isoformat()
+    conn.executemany(
+        """INSERT INTO tournaments (name, game_type, map, game_mode, date, time, entry_fee, prize_pool, capacity, starts_at, created_at)
+           SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+           WHERE NOT EXISTS (SELECT 1 FROM tournaments WHERE date = ?5 AND time = ?6 AND name = ?1)""",
+        (_tournament_values(t, created_at) for t in tournaments)
+    )
+    return conn.execute("SELECT id, starts_at FROM tournaments WHERE id > ?", (first_id,)).fetchall()
+
+async def import_tournaments(tournaments):
+    """Insert validated tournaments in one transaction; returns [(id, starts_at)] of the new rows."""
+    created = await db_write(_import_tournaments, tournaments)
+    api_snapshots.invalidate("tournaments")
+    return created
+
+EXPORTS = {
+    "users": USER_COLUMNS,
+    "tournaments": f"{TOURNAMENT_COLUMNS}, capacity, seats_taken, status, starts_at",
+}
+
+def _export_table(conn, table, fmt, path):
+    """Stream a table into a gzipped CSV/JSONL file, EXPORT_CHUNK_ROWS at a time. Returns the row count."""
+    columns = EXPORTS[table]
+    names = columns.split(", ")
+    cursor = conn.execute(f"SELECT {columns} FROM {table} ORDER BY id")
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as out:
+        writer = csv.writer(out) if fmt == "csv" else None
+        if writer:
+            writer.writerow(names)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(rows)
+            else:
+                out.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+async def export_table(table, fmt, path):
+    return await db_read(_export_table, table, fmt, path)
+
+# ------------------- RENDERING -------------------
+# Keyboards only differ by whether the user has a profile and is an admin, so
+# every variant is built once at import and shared (telegram objects are
+# immutable). Cards are cached per row tuple: an edited row is a new tuple and
+# renders fresh, and Markdown escaping runs once per row version.
+def _build_main_menu(has_profile, is_admin):
     keyboard = []
-    if user_obj:
-        # user has profile
+    if is_admin:
+        keyboard.append([InlineKeyboardButton("🛠️ Admin Panel", callback_data="admin_panel")])
+    if has_profile:
         keyboard.append([InlineKeyboardButton("🏆 View Tournaments", url=f"{MINI_APP_URL}/tournaments")])
+        keyboard.append([InlineKeyboardButton("🎟️ Join a Tournament", callback_data="browse_tournaments")])
         keyboard.append([InlineKeyboardButton("👤 View Profile", callback_data="view_profile")])
         keyboard.append([InlineKeyboardButton("💰 Wallet", url=f"{MINI_APP_URL}/wallet")])
         keyboard.append([InlineKeyboardButton("🛒 Store", url=f"{MINI_APP_URL}/store")])
@@ -220,27 +2775,78 @@ async def build_main_menu_for_user(telegram_id, user_obj=None):
         keyboard.append([InlineKeyboardButton("📞 Contact Us", callback_data="contact")])
     return InlineKeyboardMarkup(keyboard)
 
+MAIN_MENUS = {
+    (has_profile, is_admin): _build_main_menu(has_profile, is_admin)
+    for has_profile in (False, True) for is_admin in (False, True)
+}
+
+def main_menu(telegram_id, user_row):
+    """Menu for a user; user_row is None when they have no profile yet."""
+    return MAIN_MENUS[(user_row is not None, telegram_id in ADMIN_IDS)]
+
+def _profile_fields(row):
+    _, telegram_id, oto_id, name, game_id, level, state, username, created_at = row
+    return (
+        f"👤 *Name:* {escape_markdown(name or '')}\n"
+        f"🎮 *Game ID:* {escape_markdown(game_id or '')}\n"
+        f"🔥 *Level:* {level}\n"
+        f"🌍 *State:* {escape_markdown(state or '')}\n"
+        f"🆔 *OTO ID:* {oto_id}\n"
+    )
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def profile_card(row):
+    return (
+        _profile_fields(row)
+        + f"📱 *Username:* @{escape_markdown(row[7] or 'N/A')}\n"
+        f"🕒 *Joined:* {row[8]}"
+    )
+
+def new_profile_card(row):
+    # Rendered once per signup, so not worth caching
+    return (
+        "✅ *Profile Created Successfully!*\n\n"
+        + _profile_fields(row)
+        + f"👥 *Telegram ID:* {row[1]}\n"
+        f"📱 *Username:* @{escape_markdown(row[7] or 'N/A')}"
+    )
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def admin_user_card(row):
+    _, telegram_id, oto_id, name, game_id, level, state, username, created_at = row
+    return (
+        f"👤 *{escape_markdown(name or '')}* ({oto_id})\n"
+        f"🎮 {escape_markdown(game_id or '')} | 🔥 Lv {level} | 🌍 {escape_markdown(state or '')}\n"
+        f"📱 @{escape_markdown(username or 'N/A')} | 🆔 {telegram_id} | 🕒 {(created_at or '')[:10]}"
+    )
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def tournament_card(row):
+    tid, name, game_type, map_name, game_mode, date, time_, entry_fee, prize_pool = row
+    return (
+        f"🏆 *{escape_markdown(name)}* (ID: {tid})\n"
+        f"🎮 {game_type} | 🗺️ {escape_markdown(map_name)} | 🎯 {escape_markdown(game_mode)}\n"
+        f"📅 {date} at {time_}\n"
+        f"💰 ₹{entry_fee} | 🏆 ₹{prize_pool}"
+    )
+
+# ------------------- BOT HANDLERS -------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
         # check if user exists
-        user_row = get_user_by_telegram_id(user.id)
+        user_row = await get_user_by_telegram_id(user.id)
+        # t.me/<bot>?start=<referrer id> arrives as /start <referrer id>
+        referrer = parse_referral_payload(context.args or [])
+        if referrer and not user_row:
+            await record_referral(user.id, referrer)
         welcome_text = (
-            f"👋 Hello {user.first_name or 'Gamer'}!\n\n"
+            f"👋 Hello {escape_markdown(user.first_name or 'Gamer')}!\n\n"
             "Welcome to *OTO Tournament Bot* 🎮\n\n"
             "Use this bot to join tournaments, manage wallet, shop in the store, and view leaderboards.\n\n"
             "Choose from the menu below 👇"
         )
-
-        # Add admin panel button for admins if this is an admin
-        reply_markup = await build_main_menu_for_user(user.id, user_row)
-
-        if user.id in ADMIN_IDS:
-            # insert admin panel button at top if admin
-            admin_button = [InlineKeyboardButton("🛠️ Admin Panel", callback_data="admin_panel")]
-            # Put at the beginning by rebuilding markup
-            buttons = [[admin_button[0]]] + reply_markup.inline_keyboard
-            reply_markup = InlineKeyboardMarkup(buttons)
+        reply_markup = main_menu(user.id, user_row)
 
         if update.message:
             await update.message.reply_text(
@@ -315,8 +2921,7 @@ async def admin_ask_game_type(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def admin_handle_game_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    game_map = {"game_freefire": "Free Fire", "game_bgmi": "BGMI", "game_codm": "COD Mobile", "game_valorant": "Valorant Mobile"}
-    context.user_data["game_type"] = game_map.get(query.data, "Unknown")
+    context.user_data["game_type"] = GAME_TYPES.get(query.data, "Unknown")
     # maps selection
     if query.data == "game_freefire":
         keyboard = [
@@ -416,51 +3021,744 @@ async def admin_save_tournament(update: Update, context: ContextTypes.DEFAULT_TY
         "prize_pool": context.user_data["prize_pool"]
     }
 
-    # save to DB
+    # save to DB
+    try:
+        new_id = await save_tournament_to_db(tournament)
+        scheduler.schedule(new_id, tournament_starts_at(tournament["date"], tournament["time"]))
+        summary_text = (
+            "✅ *Tournament Created Successfully!*\n\n"
+            f"🏆 *Name:* {escape_markdown(tournament['name'])}\n"
+            f"🎮 *Game:* {tournament['game_type']}\n"
+            f"🗺️ *Map:* {escape_markdown(tournament['map'])}\n"
+            f"🎯 *Mode:* {escape_markdown(tournament['game_mode'])}\n"
+            f"📅 *Date:* {tournament['date']}\n"
+            f"⏰ *Time:* {tournament['time']}\n"
+            f"💰 *Entry Fee:* ₹{tournament['entry_fee']}\n"
+            f"🏆 *Prize Pool:* ₹{tournament['prize_pool']}\n"
+            f"🎟️ *Slots:* {GAME_MODE_CAPACITY.get(tournament['game_mode'], GAME_MODE_CAPACITY['Custom'])}\n"
+            f"🆔 *Tournament ID:* {new_id}"
+        )
+        keyboard = [[InlineKeyboardButton("📣 Announce to all players", callback_data=f"admin_announce_{new_id}")]]
+        await update.message.reply_text(summary_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+        # notify moderator group (delivered in the background by the outbox)
+        try:
+            await moderator_outbox.enqueue("tournament", f"🏆 *New Tournament Created!*\n\n{summary_text}", f"{tournament['name']} (ID: {new_id})")
+        except Exception:
+            logger.exception("Failed to queue moderator notification about new tournament")
+    except Exception:
+        logger.exception("Failed to save tournament to DB")
+        await update.message.reply_text("❌ Failed to create tournament, try again later.")
+    context.user_data.clear()
+    return ConversationHandler.END
+
+# ------------------- ADMIN BROWSERS -------------------
+def _encode_cursor(key):
+    return "|".join(str(v) for v in key)
+
+def _decode_cursor(parts):
+    # the last sort column is always the integer id
+    return tuple(parts[:-1]) + (int(parts[-1]),)
+
+def _browser_nav_row(prefix, rows, has_more, cursor, backwards, key_of):
+    if not rows:
+        return []
+    has_prev = has_more if backwards else cursor is not None
+    has_next = True if backwards else has_more
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{prefix}|p|{_encode_cursor(key_of(rows[0]))}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"{prefix}|n|{_encode_cursor(key_of(rows[-1]))}"))
+    return [nav] if nav else []
+
+async def _send_browser(update, text, keyboard):
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    if update.callback_query:
+        await update.callback_query.message.edit_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+
+async def show_tournament_browser(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, backwards=False):
+    browser = context.user_data.get("tournament_browser", {})
+    rows, has_more, sort_cols = await db_read(
+        _browse_tournaments, browser.get("game_type"), browser.get("date"), cursor, backwards, BROWSER_PAGE_SIZE
+    )
+    delete_mode = browser.get("delete", False)
+    title = "🗑️ *Delete Tournament*" if delete_mode else "📋 *Tournaments*"
+    filters_text = " | ".join(v for v in (browser.get("game_type"), browser.get("date")) if v)
+    lines = [title + (f" ({escape_markdown(filters_text)})" if filters_text else "") + "\n"]
+    keyboard = []
+    if not rows:
+        lines.append("No tournaments found.")
+    for row in rows:
+        lines.append(tournament_card(row) + "\n")
+        if delete_mode:
+            keyboard.append([InlineKeyboardButton(f"🗑️ Delete #{row[0]} {row[1][:30]}", callback_data=f"tdel_{row[0]}")])
+    if not delete_mode:
+        lines.append("Filter: /admin\\_tournaments [freefire|bgmi|codm|valorant] [YYYY-MM-DD]")
+    index = {col: i for i, col in enumerate(TOURNAMENT_COLUMNS.split(", "))}
+    key_of = lambda row: tuple(row[index[col]] for col in sort_cols)
+    keyboard += _browser_nav_row("tb", rows, has_more, cursor, backwards, key_of)
+    keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")])
+    await _send_browser(update, "\n".join(lines), keyboard)
+
+async def show_user_browser(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, backwards=False):
+    browser = context.user_data.get("user_browser", {})
+    rows, has_more, sort_cols = await db_read(
+        _browse_users, browser.get("state"), browser.get("joined"), cursor, backwards, BROWSER_PAGE_SIZE
+    )
+    filters_text = " | ".join(v for v in (browser.get("state"), browser.get("joined") and f"joined {browser['joined']}") if v)
+    lines = ["👥 *Users*" + (f" ({escape_markdown(filters_text)})" if filters_text else "") + "\n"]
+    if not rows:
+        lines.append("No users found.")
+    for row in rows:
+        lines.append(admin_user_card(row) + "\n")
+    lines.append("Filter: /admin\\_users [state] [YYYY-MM-DD]")
+    index = {col: i for i, col in enumerate(USER_COLUMNS.split(", "))}
+    key_of = lambda row: tuple(row[index[col]] for col in sort_cols)
+    keyboard = _browser_nav_row("ub", rows, has_more, cursor, backwards, key_of)
+    keyboard.append([InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")])
+    await _send_browser(update, "\n".join(lines), keyboard)
+
+async def admin_view_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    await query.answer()
+    context.user_data["tournament_browser"] = {}
+    await show_tournament_browser(update, context)
+
+async def admin_delete_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    await query.answer()
+    context.user_data["tournament_browser"] = {"delete": True}
+    await show_tournament_browser(update, context)
+
+async def admin_view_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    await query.answer()
+    context.user_data["user_browser"] = {}
+    await show_user_browser(update, context)
+
+async def cmd_admin_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    browser = {}
+    for arg in context.args:
+        game_type = GAME_TYPES.get(f"game_{arg.lower()}")
+        if game_type:
+            browser["game_type"] = game_type
+        elif re.match("^\\d{4}-\\d{2}-\\d{2}$", arg):
+            browser["date"] = arg
+        else:
+            await update.message.reply_text("Usage: /admin_tournaments [freefire|bgmi|codm|valorant] [YYYY-MM-DD]")
+            return
+    context.user_data["tournament_browser"] = browser
+    await show_tournament_browser(update, context)
+
+async def cmd_admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    browser = {}
+    state_words = []
+    for arg in context.args:
+        if re.match("^\\d{4}-\\d{2}-\\d{2}$", arg):
+            browser["joined"] = arg
+        else:
+            state_words.append(arg)
+    if state_words:
+        state = " ".join(state_words)
+        is_valid, error_msg = validate_state(state)
+        if not is_valid:
+            await update.message.reply_text(f"❌ {error_msg}")
+            return
+        browser["state"] = state.strip().title()
+    context.user_data["user_browser"] = browser
+    await show_user_browser(update, context)
+
+async def browser_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    await query.answer()
+    prefix, direction, *cursor = query.data.split("|")
+    show = show_tournament_browser if prefix == "tb" else show_user_browser
+    await show(update, context, cursor=_decode_cursor(cursor), backwards=direction == "p")
+
+async def confirm_delete_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    await query.answer()
+    tid = int(query.data.rsplit("_", 1)[1])
+    if query.data.startswith("tdel_yes_"):
+        try:
+            deleted = await delete_tournament(tid)
+        except sqlite3.IntegrityError:
+            await query.message.edit_text(f"❌ Tournament {tid} has recorded results and can't be deleted.")
+            return
+        await query.message.edit_text(
+            f"✅ Tournament {tid} deleted." if deleted else f"❌ Tournament {tid} not found.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]])
+        )
+        return
+    row = await get_tournament(tid)
+    if not row:
+        await query.message.edit_text(f"❌ Tournament {tid} not found.")
+        return
+    keyboard = [
+        [InlineKeyboardButton("✅ Yes, delete", callback_data=f"tdel_yes_{tid}")],
+        [InlineKeyboardButton("❌ No, go back", callback_data="admin_delete_tournament")]
+    ]
+    await query.message.edit_text(
+        f"🗑️ Delete tournament *{escape_markdown(row[1])}* (ID: {tid}) on {row[5]} at {row[6]}?",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode="Markdown"
+    )
+
+# ------------------- ADMIN BROADCAST -------------------
+async def admin_announce_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    await query.answer()
+    row = await get_tournament(int(query.data.rsplit("_", 1)[1]))
+    if not row:
+        await query.message.reply_text("❌ Tournament not found.")
+        return
+    announcement = (
+        "📢 *New Tournament!*\n\n"
+        f"{tournament_card(row)}\n\n"
+        f"Join now: {MINI_APP_URL}/tournaments"
+    )
+    broadcast_id = await broadcaster.create(announcement, "Markdown", update.effective_chat.id)
+    await query.edit_message_reply_markup(reply_markup=None)
+    await query.message.reply_text(f"📣 Announcement started as broadcast #{broadcast_id}.")
+
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    # keep the admin's own line breaks: take everything after the command
+    text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await update.message.reply_text("Usage: /broadcast <message to send to every registered user>")
+        return
+    broadcast_id = await broadcaster.create(text, None, update.effective_chat.id)
+    await update.message.reply_text(f"📣 Broadcast #{broadcast_id} started.")
+
+async def broadcast_control(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    _, action, broadcast_id = query.data.split("_")
+    if action == "pause":
+        await broadcaster.pause(int(broadcast_id))
+        await query.answer("⏸️ Pausing after the current batch…")
+    else:
+        await broadcaster.resume(int(broadcast_id))
+        await query.answer("▶️ Resumed")
+
+# ------------------- ADMIN SEARCH -------------------
+async def cmd_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text("Usage: /search <name, OTO ID, game ID, username or tournament>")
+        return
+    users, tournaments = await search(text)
+    lines = [f"🔎 *Search:* {escape_markdown(text)}\n"]
+    if users:
+        lines.append("*Players*")
+        lines += [admin_user_card(row) + "\n" for row in users]
+    if tournaments:
+        lines.append("*Tournaments*")
+        lines += [tournament_card(row) + "\n" for row in tournaments]
+    if not users and not tournaments:
+        lines.append("No matches.")
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline mode (@bot <query>) for admins; needs inline mode enabled in BotFather."""
+    inline_query = update.inline_query
+    text = inline_query.query.strip()
+    if inline_query.from_user.id not in ADMIN_IDS or len(text) < 2:
+        await inline_query.answer([], cache_time=int(SEARCH_CACHE_TTL), is_personal=True)
+        return
+    users, tournaments = await search(text, limit=25)
+    results = [
+        InlineQueryResultArticle(
+            id=f"u{row[0]}",
+            title=f"{row[3]} ({row[2]})",
+            description=f"🎮 {row[4]} | Lv {row[5]} | {row[6]} | @{row[7] or 'N/A'}",
+            input_message_content=InputTextMessageContent(admin_user_card(row), parse_mode="Markdown"),
+        )
+        for row in users
+    ] + [
+        InlineQueryResultArticle(
+            id=f"t{row[0]}",
+            title=f"🏆 {row[1]} (ID: {row[0]})",
+            description=f"{row[2]} | {row[3]} | {row[5]} {row[6]}",
+            input_message_content=InputTextMessageContent(tournament_card(row), parse_mode="Markdown"),
+        )
+        for row in tournaments
+    ]
+    await inline_query.answer(results, cache_time=int(SEARCH_CACHE_TTL), is_personal=True)
+
+# ------------------- ADMIN IMPORT / EXPORT -------------------
+# Telegram bots may download files up to 20 MB and upload up to 50 MB
+IMPORT_MAX_BYTES = 20 * 1024 * 1024
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+async def admin_import_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/import_tournaments as the caption of a CSV/JSONL upload, or as a reply to one."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    message = update.message
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    fmt = document and (document.file_name or "").rpartition(".")[2].lower()
+    if fmt not in ("csv", "jsonl"):
+        await message.reply_text(
+            "Usage: send a .csv or .jsonl file with the caption /import\\_tournaments (or reply to one with it).\n\n"
+            f"Columns: {escape_markdown(', '.join(IMPORT_FIELDS))}\n"
+            "Dates are YYYY-MM-DD and times HH:MM.",
+            parse_mode="Markdown"
+        )
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+        await message.reply_text("❌ File is too large (20 MB max).")
+        return
+    data = await (await document.get_file()).download_as_bytearray()
+    try:
+        stream = io.StringIO(bytes(data).decode("utf-8-sig"), newline="")
+    except UnicodeDecodeError:
+        await message.reply_text("❌ File must be UTF-8 text.")
+        return
+    tournaments, errors, error_count = parse_tournament_import(stream, fmt)
+    if error_count:
+        lines = [f"❌ Nothing imported: {error_count} invalid row(s)."] + errors
+        if error_count > len(errors):
+            lines.append("…")
+        await message.reply_text("\n".join(lines))
+        return
+    if not tournaments:
+        await message.reply_text("❌ The file has no tournaments.")
+        return
+    created = await import_tournaments(tournaments)
+    for tournament_id, starts_at in created:
+        scheduler.schedule(tournament_id, starts_at)
+    skipped = len(tournaments) - len(created)
+    await message.reply_text(
+        f"✅ Imported {len(created)} tournament(s)."
+        + (f" Skipped {skipped} already scheduled (same name, date and time)." if skipped else "")
+    )
+
+async def cmd_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    args = [a.lower() for a in context.args]
+    table = args[0] if args else None
+    fmt = args[1] if len(args) > 1 else "csv"
+    if table not in EXPORTS or fmt not in ("csv", "jsonl"):
+        await update.message.reply_text("Usage: /export <users|tournaments> [csv|jsonl]")
+        return
+    with tempfile.TemporaryDirectory(prefix="oto-export-") as scratch:
+        filename = f"{table}-{datetime.now().strftime('%Y%m%d-%H%M')}.{fmt}.gz"
+        path = os.path.join(scratch, filename)
+        count = await export_table(table, fmt, path)
+        if os.path.getsize(path) > EXPORT_MAX_BYTES:
+            await update.message.reply_text("❌ Export is larger than Telegram's 50 MB upload limit.")
+            return
+        with open(path, "rb") as f:
+            # read_file_handle=False hands the open file to httpx, which streams it
+            await update.message.reply_document(
+                InputFile(f, filename=filename, read_file_handle=False),
+                caption=f"📦 {count} {table}",
+                write_timeout=EXPORT_UPLOAD_TIMEOUT
+            )
+
+# ------------------- TOURNAMENT REGISTRATION -------------------
+async def show_upcoming_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor=None, backwards=False):
+    today = datetime.now().date().isoformat()
+    rows, has_more = await db_read(_browse_upcoming, today, cursor, backwards, BROWSER_PAGE_SIZE)
+    lines = ["🎟️ *Upcoming Tournaments*\n"]
+    keyboard = []
+    if not rows:
+        lines.append("No upcoming tournaments right now. Check back soon!")
+    for row in rows:
+        tid, name, capacity, seats_taken = row[0], row[1], row[9], row[10]
+        lines.append(f"{tournament_card(row[:9])} | 🎟️ {seats_taken}/{capacity}\n")
+        label = f"🎟️ Join #{tid}" if seats_taken < capacity else f"⏳ Waitlist #{tid}"
+        keyboard.append([InlineKeyboardButton(f"{label} {name[:30]}", callback_data=f"join_{tid}")])
+    keyboard += _browser_nav_row("pt", rows, has_more, cursor, backwards, lambda row: (row[5], row[6], row[0]))
+    keyboard.append([InlineKeyboardButton("🔙 Back to Main Menu", callback_data="back_to_main")])
+    await _send_browser(update, "\n".join(lines), keyboard)
+
+async def browse_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        await update.callback_query.answer()
+        if update.callback_query.data.startswith("pt|"):
+            _, direction, *cursor = update.callback_query.data.split("|")
+            await show_upcoming_tournaments(update, context, cursor=_decode_cursor(cursor), backwards=direction == "p")
+            return
+    await show_upcoming_tournaments(update, context)
+
+async def join_tournament_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_row = await get_user_by_telegram_id(update.effective_user.id)
+    if not user_row:
+        await query.answer("Create your profile first to join tournaments.", show_alert=True)
+        return
+    tid = int(query.data.split("_", 1)[1])
+    outcome, position = await join_tournament(tid, user_row[0])
+    messages = {
+        "confirmed": f"✅ You're in! Your slot in tournament #{tid} is confirmed.",
+        "waitlist": f"⏳ Tournament #{tid} is full. You're #{position} on the waitlist and will be moved in automatically if a slot opens.",
+        "already_confirmed": f"✅ You already have a slot in tournament #{tid}.",
+        "already_waitlist": f"⏳ You're already on the waitlist for tournament #{tid}.",
+        "closed": f"❌ Tournament #{tid} is no longer open for registration.",
+    }
+    await query.answer()
+    keyboard = []
+    if outcome in ("confirmed", "waitlist", "already_confirmed", "already_waitlist"):
+        keyboard.append([InlineKeyboardButton("🚪 Leave tournament", callback_data=f"leave_{tid}")])
+    await query.message.reply_text(messages[outcome], reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None)
+
+async def leave_tournament_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_row = await get_user_by_telegram_id(update.effective_user.id)
+    tid = int(query.data.split("_", 1)[1])
+    old_status, promoted_telegram_id, refunded = await leave_tournament(tid, user_row[0]) if user_row else (None, None, 0)
+    if not old_status:
+        await query.message.reply_text(f"You're not registered for tournament #{tid}.")
+        return
+    if old_status == "closed":
+        await query.message.reply_text(f"⛔ Tournament #{tid} has already started, so you can't leave it now.")
+        return
+    refund_note = f" Your ₹{refunded} entry fee has been refunded to your wallet." if refunded else ""
+    await query.message.reply_text(f"🚪 You left tournament #{tid}.{refund_note}")
+    if promoted_telegram_id:
+        try:
+            await context.bot.send_message(
+                chat_id=promoted_telegram_id,
+                text=f"🎉 A slot opened up! You've been moved from the waitlist into tournament #{tid}."
+            )
+        except TelegramError:
+            logger.exception("Failed to notify promoted player %s", promoted_telegram_id)
+
+# ------------------- WALLET -------------------
+LEDGER_KIND_LABELS = {
+    "deposit": "💵 Deposit",
+    "entry_fee": "🎟️ Entry fee",
+    "prize": "🏆 Prize",
+    "referral_bonus": "🎁 Referral bonus",
+    "refund": "↩️ Refund",
+}
+
+async def cmd_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_row = await get_user_by_telegram_id(update.effective_user.id)
+    if not user_row:
+        await update.message.reply_text("You don't have a profile yet. Click Create Profile to get started.")
+        return
+    account = user_account(user_row[0])
+    balance = await db_read(_get_balance, account)
+    entries = await db_read(_recent_ledger_entries, account, 5)
+    lines = [f"💰 *Wallet*\n\nBalance: *₹{balance}*"]
+    if entries:
+        lines.append("\n*Recent activity:*")
+        for amount, kind, reference, created_at in entries:
+            lines.append(f"{LEDGER_KIND_LABELS.get(kind, kind)}: {'+' if amount > 0 else '−'}₹{abs(amount)} ({created_at[:10]})")
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+async def cmd_credit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    if len(context.args) != 2 or not context.args[1].isdigit() or int(context.args[1]) <= 0:
+        await update.message.reply_text("Usage: /credit <OTO ID> <amount>")
+        return
+    user_row = await get_user_by_oto_id(context.args[0])
+    if not user_row:
+        await update.message.reply_text("❌ No player with that OTO ID.")
+        return
+    amount = int(context.args[1])
+    # keyed on the admin's message, so a redelivered update can't credit twice
+    key = f"deposit:{update.effective_chat.id}:{update.message.message_id}"
+    await post_transaction(key, "deposit", [("house:deposits", -amount), (user_account(user_row[0]), amount)],
+                           reference=f"admin:{update.effective_user.id}")
+    balance = await get_balance(user_row[0])
+    await update.message.reply_text(f"✅ Credited ₹{amount} to {user_row[2]}. New balance: ₹{balance}")
+
+async def cmd_collect_fees(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /collect_fees <tournament ID>")
+        return
+    collected = await collect_entry_fees(int(context.args[0]))
+    if collected is None:
+        await update.message.reply_text("❌ Tournament not found or already finished.")
+        return
+    charged, short = collected
+    text = f"✅ Collected entry fees from {charged} players."
+    if short:
+        text += f"\n⚠️ {len(short)} players didn't have enough balance."
+    await update.message.reply_text(text)
+
+async def cmd_award(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    args = context.args
+    if len(args) != 3 or not args[0].isdigit() or not args[2].isdigit() or int(args[2]) <= 0:
+        await update.message.reply_text("Usage: /award <tournament ID> <OTO ID> <amount>")
+        return
+    tid, amount = int(args[0]), int(args[2])
+    user_row = await get_user_by_oto_id(args[1])
+    if not user_row:
+        await update.message.reply_text("❌ No player with that OTO ID.")
+        return
+    # one prize per player per tournament
     try:
-        new_id = save_tournament_to_db(tournament)
-        summary_text = (
-            "✅ *Tournament Created Successfully!*\n\n"
-            f"🏆 *Name:* {tournament['name']}\n"
-            f"🎮 *Game:* {tournament['game_type']}\n"
-            f"🗺️ *Map:* {tournament['map']}\n"
-            f"🎯 *Mode:* {tournament['game_mode']}\n"
-            f"📅 *Date:* {tournament['date']}\n"
-            f"⏰ *Time:* {tournament['time']}\n"
-            f"💰 *Entry Fee:* ₹{tournament['entry_fee']}\n"
-            f"🏆 *Prize Pool:* ₹{tournament['prize_pool']}\n"
-            f"🆔 *Tournament ID:* {new_id}"
+        _, created = await post_transaction(
+            f"prize:{tid}:{user_row[0]}", "prize",
+            [(f"tournament:{tid}", -amount), (user_account(user_row[0]), amount)],
+            reference=f"tournament:{tid}"
         )
-        await update.message.reply_text(summary_text, parse_mode="Markdown")
-        # notify moderator group
-        try:
-            await context.bot.send_message(chat_id=MODERATOR_GROUP_ID, text=f"🏆 *New Tournament Created!*\n\n{summary_text}", parse_mode="Markdown")
-        except Exception:
-            logger.exception("Failed to notify moderator group about new tournament")
-    except Exception:
-        logger.exception("Failed to save tournament to DB")
-        await update.message.reply_text("❌ Failed to create tournament, try again later.")
-    context.user_data.clear()
-    return ConversationHandler.END
+    except InsufficientFunds:
+        pool = await db_read(_get_balance, f"tournament:{tid}")
+        await update.message.reply_text(f"❌ Tournament #{tid}'s prize pool only holds ₹{pool} in collected fees.")
+        return
+    if not created:
+        await update.message.reply_text(f"ℹ️ {user_row[2]} was already awarded a prize for tournament #{tid}.")
+        return
+    await update.message.reply_text(f"🏆 Awarded ₹{amount} to {user_row[2]} for tournament #{tid}.")
 
-async def admin_view_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# ------------------- LEADERBOARD -------------------
+def _parse_board_args(args):
+    """[game] [state...] -> (game_type, state, error)."""
+    if not args:
+        return "Free Fire", None, None
+    game_type = GAME_TYPES.get(f"game_{args[0].lower()}")
+    if not game_type:
+        return None, None, "Usage: /leaderboard [freefire|bgmi|codm|valorant] [state]"
+    state = None
+    if len(args) > 1:
+        state = " ".join(args[1:])
+        is_valid, error_msg = validate_state(state)
+        if not is_valid:
+            return None, None, f"❌ {error_msg}"
+        state = state.strip().title()
+    return game_type, state, None
+
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE, game_type, state, cursor=None):
+    rows, has_more = await db_read(_leaderboard_page, game_type, state, cursor, BROWSER_PAGE_SIZE)
+    title = f"🥇 *{game_type} Leaderboard*" + (f" — {state}" if state else "")
+    lines = [title + "\n"]
+    if not rows:
+        lines.append("No results recorded yet.")
+    for points, user_id, name, oto_id, matches in rows:
+        rank = leaderboards.rank_cached(game_type, state, points) if leaderboards.ready else "–"
+        lines.append(f"{rank}. *{escape_markdown(name or '')}* ({oto_id}) — {points} pts in {matches} matches")
+    keyboard = []
+    if has_more:
+        game_code = next(k[5:] for k, v in GAME_TYPES.items() if v == game_type)
+        last = rows[-1]
+        # callback data stays under Telegram's 64 bytes: state is carried as its index
+        state_code = VALID_STATES.index(state) if state else ""
+        keyboard.append([InlineKeyboardButton("Next ➡️", callback_data=f"lb|{game_code}|{state_code}|{last[0]}|{last[1]}")])
+    await _send_browser(update, "\n".join(lines), keyboard)
+
+async def cmd_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    game_type, state, error = _parse_board_args(context.args)
+    if error:
+        await update.message.reply_text(error)
+        return
+    await show_leaderboard(update, context, game_type, state)
+
+async def leaderboard_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    rows = get_recent_tournaments(limit=10)
-    if not rows:
-        await query.message.edit_text("📋 *No tournaments found*\n\nCreate your first tournament using the admin panel!", parse_mode="Markdown")
+    _, game_code, state_code, points, user_id = query.data.split("|")
+    state = VALID_STATES[int(state_code)] if state_code else None
+    await show_leaderboard(update, context, GAME_TYPES[f"game_{game_code}"], state, cursor=(int(points), int(user_id)))
+
+async def cmd_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_row = await get_user_by_telegram_id(update.effective_user.id)
+    if not user_row:
+        await update.message.reply_text("You don't have a profile yet. Click Create Profile to get started.")
         return
-    tournaments_text = "📋 *Active Tournaments:*\n\n"
-    for row in rows:
-        tid, name, game_type, map_name, game_mode, date, time, entry_fee, prize_pool = row
-        tournaments_text += (
-            f"🏆 *{name}* (ID: {tid})\n"
-            f"🎮 {game_type} | 🗺️ {map_name}\n"
-            f"📅 {date} at {time}\n"
-            f"💰 ₹{entry_fee} | 🏆 ₹{prize_pool}\n\n"
+    scores = await db_read(_user_scores, user_row[0])
+    if not scores:
+        await update.message.reply_text("📊 You don't have any recorded results yet. Join a tournament to get ranked!")
+        return
+    lines = ["📊 *Your Rankings*\n"]
+    for game_type, state, points, matches in scores:
+        overall, total = await leaderboards.rank(game_type, None, points)
+        in_state, _ = await leaderboards.rank(game_type, state, points)
+        lines.append(
+            f"🎮 *{game_type}*: {points} pts ({matches} matches)\n"
+            f"🌐 Rank #{overall}" + (f" of {total}" if total else "") + f" | 🌍 #{in_state} in {state}\n"
         )
-    keyboard = [[InlineKeyboardButton("🔙 Back to Admin Panel", callback_data="admin_panel")]]
-    await query.message.edit_text(tournaments_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+async def cmd_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    args = context.args
+    if len(args) != 4 or not args[0].isdigit() or not args[2].isdigit() or not args[3].isdigit() or int(args[2]) < 1:
+        await update.message.reply_text("Usage: /result <tournament ID> <OTO ID> <placement> <kills>")
+        return
+    user_row = await get_user_by_oto_id(args[1])
+    if not user_row:
+        await update.message.reply_text("❌ No player with that OTO ID.")
+        return
+    result = await leaderboards.record_result(int(args[0]), user_row[0], int(args[2]), int(args[3]))
+    if not result:
+        await update.message.reply_text("❌ Tournament not found.")
+        return
+    game_type, _, _, total = result
+    await update.message.reply_text(
+        f"✅ Recorded #{args[2]} with {args[3]} kills for {user_row[3]} ({user_row[2]}) "
+        f"(+{match_points(int(args[2]), int(args[3]))} pts, {game_type} total {total})."
+    )
+
+# ------------------- ADMIN BRACKETS -------------------
+async def cmd_seed(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    args = context.args
+    kind = args[1].lower() if len(args) > 1 else "lobby"
+    if not args or not args[0].isdigit() or kind not in ("lobby", "knockout"):
+        await update.message.reply_text("Usage: /seed <tournament ID> [lobby|knockout]")
+        return
+    tournament = await get_tournament(int(args[0]))
+    if not tournament:
+        await update.message.reply_text("❌ Tournament not found.")
+        return
+    seeded = await seed_tournament(tournament, kind)
+    if seeded is None:
+        await update.message.reply_text("❌ Results are already being reported for this tournament; it can't be re-seeded.")
+        return
+    team_count, first_round = seeded
+    if team_count < 2:
+        await update.message.reply_text("❌ At least two confirmed teams are needed to seed.")
+        return
+    totals = [sum(strengths) for strengths in first_round]
+    if kind == "lobby":
+        summary = f"{len(first_round)} lobbies, team strength per lobby {min(totals)}–{max(totals)}"
+    else:
+        byes = sum(len(strengths) == 1 for strengths in first_round)
+        summary = f"{len(first_round)} first-round matches ({byes} byes)"
+    await update.message.reply_text(
+        f"✅ Seeded {team_count} teams for *{escape_markdown(tournament[1])}*: {summary}.\n"
+        f"Use /bracket {tournament[0]} to run it.",
+        parse_mode="Markdown"
+    )
+
+async def show_bracket(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament_id):
+    tournament = await get_tournament(tournament_id)
+    if not tournament:
+        await _send_browser(update, "❌ Tournament not found.", [])
+        return
+    pending = await db_read(_pending_matches, tournament_id, BROWSER_PAGE_SIZE)
+    lines = [f"🏟️ *{escape_markdown(tournament[1])}*\n"]
+    keyboard = []
+    if not pending:
+        final = await db_read(_bracket_final, tournament_id)
+        if not final:
+            lines.append(f"Not seeded yet. Use /seed {tournament_id} [lobby|knockout].")
+        else:
+            result = json.loads(final[1]) if final[1] else None
+            winner = result if final[0] == "knockout" else result and result[0]
+            labels = await db_read(_team_labels, tournament_id, [winner] if winner else [])
+            lines.append(f"🏆 Winner: {escape_markdown(labels.get(winner, '?'))}" if winner else "Waiting for results.")
+        await _send_browser(update, "\n".join(lines), keyboard)
+        return
+    matches = [(round_, slot, kind, json.loads(teams)) for round_, slot, kind, teams in pending]
+    labels = await db_read(_team_labels, tournament_id, [team for *_, teams in matches for team in teams])
+    # byes can make a knockout's next-round matches playable alongside the current round's
+    for round_, slot, kind, teams in matches:
+        if kind == "knockout":
+            a, b = teams
+            lines.append(f"⚔️ R{round_} match {slot + 1}: {escape_markdown(labels[a])} vs {escape_markdown(labels[b])}")
+            keyboard.append([
+                InlineKeyboardButton(f"✅ #{a}", callback_data=f"ko|{tournament_id}|{round_}|{slot}|{a}"),
+                InlineKeyboardButton(f"✅ #{b}", callback_data=f"ko|{tournament_id}|{round_}|{slot}|{b}"),
+            ])
+        else:
+            lines.append(f"🎮 R{round_} lobby {slot + 1} (top {lobby_qualifiers(len(teams))} go through): "
+                         + ", ".join(escape_markdown(labels[team]) for team in teams))
+    if matches[0][2] == "lobby":
+        lines.append(f"\nReport a lobby: /lobby\\_result {tournament_id} <lobby> <team #> <team #> ... in finishing order")
+    await _send_browser(update, "\n".join(lines), keyboard)
+
+async def cmd_bracket(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        await update.message.reply_text("Usage: /bracket <tournament ID>")
+        return
+    await show_bracket(update, context, int(context.args[0]))
+
+async def knockout_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_user.id not in ADMIN_IDS:
+        await query.answer("⛔ Access Denied! You are not authorized.", show_alert=True)
+        return
+    tournament_id, round_, slot, winner = map(int, query.data.split("|")[1:])
+    outcome = await report_knockout(tournament_id, round_, slot, winner)
+    await query.answer({
+        "advanced": f"✅ #{winner} advances",
+        "champion": f"🏆 #{winner} wins the tournament!",
+        "decided": "This match already has a result.",
+    }.get(outcome, "❌ Match not found."))
+    await show_bracket(update, context, tournament_id)
+
+async def cmd_lobby_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Access Denied! You are not authorized.")
+        return
+    args = [a.lstrip("#") for a in context.args]
+    if len(args) < 3 or not all(a.isdigit() for a in args):
+        await update.message.reply_text("Usage: /lobby_result <tournament ID> <lobby> <team #> [team # ...] (finishing order)")
+        return
+    tournament = await get_tournament(int(args[0]))
+    if not tournament:
+        await update.message.reply_text("❌ Tournament not found.")
+        return
+    outcome, detail = await report_lobby(tournament[0], tournament[4], int(args[1]) - 1, [int(a) for a in args[2:]])
+    await update.message.reply_text({
+        "missing": "❌ No such lobby in the current round.",
+        "decided": "❌ That lobby already has a result.",
+        "invalid": f"❌ List at least the top {detail} teams of that lobby, each once.",
+        "recorded": f"✅ Recorded. Waiting for the other round {detail} lobbies.",
+        "next_round": (f"✅ Round complete: {detail} lobbies seeded for the next round." if detail > 1
+                       else "✅ Round complete: the final lobby is set.") + f" /bracket {args[0]}",
+        "final": f"🏆 Final recorded: team #{detail} wins!",
+    }[outcome])
 
 # ------------------- PROFILE CREATION FLOW -------------------
 async def create_profile_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -468,11 +3766,11 @@ async def create_profile_start(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     user = update.effective_user
     # If user already has profile, skip creation
-    existing = get_user_by_telegram_id(user.id)
+    existing = await get_user_by_telegram_id(user.id)
     if existing:
         await query.message.reply_text("✅ You already have a profile. Use /profile to view it or click View Tournaments.")
         # show normal menu
-        reply_markup = await build_main_menu_for_user(user.id, existing)
+        reply_markup = main_menu(user.id, existing)
         await query.message.reply_text("Main Menu:", reply_markup=reply_markup)
         return ConversationHandler.END
 
@@ -523,31 +3821,22 @@ async def save_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Create user in DB (this also generates unique OTO ID)
     try:
-        new_user = create_user(user.id, context.user_data["name"], context.user_data["game_id"],
+        new_user = await create_user(user.id, context.user_data["name"], context.user_data["game_id"],
                                context.user_data["level"], context.user_data["state"], user.username or "")
         # new_user = (id, telegram_id, oto_id, name, game_id, level, state, username, created_at)
         oto_id = new_user[2]
-        profile_text = (
-            "✅ *Profile Created Successfully!*\n\n"
-            f"👤 *Name:* {new_user[3]}\n"
-            f"🎮 *Game ID:* {new_user[4]}\n"
-            f"🔥 *Level:* {new_user[5]}\n"
-            f"🌍 *State:* {new_user[6]}\n"
-            f"🆔 *OTO ID:* {oto_id}\n"
-            f"👥 *Telegram ID:* {user.id}\n"
-            f"📱 *Username:* @{user.username or 'N/A'}"
-        )
+        profile_text = new_profile_card(new_user)
         await update.message.reply_text(profile_text, parse_mode="Markdown")
 
-        # Send to moderator group
-        try:
-            await context.bot.send_message(chat_id=MODERATOR_GROUP_ID, text=f"📥 *New Profile Created!*\n\n{profile_text}", parse_mode="Markdown")
-        except Exception:
-            logger.exception("Failed to notify moderator group about new profile")
-
         # show main menu now that profile exists
-        reply_markup = await build_main_menu_for_user(user.id, new_user)
+        reply_markup = main_menu(user.id, new_user)
         await update.message.reply_text("🎉 You're all set! Use the menu below:", reply_markup=reply_markup)
+
+        # Notify moderator group (delivered in the background by the outbox)
+        try:
+            await moderator_outbox.enqueue("profile", f"📥 *New Profile Created!*\n\n{profile_text}", f"{new_user[3]} ({oto_id})")
+        except Exception:
+            logger.exception("Failed to queue moderator notification about new profile")
     except sqlite3.IntegrityError:
         # If duplicate telegram_id somehow
         await update.message.reply_text("❌ It seems you already have a profile or there was an error. Use /profile to view your profile.")
@@ -575,17 +3864,15 @@ async def referral(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    try:
-        bot_info = await context.bot.get_me()
-        bot_username = bot_info.username
-        referral_link = f"https://t.me/{bot_username}?start={user.id}"
-    except Exception:
-        referral_link = "Contact admin for referral link"
+    # bot.username was resolved by get_me() once during Application.initialize()
+    referral_link = f"https://t.me/{context.bot.username}?start={user.id}"
+    referrals = await db_read(_referral_count, user.id)
     referral_text = (
         "🎁 *Referral Program*\n\n"
         f"Share this link with friends:\n`{referral_link}`\n\n"
+        f"👥 *Friends joined:* {referrals}\n\n"
         "💰 *Benefits:*\n"
-        "• Earn OTO Coins for each referral\n"
+        f"• Earn {REFERRAL_BONUS} OTO Coins for each friend who creates a profile\n"
         "• Get bonus rewards"
     )
     await query.message.reply_text(referral_text, parse_mode="Markdown")
@@ -594,38 +3881,19 @@ async def view_profile_callback(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    row = get_user_by_telegram_id(user.id)
+    row = await get_user_by_telegram_id(user.id)
     if not row:
         await query.message.reply_text("You don't have a profile yet. Click Create Profile to get started.")
         return
-    # row = (id, telegram_id, oto_id, name, game_id, level, state, username, created_at)
-    profile_text = (
-        f"👤 *Name:* {row[3]}\n"
-        f"🎮 *Game ID:* {row[4]}\n"
-        f"🔥 *Level:* {row[5]}\n"
-        f"🌍 *State:* {row[6]}\n"
-        f"🆔 *OTO ID:* {row[2]}\n"
-        f"📱 *Username:* @{row[7] or 'N/A'}\n"
-        f"🕒 *Joined:* {row[8]}"
-    )
-    await query.message.reply_text(profile_text, parse_mode="Markdown")
+    await query.message.reply_text(profile_card(row), parse_mode="Markdown")
 
 async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    row = get_user_by_telegram_id(user.id)
+    row = await get_user_by_telegram_id(user.id)
     if not row:
         await update.message.reply_text("You don't have a profile yet. Click Create Profile to get started.")
         return
-    profile_text = (
-        f"👤 *Name:* {row[3]}\n"
-        f"🎮 *Game ID:* {row[4]}\n"
-        f"🔥 *Level:* {row[5]}\n"
-        f"🌍 *State:* {row[6]}\n"
-        f"🆔 *OTO ID:* {row[2]}\n"
-        f"📱 *Username:* @{row[7] or 'N/A'}\n"
-        f"🕒 *Joined:* {row[8]}"
-    )
-    await update.message.reply_text(profile_text, parse_mode="Markdown")
+    await update.message.reply_text(profile_card(row), parse_mode="Markdown")
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
@@ -635,59 +3903,1020 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Exception while handling an update:", exc_info=context.error)
 
+# ------------------- LIFECYCLE -------------------
+_background_tasks = set()
+
+def spawn_background(coro):
+    """Run coro as a fire-and-forget task, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def on_startup(application: Application):
+    logger.info("Running as @%s", application.bot.username)
+    spawn_background(build_background_indexes())
+    spawn_background(leaderboards.rebuild())
+    if METRICS_PORT:
+        spawn_background(serve_metrics(application))
+    if MAINTENANCE_INTERVAL_HOURS:
+        spawn_background(run_maintenance())
+    # in webhook mode the API is mounted on the webhook server instead
+    if API_PORT and BOT_MODE != "webhook":
+        spawn_background(serve_api(application))
+    if isinstance(application.persistence, SQLitePersistence):
+        spawn_background(evict_abandoned_conversations(application, application.persistence))
+    if update_recorder is not None:
+        spawn_background(update_recorder.run())
+    moderator_outbox.start(application.bot)
+    await broadcaster.start(application.bot)
+    await scheduler.start(application.bot)
+
+async def on_shutdown(application: Application):
+    for task in list(_background_tasks):
+        task.cancel()
+    if update_recorder is not None:
+        await update_recorder.flush()
+    await scheduler.stop()
+    await broadcaster.stop()
+    await moderator_outbox.stop()
+    await write_batcher.close()
+    close_db()
+
+# ------------------- PERSISTENCE -------------------
+STATE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data BLOB NOT NULL)",
+    """
+    CREATE TABLE IF NOT EXISTS conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state BLOB NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (name, key)
+    )
+    """,
+]
+
+def _load_blobs(conn, table, id_column):
+    return {row[0]: pickle.loads(row[1]) for row in conn.execute(f"SELECT {id_column}, data FROM {table}")}
+
+def _load_bot_data(conn):
+    row = conn.execute("SELECT data FROM bot_data WHERE id=0").fetchone()
+    return pickle.loads(row[0]) if row else {}
+
+def _load_conversations(conn, name, min_updated_at):
+    return conn.execute(
+        "SELECT key, state, updated_at FROM conversations WHERE name=? AND updated_at >= ?", (name, min_updated_at)
+    ).fetchall()
+
+def _flush_state(conn, users, chats, bot_data, conversations, now):
+    for table, id_column, entries in (("user_data", "user_id", users), ("chat_data", "chat_id", chats)):
+        conn.executemany(f"DELETE FROM {table} WHERE {id_column}=?", [(k,) for k, blob in entries.items() if blob is None])
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {table} ({id_column}, data, updated_at) VALUES (?, ?, ?)",
+            [(k, blob, now) for k, blob in entries.items() if blob is not None]
+        )
+    if bot_data is not None:
+        conn.execute("INSERT OR REPLACE INTO bot_data (id, data) VALUES (0, ?)", (bot_data,))
+    conn.executemany(
+        "DELETE FROM conversations WHERE name=? AND key=?",
+        [(name, key) for (name, key), state in conversations.items() if state is None]
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)",
+        [(name, key, state, now) for (name, key), state in conversations.items() if state is not None]
+    )
+
+def _purge_conversations(conn, before):
+    conn.execute("DELETE FROM conversations WHERE updated_at < ?", (before,))
+
+class SQLitePersistence(BasePersistence):
+    """
+    Stores conversation states, user_data, chat_data and bot_data in a small
+    SQLite database. The Application hands over changed entries every
+    update_interval; they are buffered here and written together in a single
+    transaction, and entries whose pickled bytes didn't change since the last
+    write are skipped entirely.
+    """
+
+    def __init__(self, path, update_interval, conversation_timeout):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.path = path
+        self.conversation_timeout = conversation_timeout
+        # (name, conversation key) -> wall-clock time of the last state change
+        self.conversation_activity = {}
+        self._users = {}
+        self._chats = {}
+        self._conversations = {}
+        self._bot_data = None
+        self._last_bot_data = None
+        # fingerprints of recently written user/chat blobs, to skip unchanged rewrites
+        self._written = OrderedDict()
+        self._flush_task = None
+        conn = _open_connection(path)
+        for statement in STATE_SCHEMA:
+            conn.execute(statement)
+        conn.close()
+
+    def _changed(self, key, blob):
+        fingerprint = hash(blob)
+        if self._written.get(key) == fingerprint:
+            self._written.move_to_end(key)
+            return False
+        self._written[key] = fingerprint
+        self._written.move_to_end(key)
+        if len(self._written) > PROFILE_CACHE_SIZE:
+            self._written.popitem(last=False)
+        return True
+
+    def _schedule_flush(self):
+        # The Application calls every update_* coroutine of one run together;
+        # flushing on the next loop iteration catches all of them in one commit.
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        users, self._users = self._users, {}
+        chats, self._chats = self._chats, {}
+        conversations, self._conversations = self._conversations, {}
+        bot_data, self._bot_data = self._bot_data, None
+        if users or chats or conversations or bot_data is not None:
+            await db_write(_flush_state, users, chats, bot_data, conversations, time.time(), path=self.path)
+
+    async def get_user_data(self):
+        return await db_read(_load_blobs, "user_data", "user_id", path=self.path)
+
+    async def get_chat_data(self):
+        return await db_read(_load_blobs, "chat_data", "chat_id", path=self.path)
+
+    async def get_bot_data(self):
+        return await db_read(_load_bot_data, path=self.path)
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # conversations abandoned for longer than the timeout are not restored
+        rows = await db_read(_load_conversations, name, time.time() - self.conversation_timeout, path=self.path)
+        conversations = {}
+        for key, state, updated_at in rows:
+            key = tuple(json.loads(key))
+            conversations[key] = pickle.loads(state)
+            self.conversation_activity[(name, key)] = updated_at
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            self.conversation_activity.pop((name, key), None)
+        else:
+            self.conversation_activity[(name, key)] = time.time()
+        state = None if new_state is None else pickle.dumps(new_state)
+        self._conversations[(name, json.dumps(list(key)))] = state
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id, data):
+        blob = pickle.dumps(data) if data else None
+        if self._changed(("user", user_id), blob):
+            self._users[user_id] = blob
+            self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        blob = pickle.dumps(data) if data else None
+        if self._changed(("chat", chat_id), blob):
+            self._chats[chat_id] = blob
+            self._schedule_flush()
+
+    async def update_bot_data(self, data):
+        blob = pickle.dumps(data)
+        if blob != self._last_bot_data:
+            self._last_bot_data = self._bot_data = blob
+            self._schedule_flush()
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._written.pop(("user", user_id), None)
+        self._users[user_id] = None
+        self._schedule_flush()
+
+    async def drop_chat_data(self, chat_id):
+        self._written.pop(("chat", chat_id), None)
+        self._chats[chat_id] = None
+        self._schedule_flush()
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        await self._write_pending()
+        await db_write(_purge_conversations, time.time() - self.conversation_timeout, path=self.path)
+
+def _end_conversation(handler: ConversationHandler, key) -> bool:
+    """
+    Forget one conversation of handler. ConversationHandler has no public API to
+    end a conversation from outside, so this is the one place that reaches into
+    its private _conversations (a TrackingDict in python-telegram-bot 20 and 21,
+    so popping from it also gets the removal persisted).
+    """
+    conversations = getattr(handler, "_conversations", None)
+    if conversations is None:
+        logger.warning("ConversationHandler internals changed; abandoned conversations are no longer ended")
+        return False
+    return conversations.pop(key, None) is not None
+
+async def evict_abandoned_conversations(application: Application, persistence: SQLitePersistence):
+    """
+    Periodically ends conversations nobody has touched for CONVERSATION_TIMEOUT
+    and drops the half-filled wizard fields that went with them, so users who
+    walk away mid-wizard don't pin memory (or rows) forever.
+    """
+    handlers = {
+        handler.name: handler
+        for group in application.handlers.values()
+        for handler in group
+        if isinstance(handler, ConversationHandler) and handler.persistent
+    }
+    while True:
+        await asyncio.sleep(min(60, CONVERSATION_TIMEOUT / 4))
+        cutoff = time.time() - CONVERSATION_TIMEOUT
+        stale = [k for k, last in persistence.conversation_activity.items() if last < cutoff]
+        for name, key in stale:
+            persistence.conversation_activity.pop((name, key), None)
+            handler = handlers.get(name)
+            if handler is None or not _end_conversation(handler, key):
+                continue
+            user_data = application.user_data.get(key[-1]) if handler.per_user else None
+            if user_data:
+                for field in CONVERSATION_FIELDS.get(name, ()):
+                    user_data.pop(field, None)
+                application.mark_data_for_update_persistence(user_ids=key[-1])
+        if stale:
+            logger.info("Evicted %d abandoned conversations", len(stale))
+
+# ------------------- FLOOD CONTROL -------------------
+class FloodControl:
+    """
+    Decides whether an incoming update is worth handling at all. Runs before an
+    update is queued, so excess taps cost a dict lookup and some arithmetic
+    rather than a DB read and an API call.
+
+    Per-user state is kept in an LRU of FLOOD_TRACKED_USERS entries; a user who
+    falls out of it simply comes back with a full bucket.
+    """
+
+    def __init__(self, rate, burst, global_rate, global_burst, dedup_seconds, max_users):
+        self.rate = rate
+        self.burst = burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.dedup_seconds = dedup_seconds
+        self.max_users = max_users
+        # user id -> [tokens, refilled at, last callback_data, its arrival time]
+        self._users = OrderedDict()
+        self._global = [global_burst, time.monotonic()]
+
+    @staticmethod
+    def _take(bucket, rate, burst, now):
+        tokens = min(burst, bucket[0] + max(0.0, now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def check(self, user_id, data=None, exempt=False, now=None):
+        """None if the update may run, otherwise the reason it is dropped."""
+        now = time.monotonic() if now is None else now
+        if user_id is not None:
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = [self.burst, now, None, 0.0]
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            if data is not None:
+                # a double tap on the same button is coalesced into the first one
+                if data == state[2] and now - state[3] < self.dedup_seconds:
+                    return "duplicate"
+                state[2], state[3] = data, now
+            if not exempt and self.rate > 0 and not self._take(state, self.rate, self.burst, now):
+                return "user"
+        if self.global_rate > 0 and not self._take(self._global, self.global_rate, self.global_burst, now):
+            return "global"
+        return None
+
+    def admit(self, update):
+        if not isinstance(update, Update):
+            return True
+        user = update.effective_user
+        query = update.callback_query
+        reason = self.check(
+            user.id if user else None,
+            query.data if query else None,
+            exempt=bool(user) and user.id in ADMIN_IDS,
+        )
+        if reason is None:
+            return True
+        THROTTLED.inc(reason)
+        return False
+
+    def tracked(self):
+        return len(self._users)
+
+flood_control = FloodControl(
+    FLOOD_RATE, FLOOD_BURST, FLOOD_GLOBAL_RATE, FLOOD_GLOBAL_BURST, FLOOD_DEDUP_SECONDS, FLOOD_TRACKED_USERS
+)
+
+# ------------------- UPDATE RECORDING -------------------
+# Fields kept per update kind; everything else is dropped before redaction
+_RECORD_KINDS = ("message", "edited_message", "callback_query", "inline_query")
+_RECORD_MESSAGE_KEYS = ("message_id", "date", "edit_date", "chat", "from", "text", "entities",
+                        "caption", "caption_entities", "document", "reply_to_message")
+# Words the handlers parse out of free text (states, games, export/seed options, OTO IDs)
+_RECORD_VOCABULARY = frozenset(
+    word.lower() for word in itertools.chain(
+        " ".join(VALID_STATES).split(), " ".join(GAME_TYPES.values()).split(),
+        (key.split("_", 1)[1] for key in GAME_TYPES), EXPORTS, ("csv", "jsonl", "lobby", "knockout", "oto"),
+    )
+)
+_LETTERS = re.compile(r"[^\W\d_]+")
+_LONG_NUMBER = re.compile(r"\d{7,}")
+_COMMAND = re.compile(r"/\w+(@\w+)?")
+
+class UpdateRecorder:
+    """
+    Append-only log of admitted updates that replay.py feeds back through the
+    handlers. Each update is cut down to what the handlers read and redacted:
+
+    - user and chat ids become keyed pseudonyms, stable for the life of the
+      process so a player's conversation still lines up; names and usernames go
+    - free text keeps its shape but not its letters ("Ravi 42" -> "Xxxx 42"),
+      except /commands and _RECORD_VOCABULARY words, so validators and argument
+      parsing take the same branches they did; callback data is bot-generated
+      and kept
+    - digit runs long enough to be phone numbers or telegram ids are pseudonymized
+
+    Lines are buffered and appended every RECORD_FLUSH_SECONDS off the event
+    loop; a .gz path gets one gzip member per flush. Each process run starts
+    with a header line carrying the admins' pseudonyms.
+    """
+
+    def __init__(self, path, sample_rate=1.0, flush_interval=5.0, key=None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self._key = key or secrets.token_bytes(16)
+        self._buffer = []
+        self._header_written = False
+        self._lock = threading.Lock()
+
+    def _digest(self, value):
+        return int.from_bytes(hmac.new(self._key, str(value).encode(), hashlib.sha256).digest()[:8], "big")
+
+    def pseudonym(self, telegram_id):
+        value = 1_000_000_000 + self._digest(abs(telegram_id)) % 9_000_000_000
+        return -value if telegram_id < 0 else value
+
+    def sampled(self, user_id):
+        return self.sample_rate >= 1 or (self._digest(user_id) >> 32) < self.sample_rate * 2**32
+
+    def redact_text(self, text):
+        command = _COMMAND.match(text)
+        head = command.group(0) if command else ""
+        rest = _LONG_NUMBER.sub(lambda m: str(self.pseudonym(int(m.group(0)))), text[len(head):])
+        rest = _LETTERS.sub(
+            lambda m: m.group(0) if m.group(0).lower() in _RECORD_VOCABULARY
+            else "".join("X" if ch.isupper() else "x" for ch in m.group(0)),
+            rest,
+        )
+        return head + rest
+
+    def _user(self, user):
+        if user.get("is_bot"):
+            return user
+        redacted = {"id": self.pseudonym(user["id"]), "is_bot": False, "first_name": "Player"}
+        if user.get("username"):
+            redacted["username"] = f"player{redacted['id']}"
+        if user.get("language_code"):
+            redacted["language_code"] = user["language_code"]
+        return redacted
+
+    def _chat(self, chat):
+        redacted = {"id": self.pseudonym(chat["id"]), "type": chat["type"]}
+        if chat.get("title"):
+            redacted["title"] = self.redact_text(chat["title"])
+        return redacted
+
+    def _message(self, message):
+        redacted = {key: message[key] for key in _RECORD_MESSAGE_KEYS if key in message}
+        redacted["chat"] = self._chat(message["chat"])
+        if "from" in redacted:
+            redacted["from"] = self._user(redacted["from"])
+        for key in ("text", "caption"):
+            if key in redacted:
+                redacted[key] = self.redact_text(redacted[key])
+        for key in ("entities", "caption_entities"):
+            if key in redacted:
+                # only commands matter to the handlers; mentions and links would carry PII
+                redacted[key] = [
+                    {"type": e["type"], "offset": e["offset"], "length": e["length"]}
+                    for e in redacted[key] if e["type"] == "bot_command"
+                ]
+        if "document" in redacted:
+            document = redacted["document"]
+            redacted["document"] = {
+                "file_id": document["file_id"], "file_unique_id": document["file_unique_id"],
+                "file_name": "upload" + os.path.splitext(document.get("file_name") or "")[1],
+                "mime_type": document.get("mime_type"), "file_size": document.get("file_size"),
+            }
+        if "reply_to_message" in redacted:
+            redacted["reply_to_message"] = self._message(redacted["reply_to_message"])
+        return redacted
+
+    def _redact(self, kind, payload):
+        if kind in ("message", "edited_message"):
+            return self._message(payload)
+        if kind == "callback_query":
+            redacted = {
+                "id": payload["id"], "from": self._user(payload["from"]),
+                "chat_instance": str(self._digest(payload.get("chat_instance"))),
+            }
+            for key in ("data", "inline_message_id", "game_short_name"):
+                if key in payload:
+                    redacted[key] = payload[key]
+            if "message" in payload:
+                redacted["message"] = self._message(payload["message"])
+            return redacted
+        return {
+            "id": payload["id"], "from": self._user(payload["from"]), "query": self.redact_text(payload["query"]),
+            "offset": payload["offset"], **({"chat_type": payload["chat_type"]} if "chat_type" in payload else {}),
+        }
+
+    def record(self, update):
+        """Buffer update for the next flush; never raises into update processing."""
+        if not isinstance(update, Update):
+            return
+        try:
+            user = update.effective_user
+            if user is not None and not self.sampled(user.id):
+                return
+            raw = update.to_dict()
+            kind = next((k for k in _RECORD_KINDS if k in raw), None)
+            if kind is None:
+                return
+            entry = {"t": round(time.time(), 3), "update": {"update_id": raw["update_id"], kind: self._redact(kind, raw[kind])}}
+            self._buffer.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")))
+            RECORDED.inc(kind)
+        except Exception:
+            logger.exception("Could not record update %s", update.update_id)
+
+    def _write(self, lines):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            opener = gzip.open if self.path.endswith(".gz") else open
+            with opener(self.path, "at", encoding="utf-8") as f:
+                if not self._header_written:
+                    header = {"started": round(time.time(), 3), "admins": [self.pseudonym(a) for a in ADMIN_IDS]}
+                    f.write(json.dumps({"recording": header}, separators=(",", ":")) + "\n")
+                    self._header_written = True
+                f.write("\n".join(lines) + "\n")
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        await asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError:
+                logger.exception("Could not append to the update recording %s", self.path)
+
+update_recorder = (
+    UpdateRecorder(RECORD_UPDATES_PATH, RECORD_SAMPLE_RATE, RECORD_FLUSH_SECONDS) if RECORD_UPDATES_PATH else None
+)
+
+# ------------------- UPDATE PROCESSING -------------------
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Runs up to max_concurrent_updates updates at once while keeping updates
+    from the same user (or chat, when there is no user) strictly ordered, so
+    ConversationHandler steps never race each other.
+
+    Only one task per user holds a concurrency slot: later updates from that
+    user are queued behind it and the slot-holder works through them in
+    arrival order, so a spammy user can't occupy every slot. Updates refused
+    by flood_control are dropped before they are queued; the rest go to the
+    recorder, if recording is on. Both checks, and queueing behind a user's
+    earlier update, happen before a concurrency slot is taken, so neither
+    dropped nor waiting updates hold one.
+    """
+
+    def __init__(self, max_concurrent_updates, flood_control=None, recorder=None):
+        super().__init__(max_concurrent_updates)
+        self.flood_control = flood_control
+        self.recorder = recorder
+        self._pending = {}
+
+    @staticmethod
+    def _ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return ("user", update.effective_user.id)
+            if update.effective_chat:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    async def process_update(self, update, coroutine):
+        if self.flood_control is not None and not self.flood_control.admit(update):
+            coroutine.close()
+            return
+        if self.recorder is not None:
+            self.recorder.record(update)
+        key = self._ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.append(coroutine)
+            return
+        # registered before waiting for a slot, so the user's next update queues behind this one
+        pending = self._pending[key] = deque([coroutine])
+        try:
+            await super().process_update(update, self._drain(key, pending))
+        finally:
+            del self._pending[key]
+            for leftover in pending:
+                leftover.close()
+
+    async def _drain(self, key, pending):
+        while pending:
+            try:
+                await pending.popleft()
+            except Exception:
+                logger.exception("Unhandled error while processing update for %s", key)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    def depth(self):
+        """(users with an update in progress, updates queued behind them)."""
+        return len(self._pending), sum(len(pending) for pending in self._pending.values())
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# ------------------- INSTRUMENTATION -------------------
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency and 429s per Bot API method."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, **kwargs)
+        finally:
+            TELEGRAM_SECONDS.observe(api_method, time.perf_counter() - started)
+        if code == 429:
+            TELEGRAM_429.inc(api_method)
+        return code, payload
+
+def _timed_callback(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            HANDLER_SECONDS.observe(name, time.perf_counter() - started)
+    return timed
+
+def instrument_handlers(handlers, wrap=_timed_callback):
+    """Wrap every handler callback (including conversation steps), by default in a latency timer."""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points, wrap)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers, wrap)
+            instrument_handlers(handler.fallbacks, wrap)
+        else:
+            handler.callback = wrap(handler.callback)
+
+def _outbox_depth(conn):
+    return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+async def render_metrics(application):
+    lines = []
+    for metric in (HANDLER_SECONDS, DB_SECONDS, DB_WAIT_SECONDS, TELEGRAM_SECONDS, TELEGRAM_429, THROTTLED, RECORDED):
+        lines += metric.render()
+
+    def gauge(name, help_text, samples):
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    caches = {"profile": profile_cache.stats(), "search": search_cache.stats(), "api": api_snapshots.stats()}
+    for key, help_text in (("hits", "Cache hits."), ("misses", "Cache misses."), ("size", "Entries cached."), ("hit_rate", "Hit ratio since start.")):
+        gauge(f"oto_cache_{key}", help_text, [(_metric_labels("cache", name), stats[key]) for name, stats in caches.items()])
+    processor = application.update_processor
+    active, queued = processor.depth() if isinstance(processor, PerUserUpdateProcessor) else (0, 0)
+    gauge("oto_update_queue_depth", "Updates received but not yet dispatched.", [(None, application.update_queue.qsize())])
+    gauge("oto_users_in_flight", "Users with an update being handled.", [(None, active)])
+    gauge("oto_updates_queued_per_user", "Updates waiting behind an earlier update from the same user.", [(None, queued)])
+    gauge("oto_flood_tracked_users", "Users with flood-control state in memory.", [(None, flood_control.tracked())])
+    gauge("oto_db_batcher_depth", "Writes waiting for the next batch commit.", [(None, write_batcher.depth())])
+    gauge("oto_db_executor_depth", "DB calls waiting for a connection thread.", [
+        (_metric_labels("pool", "read"), _db_read_executor._work_queue.qsize()),
+        (_metric_labels("pool", "write"), _db_write_executor._work_queue.qsize()),
+    ])
+    gauge("oto_outbox_depth", "Moderator notifications not yet delivered.", [(None, await db_read(_outbox_depth))])
+    gauge("oto_broadcasts_running", "Broadcasts currently sending.", [(None, len(broadcaster._tasks))])
+    gauge("oto_scheduler_pending", "Tournament lifecycle steps in the scheduler heap.", [(None, len(scheduler._next))])
+    gauge("oto_last_backup_timestamp_seconds", "Unix time of the last completed backup (0 = none yet).", [(None, maintenance_stats["last_backup"])])
+    gauge("oto_tournaments_archived", "Tournaments moved to the archive database since start.", [(None, maintenance_stats["archived"])])
+    gauge("oto_background_tasks", "Fire-and-forget background tasks alive.", [(None, len(_background_tasks))])
+    return "\n".join(lines) + "\n"
+
+def build_metrics_app(application: Application):
+    async def metrics(request: Request):
+        return PlainTextResponse(await render_metrics(application), media_type="text/plain; version=0.0.4")
+
+    return Starlette(routes=[Route("/metrics", metrics, methods=["GET"])])
+
+class SidecarServer(uvicorn.Server):
+    """uvicorn server that runs next to the bot and leaves signal handling to it."""
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+async def serve_metrics(application: Application):
+    server = SidecarServer(uvicorn.Config(
+        build_metrics_app(application), host=METRICS_LISTEN, port=METRICS_PORT, log_level="warning", lifespan="off"
+    ))
+    try:
+        await server.serve()
+    except (OSError, SystemExit):
+        # uvicorn exits on a bind failure; the bot should keep running without metrics
+        logger.warning("Metrics endpoint could not start on %s:%s", METRICS_LISTEN, METRICS_PORT)
+
+# ------------------- MINI APP API -------------------
+def verify_init_data(init_data, bot_token, max_age=API_AUTH_MAX_AGE, now=None):
+    """
+    Telegram WebApp initData check: the hash must be HMAC-SHA256 of the sorted
+    key=value lines, keyed with HMAC-SHA256("WebAppData", bot token). Returns
+    the WebApp user dict, or None if the data is forged, stale or malformed.
+    """
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        return None
+    received = fields.pop("hash", "")
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(received.encode(), expected.encode()):
+        return None
+    try:
+        if (now or time.time()) - int(fields.get("auth_date", 0)) > max_age:
+            return None
+        return json.loads(fields.get("user", "{}"))
+    except ValueError:
+        return None
+
+def _api_tournaments(conn, game_type, limit):
+    # the redundant status != 'archived' lets idx_tournaments_schedule serve the scan
+    where, params = ["status != 'archived'", "status IN ('upcoming', 'live')"], []
+    if game_type:
+        where.append("game_type = ?")
+        params.append(game_type)
+    return conn.execute(
+        f"SELECT {TOURNAMENT_COLUMNS}, capacity, seats_taken, status, starts_at FROM tournaments "
+        f"WHERE {' AND '.join(where)} ORDER BY starts_at LIMIT ?",
+        params + [limit]
+    ).fetchall()
+
+def _snapshot_response(request, snapshot):
+    if snapshot is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    body, gzipped, etag = snapshot
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding, Authorization"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(gzipped, media_type="application/json", headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def build_api_app(application: Application):
+    """
+    /tournaments, /profile/{oto_id} and /leaderboard for the mini app. Every
+    response is a precomputed snapshot, so a poll with a matching
+    If-None-Match costs an HMAC check and a dict lookup.
+    """
+
+    def authenticated(endpoint):
+        async def wrapper(request: Request):
+            scheme, _, init_data = request.headers.get("authorization", "").partition(" ")
+            if scheme.lower() != "tma" or verify_init_data(init_data, application.bot.token) is None:
+                return JSONResponse({"error": "unauthorized"}, status_code=401)
+            return await endpoint(request)
+        return wrapper
+
+    def game_type_param(request):
+        game = request.query_params.get("game", "")
+        return GAME_TYPES.get(f"game_{game.lower()}") if game else None
+
+    async def tournaments(request: Request):
+        game_type = game_type_param(request)
+
+        async def build():
+            rows = await db_read(_api_tournaments, game_type, API_PAGE_SIZE)
+            names = f"{TOURNAMENT_COLUMNS}, capacity, seats_taken, status, starts_at".split(", ")
+            return {"tournaments": [dict(zip(names, row)) for row in rows]}
+
+        return _snapshot_response(request, await api_snapshots.get(("tournaments", game_type), build))
+
+    async def profile(request: Request):
+        oto_id = request.path_params["oto_id"].strip().upper()
+
+        async def build():
+            row = await get_user_by_oto_id(oto_id)
+            if not row:
+                return None
+            # public fields only: no Telegram ID or username
+            _, _, oto_id_, name, game_id, level, state, _, created_at = row
+            return {"oto_id": oto_id_, "name": name, "game_id": game_id, "level": level, "state": state, "joined": created_at}
+
+        return _snapshot_response(request, await api_snapshots.get(("profile", oto_id), build))
+
+    async def leaderboard(request: Request):
+        game_type = game_type_param(request)
+        if not game_type:
+            return JSONResponse({"error": "game must be one of freefire, bgmi, codm, valorant"}, status_code=400)
+        state = request.query_params.get("state", "").strip().title() or None
+        after = request.query_params.get("after", "")
+        try:
+            cursor = tuple(int(v) for v in after.split("|")) if after else None
+        except ValueError:
+            return JSONResponse({"error": "bad cursor"}, status_code=400)
+
+        async def build():
+            rows, has_more = await db_read(_leaderboard_page, game_type, state, cursor, API_PAGE_SIZE)
+            entries = [
+                {"rank": leaderboards.rank_cached(game_type, state, points) if leaderboards.ready else None,
+                 "oto_id": oto_id, "name": name, "points": points, "matches": matches}
+                for points, user_id, name, oto_id, matches in rows
+            ]
+            next_cursor = f"{rows[-1][0]}|{rows[-1][1]}" if has_more else None
+            return {"game_type": game_type, "state": state, "entries": entries, "next": next_cursor}
+
+        return _snapshot_response(request, await api_snapshots.get(("leaderboard", game_type, state, cursor), build))
+
+    origin = "/".join(MINI_APP_URL.split("/")[:3])
+    return Starlette(
+        routes=[
+            Route("/tournaments", authenticated(tournaments), methods=["GET"]),
+            Route("/profile/{oto_id}", authenticated(profile), methods=["GET"]),
+            Route("/leaderboard", authenticated(leaderboard), methods=["GET"]),
+        ],
+        middleware=[Middleware(
+            CORSMiddleware, allow_origins=[origin], allow_methods=["GET"],
+            allow_headers=["Authorization", "If-None-Match"], expose_headers=["ETag"], max_age=3600
+        )],
+    )
+
+async def serve_api(application: Application):
+    server = SidecarServer(uvicorn.Config(
+        Starlette(routes=[Mount("/api", build_api_app(application))]),
+        host=API_LISTEN, port=API_PORT, log_level="warning", lifespan="off"
+    ))
+    try:
+        await server.serve()
+    except (OSError, SystemExit):
+        logger.warning("Mini app API could not start on %s:%s", API_LISTEN, API_PORT)
+
+# ------------------- WEBHOOK SERVER -------------------
+def build_http_app(application: Application, secret_token):
+    """
+    Embedded ASGI app. The webhook route only authenticates and enqueues the
+    update, so Telegram gets its 200 immediately and handlers run afterwards.
+    """
+    async def telegram_webhook(request: Request):
+        received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(received.encode(), secret_token.encode()):
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception:
+            logger.warning("Rejected malformed webhook payload")
+            return Response(status_code=400)
+        await application.update_queue.put(update)
+        return Response()
+
+    async def healthz(request: Request):
+        return PlainTextResponse("ok")
+
+    routes = [
+        Route(WEBHOOK_PATH, telegram_webhook, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Mount("/api", build_api_app(application)),
+    ]
+    return Starlette(routes=routes)
+
+async def run_webhook(application: Application):
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+    secret_token = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = uvicorn.Server(uvicorn.Config(
+        build_http_app(application, secret_token),
+        host=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        log_level="warning",
+        # Telegram keeps connections open and sends in parallel up to max_connections
+        timeout_keep_alive=60,
+    ))
+    # Mirrors Application.run_webhook(), but serves through our own ASGI app
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        # Pending updates are kept by Telegram across restarts and delivered here
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=DROP_PENDING_UPDATES,
+        )
+        await application.start()
+        try:
+            await server.serve()
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
 # ------------------- MAIN -------------------
+def build_application(token=BOT_TOKEN, base_url=None):
+    """The fully wired Application; base_url points it at another Bot API server (e.g. bench.py's fake)."""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, flood_control, update_recorder))
+        .persistence(SQLitePersistence(STATE_DB_PATH, PERSISTENCE_INTERVAL, CONVERSATION_TIMEOUT))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    application.add_error_handler(error_handler)
+
+    # Core handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("profile", cmd_profile))
+
+    application.add_handler(CallbackQueryHandler(contact, pattern="^contact$"))
+    application.add_handler(CallbackQueryHandler(referral, pattern="^referral$"))
+    application.add_handler(CallbackQueryHandler(admin_panel, pattern="^admin_panel$"))
+    application.add_handler(CallbackQueryHandler(back_to_main, pattern="^back_to_main$"))
+    application.add_handler(CallbackQueryHandler(view_profile_callback, pattern="^view_profile$"))
+
+    # Leaderboards
+    application.add_handler(CommandHandler("leaderboard", cmd_leaderboard))
+    application.add_handler(CommandHandler("rank", cmd_rank))
+    application.add_handler(CommandHandler("result", cmd_result))
+    application.add_handler(CallbackQueryHandler(leaderboard_page, pattern="^lb\\|"))
+
+    # Brackets and lobbies (admin)
+    application.add_handler(CommandHandler("seed", cmd_seed))
+    application.add_handler(CommandHandler("bracket", cmd_bracket))
+    application.add_handler(CommandHandler("lobby_result", cmd_lobby_result))
+    application.add_handler(CallbackQueryHandler(knockout_result, pattern="^ko\\|"))
+
+    # Wallet
+    application.add_handler(CommandHandler("wallet", cmd_wallet))
+    application.add_handler(CommandHandler("credit", cmd_credit))
+    application.add_handler(CommandHandler("collect_fees", cmd_collect_fees))
+    application.add_handler(CommandHandler("award", cmd_award))
+
+    # Tournament registration
+    application.add_handler(CommandHandler("tournaments", browse_tournaments))
+    application.add_handler(CallbackQueryHandler(browse_tournaments, pattern="^(browse_tournaments$|pt\\|[np]\\|)"))
+    application.add_handler(CallbackQueryHandler(join_tournament_callback, pattern="^join_\\d+$"))
+    application.add_handler(CallbackQueryHandler(leave_tournament_callback, pattern="^leave_\\d+$"))
+
+    # Admin browsers
+    application.add_handler(CommandHandler("admin_tournaments", cmd_admin_tournaments))
+    application.add_handler(CommandHandler("admin_users", cmd_admin_users))
+    application.add_handler(CallbackQueryHandler(admin_view_tournaments, pattern="^admin_view_tournaments$"))
+    application.add_handler(CallbackQueryHandler(admin_delete_tournament, pattern="^admin_delete_tournament$"))
+    application.add_handler(CallbackQueryHandler(admin_view_users, pattern="^admin_view_users$"))
+    application.add_handler(CallbackQueryHandler(browser_page, pattern="^(tb|ub)\\|[np]\\|"))
+    application.add_handler(CallbackQueryHandler(confirm_delete_tournament, pattern="^tdel_(yes_)?\\d+$"))
+
+    # Admin search
+    application.add_handler(CommandHandler("search", cmd_search))
+    application.add_handler(InlineQueryHandler(inline_search))
+
+    # Bulk import / export (admin)
+    application.add_handler(CommandHandler("import_tournaments", admin_import_tournaments))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r"^/import_tournaments(@\w+)?\b"), admin_import_tournaments
+    ))
+    application.add_handler(CommandHandler("export", cmd_export))
+
+    # Broadcasts (admin)
+    application.add_handler(CommandHandler("broadcast", cmd_broadcast))
+    application.add_handler(CallbackQueryHandler(admin_announce_tournament, pattern="^admin_announce_\\d+$"))
+    application.add_handler(CallbackQueryHandler(broadcast_control, pattern="^bc_(pause|resume)_\\d+$"))
+
+    # Profile conversation
+    profile_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(create_profile_start, pattern="^create_profile$")],
+        states={
+            ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_game_id)],
+            ASK_GAME_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_level)],
+            ASK_LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_state)],
+            ASK_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_profile)]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        per_message=False,
+        name="profile_conversation",
+        persistent=True
+    )
+    application.add_handler(profile_conv_handler)
+
+    # Tournament creation conversation (admin)
+    tournament_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(admin_create_tournament_start, pattern="^admin_create_tournament$")],
+        states={
+            ADMIN_TOURNAMENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_game_type)],
+            ADMIN_GAME_TYPE: [CallbackQueryHandler(admin_handle_game_type, pattern="^game_")],
+            ADMIN_MAP: [CallbackQueryHandler(admin_handle_map, pattern="^map_")],
+            ADMIN_GAME_MODE: [CallbackQueryHandler(admin_handle_game_mode, pattern="^mode_")],
+            ADMIN_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_time)],
+            ADMIN_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_entry_fee)],
+            ADMIN_ENTRY_FEE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_prize)],
+            ADMIN_PRIZE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_save_tournament)]
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        per_message=False,
+        name="tournament_conversation",
+        persistent=True
+    )
+    application.add_handler(tournament_conv_handler)
+
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+    return application
+
 def main():
     try:
         init_db()
         logger.info("Starting OTO Tournament Bot...")
-        application = Application.builder().token(BOT_TOKEN).build()
-        application.add_error_handler(error_handler)
-
-        # Core handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("profile", cmd_profile))
-
-        application.add_handler(CallbackQueryHandler(contact, pattern="^contact$"))
-        application.add_handler(CallbackQueryHandler(referral, pattern="^referral$"))
-        application.add_handler(CallbackQueryHandler(admin_panel, pattern="^admin_panel$"))
-        application.add_handler(CallbackQueryHandler(back_to_main, pattern="^back_to_main$"))
-        application.add_handler(CallbackQueryHandler(view_profile_callback, pattern="^view_profile$"))
-
-        # Profile conversation
-        profile_conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(create_profile_start, pattern="^create_profile$")],
-            states={
-                ASK_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_game_id)],
-                ASK_GAME_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_level)],
-                ASK_LEVEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_state)],
-                ASK_STATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_profile)]
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-            per_message=True
-        )
-        application.add_handler(profile_conv_handler)
-
-        # Tournament creation conversation (admin)
-        tournament_conv_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(admin_create_tournament_start, pattern="^admin_create_tournament$")],
-            states={
-                ADMIN_TOURNAMENT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_game_type)],
-                ADMIN_GAME_TYPE: [CallbackQueryHandler(admin_handle_game_type, pattern="^game_")],
-                ADMIN_MAP: [CallbackQueryHandler(admin_handle_map, pattern="^map_")],
-                ADMIN_GAME_MODE: [CallbackQueryHandler(admin_handle_game_mode, pattern="^mode_")],
-                ADMIN_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_time)],
-                ADMIN_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_entry_fee)],
-                ADMIN_ENTRY_FEE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_ask_prize)],
-                ADMIN_PRIZE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_save_tournament)]
-            },
-            fallbacks=[CommandHandler("cancel", cancel)],
-            per_message=True
-        )
-        application.add_handler(tournament_conv_handler)
-
+        application = build_application()
         logger.info("🤖 Bot is starting...")
         print("🤖 OTO Tournament Bot is running!")
-        application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        if BOT_MODE == "webhook":
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=DROP_PENDING_UPDATES)
     except Exception as e:
         logger.exception("Critical error starting bot: %s", e)
         print(f"❌ Failed to start bot: {e}")
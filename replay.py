@@ -0,0 +1,347 @@
+"""
+Replay a recording of production updates through bot.py and profile each handler.
+
+Recordings come from the bot itself with RECORD_UPDATES_PATH set (see
+UpdateRecorder: ids are pseudonymized and free text is masked). The updates
+go to the Application from bot.build_application(), so the same handlers,
+conversations and persistence that main() runs, while bench.py's fake Bot API
+answers from a child process. Every handler callback is timed, and one of two
+profilers runs alongside:
+
+  sample    a thread samples the event loop's stack every --interval-ms and
+            writes stacks.folded ("handler;frame;...;frame count" per line) for
+            flamegraph.pl, inferno-flamegraph or speedscope
+  cprofile  <handler>.prof per handler and all.prof (pstats, for snakeviz,
+            gprof2dot or flameprof); needs back-to-back replay (--speed 0)
+
+    RECORD_UPDATES_PATH=updates.jsonl.gz python bot.py        # in production
+    python replay.py updates.jsonl.gz                        # back to back, sampled
+    python replay.py updates.jsonl.gz --speed 1              # recorded pace, updates overlap
+    python replay.py updates.jsonl.gz --profiler cprofile
+    python replay.py updates.jsonl.gz --db backups/data-20260101T000000.db
+    flamegraph.pl replay-out/stacks.folded > flame.svg
+
+--db replays against a copy of a backup, so tournaments, leaderboards and the
+other shared data are production-sized. Recorded players are pseudonyms, so
+they show up there as new users.
+"""
+import argparse
+import asyncio
+import cProfile
+import functools
+import gzip
+import importlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import uvicorn
+
+import bench
+
+bot = None  # imported in main() once the environment points it at a scratch database
+
+# ------------------- RECORDING -------------------
+def read_recording(path):
+    """(admin pseudonyms, [(timestamp, update dict)]) from a recording; one file may hold several runs."""
+    opener = gzip.open if path.endswith(".gz") else open
+    admins, entries = set(), []
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short when the bot was killed mid-flush
+                if "recording" in record:
+                    admins.update(record["recording"]["admins"])
+                else:
+                    entries.append((record["t"], record["update"]))
+        except EOFError:
+            pass  # truncated last gzip member
+    entries.sort(key=lambda entry: entry[0])
+    return sorted(admins), entries
+
+def schedule(entries, speed, max_gap):
+    """Seconds after the start at which each entry is due, with idle gaps capped at max_gap."""
+    offsets, elapsed = [], 0.0
+    for i, (t, _) in enumerate(entries):
+        if i:
+            elapsed += min(t - entries[i - 1][0], max_gap) / speed
+        offsets.append(elapsed)
+    return offsets
+
+# ------------------- PROFILERS -------------------
+class HandlerProfile:
+    """Times every handler callback and, in cprofile mode, profiles each handler separately."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.durations = defaultdict(list)
+        self.errors = Counter()
+        self.profiles = {}
+        self.codes = {}  # code object of each handler function -> handler name, for the sampler
+
+    def wrap(self, callback):
+        name = callback.__name__
+        self.codes[inspect.unwrap(callback).__code__] = name
+
+        @functools.wraps(callback)
+        async def profiled(update, context):
+            profile = None
+            if self.mode == "cprofile":
+                profile = self.profiles.setdefault(name, cProfile.Profile())
+                profile.enable()
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.errors[name] += 1
+                raise
+            finally:
+                self.durations[name].append(time.perf_counter() - started)
+                if profile is not None:
+                    profile.disable()
+        return profiled
+
+class StackSampler:
+    """
+    Samples the event loop thread's Python stack from a helper thread. Each
+    stack is rooted at the handler whose function is on it, "(idle)" when the
+    loop is waiting in select(), and "(other)" for everything else (background
+    tasks, PTB's own dispatching).
+    """
+
+    def __init__(self, interval, handler_codes):
+        self.interval = interval
+        self.handler_codes = handler_codes
+        self.stacks = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.stacks[self._fold(frame)] += 1
+
+    def _fold(self, frame):
+        code = frame.f_code
+        if code.co_name == "select" and code.co_filename.endswith("selectors.py"):
+            return "(idle)"
+        names, root = [], "(other)"
+        while frame is not None:
+            code = frame.f_code
+            root = self.handler_codes.get(code, root)
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.append(root)
+        return ";".join(reversed(names))
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+# ------------------- REPORT -------------------
+def summarize(args, profile, wall, updates):
+    handlers = {
+        name: {
+            "calls": len(values),
+            "errors": profile.errors[name],
+            "p50_ms": round(bench.percentile(values, 0.5) * 1000, 2),
+            "p95_ms": round(bench.percentile(values, 0.95) * 1000, 2),
+            "max_ms": round(max(values) * 1000, 2),
+            "total_ms": round(sum(values) * 1000, 1),
+        }
+        for name, values in sorted(profile.durations.items(), key=lambda item: sum(item[1]), reverse=True)
+    }
+    db_helpers = sorted(
+        ((helper, sum(counts), total) for helper, (counts, total) in bot.DB_SECONDS.snapshot().items()),
+        key=lambda item: item[2], reverse=True
+    )
+    return {
+        "config": {"recording": args.recording, "speed": args.speed, "profiler": args.profiler, "db": args.db},
+        "updates": updates,
+        "wall_seconds": round(wall, 3),
+        "updates_per_second": round(updates / wall, 1) if wall else 0.0,
+        "handlers": handlers,
+        "db_helpers": {
+            helper: {"calls": calls, "total_ms": round(total * 1000, 1), "mean_ms": round(total / calls * 1000, 3)}
+            for helper, calls, total in db_helpers[:10]
+        },
+    }
+
+def print_report(summary):
+    print(f"\n{summary['updates']} updates in {summary['wall_seconds']}s -> {summary['updates_per_second']} updates/s\n")
+    print(f"{'handler':<32}{'calls':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'total ms':>11}")
+    for name, stats in summary["handlers"].items():
+        print(f"{name:<32}{stats['calls']:>8}{stats['errors']:>8}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['max_ms']:>10}{stats['total_ms']:>11}")
+    print(f"\n{'db helper':<32}{'calls':>8}{'mean ms':>10}{'total ms':>10}")
+    for helper, stats in summary["db_helpers"].items():
+        print(f"{helper:<32}{stats['calls']:>8}{stats['mean_ms']:>10}{stats['total_ms']:>10}")
+
+def write_profiles(out, profile, sampler):
+    written = []
+    if sampler is not None:
+        sampler.write(os.path.join(out, "stacks.folded"))
+        written.append(f"stacks.folded ({sum(sampler.stacks.values())} samples)")
+    if profile.profiles:
+        for name, handler_profile in profile.profiles.items():
+            handler_profile.dump_stats(os.path.join(out, f"{name}.prof"))
+        profiles = list(profile.profiles.values())
+        combined = pstats.Stats(profiles[0])
+        for handler_profile in profiles[1:]:
+            combined.add(handler_profile)
+        combined.dump_stats(os.path.join(out, "all.prof"))
+        written.append(f"{len(profiles)} handler profiles and all.prof")
+    return written
+
+# ------------------- MAIN -------------------
+# As in bench.py, the fake API runs in a child process so its request handling
+# doesn't show up in the profiles.
+async def fake_api(port, latency, pipe):
+    api = bench.FakeBotAPI(latency, 0.5, 0.0, 1)
+    server = uvicorn.Server(uvicorn.Config(api.app(), host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    pipe.send("listening")
+    await asyncio.get_running_loop().run_in_executor(None, pipe.recv)  # replay finished
+    server.should_exit = True
+    await server_task
+
+def fake_api_process(port, latency, pipe):
+    asyncio.run(fake_api(port, latency, pipe))
+
+async def drain(application):
+    # task_done() comes early for updates queued behind another from the same user
+    await application.update_queue.join()
+    while application.update_processor.depth() != (0, 0):
+        await asyncio.sleep(0.01)
+
+async def run(args, entries, pipe):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, pipe.recv)  # fake API is listening
+    bot.init_db()
+    application = bot.build_application(bench.BOT_TOKEN, base_url=f"http://127.0.0.1:{args.port}/bot")
+    profile = HandlerProfile(args.profiler)
+    for handlers in application.handlers.values():
+        bot.instrument_handlers(handlers, profile.wrap)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    sampler = StackSampler(args.interval_ms / 1000, profile.codes) if args.profiler == "sample" else None
+    if sampler is not None:
+        sampler.start()
+    offsets = schedule(entries, args.speed, args.max_gap) if args.speed else None
+    started = time.perf_counter()
+    for i, (_, data) in enumerate(entries):
+        update = bot.Update.de_json(data, application.bot)
+        if offsets is None:
+            await application.process_update(update)
+            continue
+        delay = offsets[i] - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await application.update_queue.put(update)
+    if offsets is not None:
+        await drain(application)
+    wall = time.perf_counter() - started
+    if sampler is not None:
+        sampler.stop()
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    pipe.send("done")
+    return profile, sampler, wall
+
+def main():
+    global bot
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="file written by the bot with RECORD_UPDATES_PATH (.jsonl or .jsonl.gz)")
+    parser.add_argument("--profiler", choices=("sample", "cprofile", "none"), default="sample")
+    parser.add_argument("--interval-ms", type=float, default=1, help="stack sampling interval")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="0 replays back to back, one update at a time; N replays at N times the recorded pace")
+    parser.add_argument("--max-gap", type=float, default=5, help="longest pause (recorded seconds) kept between updates")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N updates")
+    parser.add_argument("--db", help="replay against a copy of this database (e.g. a backup) instead of an empty one")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every fake Bot API call")
+    parser.add_argument("--port", type=int, default=18082)
+    parser.add_argument("--out", default="replay-out", help="directory for the summary and profiles")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own logging")
+    args = parser.parse_args()
+    if args.profiler == "cprofile" and args.speed:
+        parser.error("--profiler cprofile needs --speed 0: one profiler can't follow overlapping handlers")
+
+    admins, entries = read_recording(args.recording)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        parser.error(f"no updates in {args.recording}")
+
+    scratch = tempfile.mkdtemp(prefix="oto-replay-")
+    db_path = os.path.join(scratch, "data.db")
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    os.environ.update({
+        "DB_PATH": db_path,
+        "STATE_DB_PATH": os.path.join(scratch, "state.db"),
+        "METRICS_PORT": "0",
+        "API_PORT": "0",
+        "BOT_MODE": "polling",
+        "MAINTENANCE_INTERVAL_HOURS": "0",
+        "RECORD_UPDATES_PATH": "",
+        # recorded updates already got past flood control once
+        "FLOOD_RATE": "0",
+        "FLOOD_GLOBAL_RATE": "0",
+        "FLOOD_DEDUP_SECONDS": "0",
+    })
+    if admins:
+        os.environ["ADMIN_IDS"] = ",".join(str(admin) for admin in admins)
+    bot = importlib.import_module("bot")
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    context = multiprocessing.get_context("spawn")
+    pipe, child_pipe = context.Pipe()
+    server = context.Process(target=fake_api_process, args=(args.port, args.latency_ms / 1000, child_pipe), daemon=True)
+    server.start()
+    profile, sampler, wall = asyncio.run(run(args, entries, pipe))
+    server.join()
+
+    os.makedirs(args.out, exist_ok=True)
+    summary = summarize(args, profile, wall, len(entries))
+    with open(os.path.join(args.out, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    written = write_profiles(args.out, profile, sampler)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+        print(f"\nWrote summary.json{''.join(', ' + item for item in written)} to {args.out}/")
+
+if __name__ == "__main__":
+    main()
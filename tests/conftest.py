@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A freshly migrated database that bot's helpers (DB_PATH, db_read/db_write) point at."""
+    path = str(tmp_path / "data.db")
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    bot.init_db()
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = bot._open_connection(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def make_user(conn):
+    def make(telegram_id, state="Goa", level=10):
+        return bot._create_user(conn, telegram_id, "Player", f"gid_{telegram_id}", level, state, "")
+    return make
+
+
+@pytest.fixture
+def make_tournament(conn):
+    def make(game_mode="Solo (1v1)", entry_fee=10, days_ahead=3):
+        return bot._save_tournament(conn, {
+            "name": "Cup", "game_type": "BGMI", "map": "Erangel", "game_mode": game_mode,
+            "date": (date.today() + timedelta(days=days_ahead)).isoformat(), "time": "18:00",
+            "entry_fee": entry_fee, "prize_pool": 100,
+        })
+    return make
+
+
+@pytest.fixture
+def deposit(conn):
+    def credit(user_id, amount):
+        bot._post_transaction(conn, f"deposit:{user_id}:{amount}", "deposit",
+                              [("house:deposits", -amount), (bot.user_account(user_id), amount)])
+    return credit
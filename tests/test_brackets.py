@@ -0,0 +1,14 @@
+import random
+
+import bot
+
+
+def test_form_teams_keeps_team_strengths_close():
+    rng = random.Random(7)
+    players = [(i, rng.randint(1, 100), rng.choice(bot.VALID_STATES)) for i in range(12000)]
+    for team_size in (2, 4):
+        teams, strengths = bot.form_teams(players, team_size)
+        assert sorted(i for team in teams for i in team) == list(range(len(players)))
+        full = [s for team, s in zip(teams, strengths) if len(team) == team_size]
+        mean = sum(full) / len(full)
+        assert max(full) - min(full) <= 0.35 * mean
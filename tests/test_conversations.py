@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+import bot
+
+
+def _conversation(application, name):
+    return next(
+        handler for group in application.handlers.values() for handler in group
+        if isinstance(handler, bot.ConversationHandler) and handler.name == name
+    )
+
+
+def test_abandoned_wizard_loses_only_its_fields(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "STATE_DB_PATH", str(tmp_path / "state.db"))
+    monkeypatch.setattr(bot, "CONVERSATION_TIMEOUT", 0.04)
+    application = bot.build_application("1:x")
+    persistence = application.persistence
+    profile = _conversation(application, "profile_conversation")
+
+    walked_away, typing = (42, 42), (43, 43)
+    for key in (walked_away, typing):
+        profile._conversations[key] = bot.ASK_LEVEL
+        application.user_data[key[-1]].update({"name": "Ravi", "game_id": "gid_1", "tournament_browser": {"page": 2}})
+    persistence.conversation_activity[("profile_conversation", walked_away)] = 0
+    persistence.conversation_activity[("profile_conversation", typing)] = time.time() + 60
+
+    async def evict_once():
+        task = asyncio.create_task(bot.evict_abandoned_conversations(application, persistence))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(evict_once())
+
+    assert walked_away not in profile._conversations
+    assert application.user_data[42] == {"tournament_browser": {"page": 2}}
+    assert profile._conversations[typing] == bot.ASK_LEVEL
+    assert application.user_data[43]["name"] == "Ravi"
+    assert ("profile_conversation", walked_away) not in persistence.conversation_activity
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+import bot
+
+TODAY = date.today().isoformat()
+
+
+def _balances(conn):
+    return dict(conn.execute("SELECT account, balance FROM balances"))
+
+
+def _post_or_rollback(conn, *args):
+    # what _run_write does around every helper: a refused post leaves nothing behind
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = bot._post_transaction(conn, *args)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return result
+
+
+def test_replayed_key_posts_once(conn, make_user):
+    user_id = make_user(1)[0]
+    legs = [("house:deposits", -40), (bot.user_account(user_id), 40)]
+    first = bot._post_transaction(conn, "deposit:1", "deposit", legs)
+    before = _balances(conn)
+    second = bot._post_transaction(conn, "deposit:1", "deposit", legs)
+    assert first[1] and not second[1]
+    assert second[0] == first[0]
+    assert _balances(conn) == before
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 40
+
+
+def test_funded_user_can_be_debited(conn, make_user, deposit):
+    user_id = make_user(1)[0]
+    deposit(user_id, 30)
+    bot._post_transaction(conn, "spend:1", "entry_fee", [(bot.user_account(user_id), -20), ("house:fees", 20)])
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 10
+
+
+def test_overdraft_is_refused(conn, make_user, deposit):
+    user_id = make_user(1)[0]
+    deposit(user_id, 5)
+    with pytest.raises(bot.InsufficientFunds):
+        _post_or_rollback(conn, "spend:1", "entry_fee", [(bot.user_account(user_id), -20), ("house:fees", 20)])
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 5
+
+
+def test_unbalanced_legs_are_refused(conn):
+    with pytest.raises(ValueError):
+        bot._post_transaction(conn, "bad", "deposit", [("house:deposits", -5), ("user:1", 4)])
+
+
+def test_fee_collection_is_idempotent_and_reports_short(conn, make_user, make_tournament, deposit):
+    tid = make_tournament(entry_fee=10)
+    paid, broke = make_user(1)[0], make_user(2)[0]
+    deposit(paid, 25)
+    for user_id in (paid, broke):
+        bot._join_tournament(conn, tid, user_id, TODAY)
+    assert bot._collect_entry_fees(conn, tid) == (1, [broke])
+    assert bot._collect_entry_fees(conn, tid) == (0, [broke])
+    assert bot._get_balance(conn, bot.user_account(paid)) == 15
+    assert bot._get_balance(conn, f"tournament:{tid}") == 10
+
+
+@pytest.mark.parametrize("status", ["completed", "archived"])
+def test_finished_tournaments_are_not_charged(conn, make_user, make_tournament, deposit, status):
+    tid = make_tournament(entry_fee=10)
+    user_id = make_user(1)[0]
+    deposit(user_id, 25)
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    conn.execute("UPDATE tournaments SET status=? WHERE id=?", (status, tid))
+    assert bot._collect_entry_fees(conn, tid) is None
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 25
+
+
+def test_prize_cannot_exceed_collected_pool(conn, make_user, make_tournament, deposit):
+    tid = make_tournament(entry_fee=10)
+    user_id = make_user(1)[0]
+    deposit(user_id, 10)
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    bot._collect_entry_fees(conn, tid)
+    legs = [(f"tournament:{tid}", -50), (bot.user_account(user_id), 50)]
+    with pytest.raises(bot.InsufficientFunds):
+        _post_or_rollback(conn, f"prize:{tid}:{user_id}", "prize", legs)
+    assert bot._get_balance(conn, f"tournament:{tid}") == 10
+    _post_or_rollback(conn, f"prize:{tid}:{user_id}", "prize",
+                          [(f"tournament:{tid}", -10), (bot.user_account(user_id), 10)])
+    assert bot._get_balance(conn, f"tournament:{tid}") == 0
+
+
+def test_refused_post_through_batcher_leaves_no_trace(db_path, make_user):
+    user_id = make_user(1)[0]
+
+    async def attempt():
+        try:
+            with pytest.raises(bot.InsufficientFunds):
+                await bot.post_transaction("spend:1", "entry_fee", [(bot.user_account(user_id), -5), ("house:fees", 5)])
+            # a second, valid post in the same key space still goes through
+            return await bot.post_transaction("spend:1", "entry_fee", [("house:deposits", -5), ("house:fees", 5)])
+        finally:
+            await bot.write_batcher.close()
+
+    txn_id, created = asyncio.run(attempt())
+    assert created
+    assert asyncio.run(bot.db_read(bot._get_balance, bot.user_account(user_id))) == 0
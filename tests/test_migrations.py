@@ -0,0 +1,143 @@
+import asyncio
+import sqlite3
+import time
+from datetime import date
+
+import pytest
+
+import bot
+
+# the two tables the bot created before it tracked PRAGMA user_version
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE,
+    oto_id TEXT UNIQUE,
+    name TEXT,
+    game_id TEXT,
+    level INTEGER,
+    state TEXT,
+    username TEXT,
+    created_at TEXT
+);
+CREATE TABLE tournaments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    game_type TEXT,
+    map TEXT,
+    game_mode TEXT,
+    date TEXT,
+    time TEXT,
+    entry_fee INTEGER,
+    prize_pool INTEGER,
+    created_at TEXT
+);
+INSERT INTO users (telegram_id, oto_id, name, game_id, level, state, username, created_at)
+    VALUES (42, 'OTO1', 'Ravi Kumar', 'gid_42', 30, 'Goa', 'ravi', '2024-01-01T00:00:00');
+INSERT INTO tournaments (name, game_type, map, game_mode, date, time, entry_fee, prize_pool, created_at)
+    VALUES ('Old Cup', 'BGMI', 'Erangel', 'Squad (4v4)', '2024-02-01', '18:00', 0, 500, '2024-01-01T00:00:00');
+"""
+
+
+def _pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def test_fresh_database_is_migrated_with_incremental_vacuum(conn):
+    assert _pragma(conn, "user_version") == bot.MIGRATIONS[-1][0]
+    assert _pragma(conn, "auto_vacuum") == 2
+    assert _pragma(conn, "journal_mode") == "wal"
+    assert {"users", "tournaments", "registrations", "balances", "match_results", "bracket_matches"} <= _tables(conn)
+
+
+def test_current_database_is_left_alone(db_path, conn):
+    before = conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall()
+    bot.init_db()
+    assert conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall() == before
+
+
+def test_legacy_database_is_upgraded_in_place(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    legacy = sqlite3.connect(path)
+    legacy.executescript(LEGACY_SCHEMA)
+    legacy.close()
+    monkeypatch.setattr(bot, "DB_PATH", path)
+
+    bot.init_db()
+
+    conn = bot._open_connection(path)
+    try:
+        assert _pragma(conn, "user_version") == bot.MIGRATIONS[-1][0]
+        user = conn.execute("SELECT id, name, oto_id FROM users WHERE telegram_id=42").fetchone()
+        assert user[1:] == ("Ravi Kumar", "OTO1")
+        # later migrations backfill seats and the schedule on rows that predate them
+        name, status, starts_at, capacity = conn.execute(
+            "SELECT name, status, starts_at, capacity FROM tournaments"
+        ).fetchone()
+        assert (name, status, capacity) == ("Old Cup", "upcoming", bot.GAME_MODE_CAPACITY["Squad (4v4)"])
+        assert starts_at is not None
+        # old rows are searchable once the background rebuild has run
+        for table in bot._pending_fts(conn):
+            bot._rebuild_fts(conn, table)
+        assert conn.execute("SELECT rowid FROM users_fts WHERE users_fts MATCH 'ravi'").fetchall() == [(user[0],)]
+    finally:
+        conn.close()
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "data.db")
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    monkeypatch.setattr(bot, "MIGRATIONS", bot.MIGRATIONS[:2] + [(3, "broken", ["CREATE TABLE nope (", ])])
+    with pytest.raises(sqlite3.OperationalError):
+        bot.init_db()
+    conn = sqlite3.connect(path)
+    try:
+        assert _pragma(conn, "user_version") == 0
+        assert "users" not in _tables(conn)
+    finally:
+        conn.close()
+
+
+def test_archive_moves_finished_tournaments(conn, make_user, make_tournament, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "ARCHIVE_DB_PATH", str(tmp_path / "archive.db"))
+    user_id = make_user(1)[0]
+    old, current = make_tournament(), make_tournament()
+    bot._join_tournament(conn, old, user_id, date.today().isoformat())
+    conn.execute(
+        "INSERT INTO match_results (tournament_id, user_id, placement, kills, points, created_at) VALUES (?, ?, 1, 3, 20, 'x')",
+        (old, user_id)
+    )
+    conn.execute("UPDATE tournaments SET status='completed', starts_at=0 WHERE id=?", (old,))
+
+    async def run_batch():
+        # on the writer thread, as run_maintenance does
+        return await asyncio.get_running_loop().run_in_executor(
+            bot._db_write_executor, bot._run_archive_batch, time.time(), 10, time.perf_counter()
+        )
+
+    def archive():
+        return asyncio.run(run_batch())
+
+    # a batch copied by an earlier run that died before deleting it
+    conn.execute("ATTACH DATABASE ? AS archive", (bot.ARCHIVE_DB_PATH,))
+    for sql in bot.ARCHIVE_SCHEMA:
+        conn.execute(sql)
+    conn.execute("INSERT INTO archive.tournaments (id, name) SELECT id, name FROM main.tournaments WHERE id=?", (old,))
+    conn.execute("DETACH DATABASE archive")
+
+    assert archive() == 1
+    assert archive() == 0
+    assert [row[0] for row in conn.execute("SELECT id FROM tournaments")] == [current]
+    assert conn.execute("SELECT COUNT(*) FROM registrations").fetchone()[0] == 0
+
+    archived = sqlite3.connect(bot.ARCHIVE_DB_PATH)
+    try:
+        assert archived.execute("SELECT id FROM tournaments").fetchall() == [(old,)]
+        assert archived.execute("SELECT tournament_id, user_id FROM registrations").fetchall() == [(old, user_id)]
+        assert archived.execute("SELECT points FROM match_results").fetchall() == [(20,)]
+    finally:
+        archived.close()
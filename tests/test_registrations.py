@@ -0,0 +1,95 @@
+import asyncio
+from datetime import date
+
+import bot
+
+TODAY = date.today().isoformat()
+
+
+def _statuses(conn, tournament_id):
+    return dict(conn.execute(
+        "SELECT status, COUNT(*) FROM registrations WHERE tournament_id=? GROUP BY status", (tournament_id,)
+    ).fetchall())
+
+
+def test_burst_of_joins_never_overbooks(conn, make_user, make_tournament):
+    tid = make_tournament()  # Solo: 50 seats
+    user_ids = [make_user(1000 + i)[0] for i in range(80)]
+
+    async def burst():
+        try:
+            return await asyncio.gather(*(bot.join_tournament(tid, uid) for uid in user_ids))
+        finally:
+            await bot.write_batcher.close()
+
+    outcomes = asyncio.run(burst())
+    assert sorted(pos for status, pos in outcomes if status == "confirmed") == list(range(1, 51))
+    assert sorted(pos for status, pos in outcomes if status == "waitlist") == list(range(1, 31))
+    assert _statuses(conn, tid) == {"confirmed": 50, "waitlist": 30}
+    assert conn.execute("SELECT seats_taken FROM tournaments WHERE id=?", (tid,)).fetchone()[0] == 50
+
+
+def test_leave_promotes_the_first_waitlisted_player(conn, make_user, make_tournament):
+    tid = make_tournament()
+    users = [make_user(1000 + i) for i in range(52)]
+    for user in users:
+        bot._join_tournament(conn, tid, user[0], TODAY)
+
+    status, promoted, refunded = bot._leave_tournament(conn, tid, users[0][0])
+    assert (status, promoted, refunded) == ("confirmed", users[50][1], 0)
+    assert _statuses(conn, tid) == {"confirmed": 50, "waitlist": 1}
+    assert conn.execute("SELECT seats_taken FROM tournaments WHERE id=?", (tid,)).fetchone()[0] == 50
+
+    # a waitlisted player leaving frees nothing
+    assert bot._leave_tournament(conn, tid, users[51][0]) == ("waitlist", None, 0)
+    assert bot._leave_tournament(conn, tid, users[51][0]) == (None, None, 0)
+
+
+def test_leaving_a_started_tournament_is_refused(conn, make_user, make_tournament):
+    tid = make_tournament()
+    user_id = make_user(1000)[0]
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    conn.execute("UPDATE tournaments SET status='live' WHERE id=?", (tid,))
+    assert bot._leave_tournament(conn, tid, user_id) == ("closed", None, 0)
+    assert _statuses(conn, tid) == {"confirmed": 1}
+
+
+def test_rejoining_after_a_refund_pays_again(conn, make_user, make_tournament, deposit):
+    tid = make_tournament(entry_fee=10)
+    user_id = make_user(1000)[0]
+    deposit(user_id, 50)
+
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    assert bot._collect_entry_fees(conn, tid) == (1, [])
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 40
+
+    assert bot._leave_tournament(conn, tid, user_id) == ("confirmed", None, 10)
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 50
+
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    assert bot._collect_entry_fees(conn, tid) == (1, [])
+    assert bot._collect_entry_fees(conn, tid) == (0, [])
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 40
+    assert bot._get_balance(conn, f"tournament:{tid}") == 10
+
+
+def test_fees_collected_under_per_user_keys_still_count(conn, make_user, make_tournament, deposit):
+    tid = make_tournament(entry_fee=10)
+    user_id = make_user(1000)[0]
+    deposit(user_id, 50)
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    # as _collect_entry_fees wrote it before fees were keyed per registration
+    txn_id = conn.execute(
+        "INSERT INTO ledger_transactions (idempotency_key, kind, reference, created_at) VALUES (?, 'entry_fee', ?, '')",
+        (f"fee:{tid}:{user_id}", f"tournament:{tid}")
+    ).lastrowid
+    conn.executemany("INSERT INTO ledger_entries (txn_id, account, amount) VALUES (?, ?, ?)",
+                     [(txn_id, bot.user_account(user_id), -10), (txn_id, f"tournament:{tid}", 10)])
+    conn.execute("UPDATE balances SET balance = balance - 10 WHERE account=?", (bot.user_account(user_id),))
+    conn.execute("INSERT INTO balances (account, balance) VALUES (?, 10)", (f"tournament:{tid}",))
+
+    assert bot._collect_entry_fees(conn, tid) == (0, [])
+    assert bot._leave_tournament(conn, tid, user_id) == ("confirmed", None, 10)
+    bot._join_tournament(conn, tid, user_id, TODAY)
+    assert bot._collect_entry_fees(conn, tid) == (1, [])
+    assert bot._get_balance(conn, bot.user_account(user_id)) == 40
@@ -0,0 +1,61 @@
+import asyncio
+
+from telegram import Bot, Update
+
+import bot
+
+
+def _update(user_id, update_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "x",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "a"},
+        },
+    }, Bot("1:x"))
+
+
+def test_one_users_updates_run_in_arrival_order_on_one_slot():
+    processor = bot.PerUserUpdateProcessor(2)
+    order = []
+
+    async def handle(tag, delay):
+        await asyncio.sleep(delay)
+        order.append(tag)
+
+    async def main():
+        # later updates finish faster, so any overlap would reorder them
+        await asyncio.gather(
+            *(processor.process_update(_update(1, n), handle(f"u1-{n}", 0.03 - n * 0.01)) for n in range(3)),
+            processor.process_update(_update(2, 9), handle("u2", 0)),
+        )
+
+    asyncio.run(main())
+    assert [tag for tag in order if tag.startswith("u1")] == ["u1-0", "u1-1", "u1-2"]
+    # user 2 took the second slot instead of waiting behind user 1
+    assert order.index("u2") < order.index("u1-0")
+    assert processor.depth() == (0, 0)
+
+
+def test_flooded_updates_are_dropped_without_waiting_for_a_slot():
+    flood_control = bot.FloodControl(1, 1, 0, 0, 0, 100)
+    processor = bot.PerUserUpdateProcessor(1, flood_control)
+    order = []
+    gate = asyncio.Event()
+
+    async def handle(tag, wait=False):
+        if wait:
+            await gate.wait()
+        order.append(tag)
+
+    async def main():
+        first = asyncio.create_task(processor.process_update(_update(1, 1), handle("first", wait=True)))
+        await asyncio.sleep(0)
+        # the only slot is held, yet the over-limit update returns at once
+        await asyncio.wait_for(processor.process_update(_update(1, 2), handle("flooded")), 0.1)
+        gate.set()
+        await first
+
+    asyncio.run(main())
+    assert order == ["first"]